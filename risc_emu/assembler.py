@@ -0,0 +1,154 @@
+"""
+This is a two-pass assembler / linker for the risc machine.
+
+The program is collected with the same calls as on the machine (addLabel, storeAssembly), but nothing is
+encoded until assemble() is called:
+    pass 1: every label gets its offset from the start of the program, so labels can be used before
+            they are defined (forward branches / calls)
+    pass 2: all instructions are encoded at once with numpy integer operations (one call per format)
+
+The result is a program_image: the encoded words plus the symbol table, relative to the start of the
+program. Branches and JAL are pc-relative, so the image can be loaded at any base address.
+Images are cached by a hash of the program, assembling the same program again returns the cached image.
+"""
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from machine import ASM_FIELDS, encode
+
+# images of the most recently assembled programs: hash -> program_image
+image_cache = OrderedDict()
+IMAGE_CACHE_SIZE = 128
+
+
+class program_image:
+    def __init__(self, words, symbols, source_hash):
+        """
+        words:          encoded instructions (np.uint32 array)
+        symbols:        {label: offset from the start of the image}
+        source_hash:    hash of the program the image was assembled from
+        """
+        self.words          = words
+        self.symbols        = symbols
+        self.source_hash    = source_hash
+
+    def size(self):
+        """
+        size of the image in bytes
+        """
+        return 4 * len(self.words)
+
+    def entry(self, label='start'):
+        """
+        offset of the entry label from the start of the image
+        """
+        return self.symbols[label]
+
+    def load(self, m, base=0):
+        """
+        copy the image into the memory of machine m at address base (one slice copy) and add its labels
+        to m.label_dictionary, relocated to base. m.pc is left after the image, like storeAssembly does
+        """
+        end = base + self.size()
+        if m.paged:
+            m.memory.write(base, self.words.astype('<u4').tobytes())
+        else:
+            memoryview(m.memory)[base:end] = self.words.astype('<u4').tobytes()
+        m.flush_decode()
+        for label, offset in self.symbols.items():
+            m.label_dictionary[label] = base + offset
+        m.pc = end
+        return end
+
+
+class assembler:
+    def __init__(self):
+        """
+        Create an empty program
+        """
+        # ('label', name) or (instruction, arg1, arg2, arg3) in program order
+        self.statements = []
+
+    def addLabel(self, label):
+        """
+        add a label at the current position of the program
+        """
+        self.statements.append(('label', label))
+
+    def storeAssembly(self, instruction, arg1=0, arg2=0, arg3=0, arg4=0):
+        """
+        add an instruction to the program (same arguments as machine.storeAssembly,
+        but branch / JAL targets may be labels that are defined later)
+        """
+        if instruction not in ASM_FIELDS:
+            raise ValueError("instruction not supported: " + str(instruction))
+        self.statements.append((instruction, arg1, arg2, arg3))
+
+    def hash(self):
+        """
+        hash of the program, used as key of the image cache
+        """
+        return hashlib.sha256(repr(self.statements).encode()).hexdigest()
+
+    def assemble(self, cache=True):
+        """
+        resolve all labels and encode the program into a program_image
+        """
+        key = self.hash()
+        if cache and key in image_cache:
+            image_cache.move_to_end(key)
+            return image_cache[key]
+
+        # pass 1: symbol table
+        symbols = {}
+        instructions = []
+        for statement in self.statements:
+            if statement[0] == 'label':
+                symbols[statement[1]] = 4 * len(instructions)
+            else:
+                instructions.append(statement)
+
+        # pass 2: resolve the arguments (as storeAssembly does) and encode every format in bulk
+        n = len(instructions)
+        args = np.zeros((n, 3), dtype=np.int64)
+        fields = np.zeros((n, 3), dtype=np.int64)
+        types = []
+        for i, (instruction, arg1, arg2, arg3) in enumerate(instructions):
+            typ, funct7, funct3, opcode = ASM_FIELDS[instruction]
+            if instruction == 'LW':
+                arg2, arg3 = arg3, arg2
+            if typ == 'B':
+                arg3 = self.resolve(symbols, arg3) - 4 * i
+            if instruction == 'JAL':
+                arg2 = self.resolve(symbols, arg2) - 4 * i
+            args[i] = (arg1, arg2, arg3)
+            fields[i] = (funct7, funct3, opcode)
+            types.append(typ)
+
+        words = np.zeros(n, dtype=np.int64)
+        types = np.array(types)
+        for typ in ['R', 'I', 'S', 'B', 'J', 'N']:
+            rows = types == typ
+            if rows.any():
+                f, a = fields[rows], args[rows]
+                words[rows] = encode(typ, f[:, 0], f[:, 1], f[:, 2], a[:, 0], a[:, 1], a[:, 2])
+
+        image = program_image(words.astype(np.uint32), symbols, key)
+        if cache:
+            image_cache[key] = image
+            if len(image_cache) > IMAGE_CACHE_SIZE:
+                image_cache.popitem(last=False)
+        return image
+
+    def resolve(self, symbols, target):
+        """
+        offset of a branch / jump target: a label, or a number (offset from the start of the image)
+        """
+        if isinstance(target, str):
+            if target not in symbols:
+                raise KeyError("undefined label: " + target)
+            return symbols[target]
+        return target
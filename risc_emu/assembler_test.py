@@ -0,0 +1,81 @@
+"""
+This is a test for the two-pass assembler: forward labels, relocation and the image cache
+"""
+
+import numpy as np
+from machine import machine
+from assembler import assembler, image_cache
+
+ra, sp, t0, t2, s0, a0 = 1, 2, 5, 7, 8, 10
+
+#-------------------------------------------------------------------------------
+# fibonacci written top-down: start calls fibonacci, which branches to BaseCase, all defined later
+#-------------------------------------------------------------------------------
+def fibonacci(n):
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', a0, 0, n)
+    a.storeAssembly('ADDi', s0, 0, 1)
+    a.storeAssembly('JAL', ra, 'fibonacci')
+    a.addLabel('end')
+    a.storeAssembly('ADD', t2, 0, a0)
+
+    a.addLabel('fibonacci')
+    a.storeAssembly('BEQ', s0, a0, 'BaseCase')
+    a.storeAssembly('BLT', a0, s0, 'BaseCase')
+    a.storeAssembly('ADDi', sp, sp, -12)
+    a.storeAssembly('SW', ra, 8, sp)
+    a.storeAssembly('SW', a0, 4, sp)
+    a.storeAssembly('ADDi', a0, a0, -1)
+    a.storeAssembly('JAL', ra, 'fibonacci')
+    a.storeAssembly('SW', a0, 0, sp)
+    a.storeAssembly('LW', a0, 4, sp)
+    a.storeAssembly('ADDi', a0, a0, -2)
+    a.storeAssembly('JAL', ra, 'fibonacci')
+    a.storeAssembly('LW', t0, 0, sp)
+    a.storeAssembly('ADD', a0, a0, t0)
+    a.storeAssembly('LW', ra, 8, sp)
+    a.storeAssembly('ADDi', sp, sp, 12)
+    a.storeAssembly('JALR', ra, ra, 0)
+
+    a.addLabel('BaseCase')
+    a.storeAssembly('JALR', ra, ra, 0)
+    return a
+
+#-------------------------------------------------------------------------------
+# Test 1: forward labels, image loaded at different base addresses
+#-------------------------------------------------------------------------------
+image = fibonacci(10).assemble()
+for base in [0, 4000, 1236]:
+    m = machine(mem_size=8000)
+    image.load(m, base)
+    m.registers[sp] = 8000
+    m.execute('start', 'end')
+    assert(m.registers[a0] == 55 and m.label_dictionary['start'] == base)
+print("Test 1: Fibonacci of 10 = " + str(m.registers[a0]) + " at base 0, 4000 and 1236")
+
+#-------------------------------------------------------------------------------
+# Test 2: same encoding as storeAssembly for a program without forward labels
+#-------------------------------------------------------------------------------
+program = [('label', 'loop'), ('ADDi', a0, a0, -1), ('SW', a0, -4, sp), ('LW', t0, -4, sp), ('MUL', t2, t0, a0),
+           ('BNE', a0, 0, 'loop'), ('JAL', ra, 'loop'), ('JALR', 0, ra, 8)]
+a = assembler()
+m = machine(mem_size=1000)
+m.pc = 100
+for statement in program:
+    if statement[0] == 'label':
+        a.addLabel(statement[1])
+        m.addLabel(statement[1])
+    else:
+        a.storeAssembly(*statement)
+        m.storeAssembly(*statement)
+image = a.assemble()
+assert(bytes(m.memory[100:100 + image.size()]) == image.words.astype('<u4').tobytes())
+print("Test 2: " + str(len(image.words)) + " words identical to storeAssembly")
+
+#-------------------------------------------------------------------------------
+# Test 3: assembling the same program again hits the image cache
+#-------------------------------------------------------------------------------
+assert(fibonacci(10).assemble() is fibonacci(10).assemble())
+assert(fibonacci(11).assemble() is not fibonacci(10).assemble())
+print("Test 3: image cache holds " + str(len(image_cache)) + " images")
@@ -0,0 +1,91 @@
+"""
+This is a benchmark of the state backends (numpy vs native):
+- cost of single instructions called directly
+- cost per instruction when running the fibonacci program with each execution engine
+
+usage: python backend_benchmark.py [n]
+"""
+
+import sys
+import time
+import timeit
+
+from machine import machine
+
+ra, sp, t0, s0, a0, t6 = 1, 2, 5, 8, 10, 31
+
+def fibonacci(n, backend):
+    m = machine(mem_size=8000, backend=backend)
+    m.pc = 4000
+    m.addLabel('BaseCase')
+    m.storeAssembly('JALR', ra, ra, 0)
+    m.addLabel('fibonacci')
+    m.storeAssembly('BEQ', s0, a0, 'BaseCase')
+    m.storeAssembly('BLT', a0, s0, 'BaseCase')
+    m.storeAssembly('ADDi', sp, sp, -12)
+    m.storeAssembly('SW', ra, 8, sp)
+    m.storeAssembly('SW', a0, 4, sp)
+    m.storeAssembly('ADDi', a0, a0, -1)
+    m.storeAssembly('JAL', ra, 'fibonacci')
+    m.storeAssembly('SW', a0, 0, sp)
+    m.storeAssembly('LW', a0, 4, sp)
+    m.storeAssembly('ADDi', a0, a0, -2)
+    m.storeAssembly('JAL', ra, 'fibonacci')
+    m.storeAssembly('LW', t0, 0, sp)
+    m.storeAssembly('ADD', a0, a0, t0)
+    m.storeAssembly('LW', ra, 8, sp)
+    m.storeAssembly('ADDi', sp, sp, 12)
+    m.storeAssembly('JALR', ra, ra, 0)
+    m.addLabel('start')
+    m.storeAssembly('ADDi', a0, 0, n)
+    m.storeAssembly('ADDi', s0, 0, 1)
+    m.storeAssembly('JAL', ra, 'fibonacci')
+    m.addLabel('end')
+    m.storeAssembly('ADD', t6, 0, a0)
+    m.registers[sp] = 8000
+    return m
+
+def instruction_costs(backend, number=100000):
+    """
+    ns per call for a few instructions called directly on the machine
+    """
+    m = machine(mem_size=1000, backend=backend)
+    m.registers[5] = 3
+    m.registers[6] = 4
+    m.registers[2] = 100
+    costs = {}
+    for name, stmt in [('ADD', 'm.ADD(7, 6, 5)'), ('ADDi', 'm.ADDi(7, 6, 5)'), ('LW', 'm.LW(7, 0, 2)'),
+                       ('SW', 'm.SW(7, 0, 2)'), ('BEQ', 'm.BEQ(5, 6, 8)')]:
+        m.pc = 0
+        costs[name] = timeit.timeit(stmt, globals={'m': m}, number=number) / number * 1e9
+    return costs
+
+def program_cost(backend, engine, n):
+    """
+    ns per executed instruction for fibonacci(n)
+    """
+    m = fibonacci(n, backend)
+    m.debug = True
+    m.execute('start', 'end', engine=engine)  # count instructions (and warm up the caches)
+    count = m.total_number_of_instructions
+
+    m = fibonacci(n, backend)
+    t = time.perf_counter()
+    m.execute('start', 'end', engine=engine)
+    return (time.perf_counter() - t) / count * 1e9
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 18
+
+    costs = {backend: instruction_costs(backend) for backend in ['numpy', 'native']}
+    print("instruction      numpy     native    saved")
+    for name in costs['numpy']:
+        numpy_ns, native_ns = costs['numpy'][name], costs['native'][name]
+        print("%-10s %8.0f ns %8.0f ns %7.0f%%" % (name, numpy_ns, native_ns, 100 * (1 - native_ns / numpy_ns)))
+
+    print("")
+    print("fibonacci(%d)     numpy     native    saved" % n)
+    for engine in ['interpreter', 'block']:
+        numpy_ns, native_ns = program_cost('numpy', engine, n), program_cost('native', engine, n)
+        print("%-12s %6.0f ns %8.0f ns %7.0f%%" % (engine, numpy_ns, native_ns, 100 * (1 - native_ns / numpy_ns)))
@@ -0,0 +1,43 @@
+"""
+This is a test for the state backends: the 'native' backend (python int registers, bytearray memory)
+has to give the same results as the default 'numpy' backend
+"""
+
+from machine import machine
+from backend_benchmark import fibonacci
+
+#-------------------------------------------------------------------------------
+# Test 1: instructions on the native backend
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1000, backend='native')
+assert(isinstance(m.registers, list) and isinstance(m.memory, bytearray))
+
+m.registers[5] = 0x7FFFFFFF
+m.registers[6] = 1
+m.ADD(7, 6, 5)                  # wraps around like an int32 register
+print("Test 1: 0x7FFFFFFF + 1 = " + str(m.registers[7]))
+assert(m.registers[7] == -2**31)
+
+m.registers[4] = 500
+m.SW(7, 0, 4)
+m.LW(8, 0, 4)
+assert(m.registers[8] == -2**31 and m.memory[503] == 0x80)
+
+m.MUL(9, 5, 5)
+assert(m.registers[9] == 1)     # (2^31 - 1)^2 mod 2^32
+
+m.JALR(1, 4, 3)
+assert(m.pc == 502 and type(m.pc) is int)
+
+#-------------------------------------------------------------------------------
+# Test 2: fibonacci on both backends and engines
+#-------------------------------------------------------------------------------
+results = []
+for backend in ['numpy', 'native']:
+    for engine in ['interpreter', 'block']:
+        m = fibonacci(10, backend)
+        m.execute('start', 'end', engine=engine)
+        results.append(([int(r) for r in m.registers], bytes(m.memory), m.pc))
+print("Test 2: Fibonacci of 10 = " + str(results[-1][0][10]))
+assert(results[0][0][10] == 55)
+assert(all(result == results[0] for result in results))
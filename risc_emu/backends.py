@@ -0,0 +1,79 @@
+"""
+State backends for the risc machine: they decide how the register file and the memory are stored.
+
+numpy:  registers = np.int32 array, memory = np.uint8 array (default, easy to inspect / vectorize)
+native: registers = list of python ints, memory = bytearray (no numpy scalar boxing per instruction)
+paged:  registers = list of python ints, memory = paged_memory (sparse 4 KiB pages, see paged_memory.py)
+
+The numpy and native memories expose the buffer protocol, so words are loaded / stored with struct in
+either case. A paged memory has no flat buffer, the machine goes through its read_i32 / write_i32 instead
+(backend.paged is set).
+Register values are always kept as signed 32-bit values (see machine.wrap32).
+"""
+
+import numpy as np
+
+from paged_memory import paged_memory
+
+
+class numpy_backend:
+    name = 'numpy'
+    paged = False
+
+    def registers(self):
+        """
+        32 general purpose registers of type int32
+        """
+        return np.zeros(32, dtype=np.int32)
+
+    def memory(self, mem_size):
+        """
+        mem_size bytes of memory of type uint8
+        """
+        return np.zeros(mem_size, dtype=np.uint8)
+
+
+class native_backend:
+    name = 'native'
+    paged = False
+
+    def registers(self):
+        """
+        32 general purpose registers as python ints
+        """
+        return [0] * 32
+
+    def memory(self, mem_size):
+        """
+        mem_size bytes of memory as a bytearray
+        """
+        return bytearray(mem_size)
+
+
+class paged_backend:
+    name = 'paged'
+    paged = True
+
+    def registers(self):
+        """
+        32 general purpose registers as python ints
+        """
+        return [0] * 32
+
+    def memory(self, mem_size):
+        """
+        sparse address space of mem_size bytes, pages are allocated on first write
+        """
+        return paged_memory(mem_size)
+
+
+backends = {'numpy': numpy_backend(), 'native': native_backend(), 'paged': paged_backend()}
+
+
+def get_backend(backend):
+    """
+    look up a backend by name, or pass a backend object through
+    """
+    if isinstance(backend, str):
+        return backends[backend]
+    return backend
@@ -0,0 +1,179 @@
+"""
+This is a lane-parallel version of the risc machine: N independent copies (lanes) of one program
+run side by side, registers have shape (N, 32) and memory has shape (N, mem_size).
+
+Every step the active lanes are grouped by their pc and each instruction is executed once per group
+with vectorized numpy operations over all lanes of that group, so lanes whose branches diverge keep
+running correctly (they simply end up in different groups).
+
+The code is decoded once from the template machine (the program has to be stored in it already).
+All lanes share that decoded code, stores into the code area are not re-decoded.
+"""
+
+import numpy as np
+
+
+class batch_machine:
+    def __init__(self, m, lanes):
+        """
+        Create 'lanes' copies of the state of machine m (registers + memory, including the program)
+        """
+        self.m          = m
+        self.lanes      = lanes
+
+        self.registers  = np.tile(np.asarray(m.registers, dtype=np.int32), (lanes, 1))
+        self.memory     = np.tile(np.frombuffer(bytes(m.memory), dtype=np.uint8), (lanes, 1))
+        self.pc         = np.full(lanes, int(m.pc), dtype=np.int64)
+
+        # number of instructions executed by every lane
+        self.instruction_count = np.zeros(lanes, dtype=np.int64)
+
+        # pc -> (vectorized instruction, operands)
+        self.decode_cache = {}
+
+        # byte offsets of a word, used to gather / scatter 4 bytes per lane
+        self.word = np.arange(4)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Vectorized Instructions (lanes = indices of the lanes executing the instruction)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def ADD(self, lanes, rd, rs1, rs2):
+        if rd: self.registers[lanes, rd] = self.registers[lanes, rs1] + self.registers[lanes, rs2]
+        self.pc[lanes] += 4
+
+    def SUB(self, lanes, rd, rs1, rs2):
+        if rd: self.registers[lanes, rd] = self.registers[lanes, rs1] - self.registers[lanes, rs2]
+        self.pc[lanes] += 4
+
+    def MUL(self, lanes, rd, rs1, rs2):
+        if rd: self.registers[lanes, rd] = self.registers[lanes, rs1] * self.registers[lanes, rs2]
+        self.pc[lanes] += 4
+
+    def XOR(self, lanes, rd, rs1, rs2):
+        if rd: self.registers[lanes, rd] = self.registers[lanes, rs1] ^ self.registers[lanes, rs2]
+        self.pc[lanes] += 4
+
+    def OR(self, lanes, rd, rs1, rs2):
+        if rd: self.registers[lanes, rd] = self.registers[lanes, rs1] | self.registers[lanes, rs2]
+        self.pc[lanes] += 4
+
+    def AND(self, lanes, rd, rs1, rs2):
+        if rd: self.registers[lanes, rd] = self.registers[lanes, rs1] & self.registers[lanes, rs2]
+        self.pc[lanes] += 4
+
+    def ADDi(self, lanes, rd, rs1, imm):
+        if rd: self.registers[lanes, rd] = self.registers[lanes, rs1] + np.int32(imm)
+        self.pc[lanes] += 4
+
+    def LW(self, lanes, rd, imm, rs1):
+        """
+        gather 4 bytes per lane and reinterpret them as little-endian int32
+        """
+        addr = self.registers[lanes, rs1].astype(np.int64) + imm
+        data = self.memory[lanes[:, None], addr[:, None] + self.word]
+        if rd: self.registers[lanes, rd] = np.ascontiguousarray(data).view('<i4')[:, 0]
+        self.pc[lanes] += 4
+
+    def SW(self, lanes, rs2, imm, rs1):
+        """
+        scatter the 4 bytes of every lane's rs2 into that lane's memory
+        """
+        addr = self.registers[lanes, rs1].astype(np.int64) + imm
+        data = self.registers[lanes, rs2].astype('<i4').view(np.uint8).reshape(-1, 4)
+        self.memory[lanes[:, None], addr[:, None] + self.word] = data
+        self.pc[lanes] += 4
+
+    def BEQ(self, lanes, rs1, rs2, imm):
+        self.branch(lanes, self.registers[lanes, rs1] == self.registers[lanes, rs2], imm)
+
+    def BNE(self, lanes, rs1, rs2, imm):
+        self.branch(lanes, self.registers[lanes, rs1] != self.registers[lanes, rs2], imm)
+
+    def BLT(self, lanes, rs1, rs2, imm):
+        self.branch(lanes, self.registers[lanes, rs1] < self.registers[lanes, rs2], imm)
+
+    def BGE(self, lanes, rs1, rs2, imm):
+        self.branch(lanes, self.registers[lanes, rs1] >= self.registers[lanes, rs2], imm)
+
+    def branch(self, lanes, taken, imm):
+        """
+        lanes where 'taken' is set jump by imm, the others continue with the next instruction
+        """
+        self.pc[lanes] += np.where(taken, imm, 4)
+
+    def JAL(self, lanes, rd, imm):
+        if rd: self.registers[lanes, rd] = self.pc[lanes] + 4
+        self.pc[lanes] += imm
+
+    def JALR(self, lanes, rd, rs1, imm):
+        target = (self.registers[lanes, rs1].astype(np.int64) + imm) & ~1
+        if rd: self.registers[lanes, rd] = self.pc[lanes] + 4
+        self.pc[lanes] = target
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Execution
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def decode(self, pc):
+        """
+        decode the instruction at pc through the template machine
+        """
+        entry = self.decode_cache.get(pc)
+        if entry is None:
+            handler, operands, inst = self.m.decode_cache.get(pc) or self.m.predecode(pc)
+            entry = self.decode_cache[pc] = (getattr(self, inst), operands)
+        return entry
+
+    def step(self, active):
+        """
+        execute one instruction on every lane in 'active' (array of lane indices), grouped by pc
+        """
+        pcs, group = np.unique(self.pc[active], return_inverse=True)
+        if len(pcs) == 1:
+            groups = [active]
+        else:
+            order = np.argsort(group, kind='stable')
+            groups = np.split(active[order], np.cumsum(np.bincount(group))[:-1])
+        for pc, lanes in zip(pcs.tolist(), groups):
+            instruction, operands = self.decode(pc)
+            instruction(lanes, *operands)
+        self.instruction_count[active] += 1
+
+    def execute(self, start, end=None, instructionCount=0):
+        """
+        Executes code on all lanes from start label to end label or for instructionCount number of instructions
+        returns the registers of all lanes, shape (lanes, 32)
+        """
+        self.pc[:] = self.m.getLabel(start)
+        lanes = np.arange(self.lanes)
+
+        if end is None:
+            for i in range(instructionCount):
+                self.step(lanes)
+        else:
+            end = self.m.getLabel(end)
+            active = lanes[self.pc != end]
+            while len(active):
+                self.step(active)
+                active = active[self.pc[active] != end]
+        return self.registers
+
+    def result(self, reg):
+        """
+        value of register reg in every lane
+        """
+        return self.registers[:, reg].copy()
+
+    def read_i32(self, addr):
+        """
+        read the 32-bit int at addr from the memory of every lane
+        """
+        return np.ascontiguousarray(self.memory[:, addr:addr + 4]).view('<i4')[:, 0].copy()
+
+    def write_i32(self, x, addr):
+        """
+        write 32-bit int(s) into the memory of every lane (x: scalar or one value per lane)
+        """
+        values = np.broadcast_to(np.asarray(x).astype('<i4'), (self.lanes,))
+        self.memory[:, addr:addr + 4] = np.ascontiguousarray(values).view(np.uint8).reshape(-1, 4)
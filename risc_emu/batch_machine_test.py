@@ -0,0 +1,82 @@
+"""
+This is a test for the lane-parallel batch machine: fib(n) for a whole range of n in one run
+"""
+
+import time
+import numpy as np
+from machine import machine
+from batch_machine import batch_machine
+
+ra, sp, t0, s0, a0 = 1, 2, 5, 8, 10
+
+#-------------------------------------------------------------------------------
+# fibonacci program, the argument n is taken from a0 (set per lane)
+#-------------------------------------------------------------------------------
+m = machine(mem_size=8000)
+m.registers[sp] = 8000
+m.pc = 4000
+m.addLabel('BaseCase')
+m.storeAssembly('JALR', ra, ra, 0)
+m.addLabel('fibonacci')
+m.storeAssembly('BEQ', s0, a0, 'BaseCase')
+m.storeAssembly('BLT', a0, s0, 'BaseCase')
+m.storeAssembly('ADDi', sp, sp, -12)
+m.storeAssembly('SW', ra, 8, sp)
+m.storeAssembly('SW', a0, 4, sp)
+m.storeAssembly('ADDi', a0, a0, -1)
+m.storeAssembly('JAL', ra, 'fibonacci')
+m.storeAssembly('SW', a0, 0, sp)
+m.storeAssembly('LW', a0, 4, sp)
+m.storeAssembly('ADDi', a0, a0, -2)
+m.storeAssembly('JAL', ra, 'fibonacci')
+m.storeAssembly('LW', t0, 0, sp)
+m.storeAssembly('ADD', a0, a0, t0)
+m.storeAssembly('LW', ra, 8, sp)
+m.storeAssembly('ADDi', sp, sp, 12)
+m.storeAssembly('JALR', ra, ra, 0)
+m.addLabel('start')
+m.storeAssembly('ADDi', s0, 0, 1)
+m.storeAssembly('JAL', ra, 'fibonacci')
+m.addLabel('end')
+
+#-------------------------------------------------------------------------------
+# Test 1: fib(n) for n = 0..15 on 16 lanes
+#-------------------------------------------------------------------------------
+n = np.arange(16)
+b = batch_machine(m, lanes=len(n))
+b.registers[:, a0] = n
+t = time.perf_counter()
+b.execute('start', 'end')
+t = time.perf_counter() - t
+
+fib = [0, 1]
+for i in range(14): fib.append(fib[-1] + fib[-2])
+print("Test 1: fib(0..15) = " + str(b.result(a0)) + " in %.3fs" % t)
+assert((b.result(a0) == fib).all())
+assert((b.pc == m.getLabel('end')).all())
+
+#-------------------------------------------------------------------------------
+# Test 2: every lane matches a single machine run (registers, memory, instruction count)
+#-------------------------------------------------------------------------------
+for lane in [0, 1, 7, 15]:
+    single = machine(mem_size=8000)
+    single.memory[:] = m.memory
+    single.label_dictionary = dict(m.label_dictionary)
+    single.registers[a0], single.registers[sp] = lane, 8000
+    single.debug = True
+    single.execute('start', 'end')
+    assert((single.registers == b.registers[lane]).all())
+    assert((single.memory == b.memory[lane]).all())
+    assert(single.total_number_of_instructions == b.instruction_count[lane])
+print("Test 2: lanes match single machine runs")
+
+#-------------------------------------------------------------------------------
+# Test 3: instructionCount and memory helpers
+#-------------------------------------------------------------------------------
+b = batch_machine(m, lanes=4)
+b.write_i32(np.array([-1, 2, 3, 2**31 - 1]), 100)
+assert((b.read_i32(100) == [-1, 2, 3, 2**31 - 1]).all())
+b.registers[:, a0] = 5
+b.execute('start', None, 3)
+assert((b.instruction_count == 3).all() and (b.pc == m.getLabel('fibonacci') + 4).all())
+print("Test 3: instructionCount")
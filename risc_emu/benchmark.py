@@ -0,0 +1,261 @@
+"""
+This is the benchmark suite of the risc machine: standard guest kernels (programs.py) measured on every
+backend and execution engine.
+
+For every kernel / backend / engine it reports:
+- assembly time:    assembling the kernel (image cache off)
+- startup time:     machine construction + loading the image + writing the input data
+- first run:        the first execution (includes decoding / block translation)
+- run:              best of the following runs (after restore() to the loaded state)
+- instructions, MIPS and ns per instruction (from the best run)
+Every run is checked against the expected result.
+
+usage:
+    python benchmark.py [--quick] [--output results.json]
+    python benchmark.py --compare baseline.json [--threshold 0.1]       # exit code 1 on regressions
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from machine import machine, wrap32
+from programs import fibonacci, factorial, memcpy, bubble_sort, matmul, count_loop
+
+a0, a1, a2, a3, sp = 10, 11, 12, 13, 2
+
+MEM_SIZE = 1 << 20
+DATA = 0x10000                                                  # first input buffer
+DATA2 = 0x40000                                                 # second input / output buffer
+DATA3 = 0x80000                                                 # output buffer
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Kernels: (program, input setup, result check), size = problem size
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+def fib_kernel(size):
+    fib = [0, 1]
+    for i in range(size): fib.append(fib[-1] + fib[-2])
+    def setup(m): m.registers[a0] = size
+    def check(m): return m.registers[a0] == fib[size]
+    return fibonacci(), setup, check
+
+def factorial_kernel(size):
+    expected = wrap32(int(np.prod(np.arange(1, size + 1, dtype=object))))
+    def setup(m): m.registers[a0] = size
+    def check(m): return m.registers[a0] == expected
+    return factorial(), setup, check
+
+def memcpy_kernel(size):
+    data = np.arange(size, dtype=np.int32) * 7 - 1000
+    def setup(m):
+        write_words(m, DATA, data)
+        m.registers[a0], m.registers[a1], m.registers[a2] = DATA, DATA2, size
+    def check(m): return read_words(m, DATA2, size) == data.tolist()
+    return memcpy(), setup, check
+
+def bubble_sort_kernel(size):
+    data = np.random.default_rng(size).integers(-10**6, 10**6, size).astype(np.int32)
+    def setup(m):
+        write_words(m, DATA, data)
+        m.registers[a0], m.registers[a1] = DATA, size
+    def check(m): return read_words(m, DATA, size) == sorted(data.tolist())
+    return bubble_sort(), setup, check
+
+def matmul_kernel(size):
+    rng = np.random.default_rng(size)
+    A = rng.integers(-100, 100, (size, size)).astype(np.int32)
+    B = rng.integers(-100, 100, (size, size)).astype(np.int32)
+    def setup(m):
+        write_words(m, DATA, A.ravel())
+        write_words(m, DATA2, B.ravel())
+        m.registers[a0], m.registers[a1], m.registers[a2], m.registers[a3] = DATA, DATA2, DATA3, size
+    def check(m): return read_words(m, DATA3, size * size) == (A.astype(np.int64) @ B).ravel().tolist()
+    return matmul(), setup, check
+
+def count_loop_kernel(size):
+    def setup(m): m.registers[a0] = size
+    def check(m): return m.registers[a0] == size
+    return count_loop(), setup, check
+
+# name -> (kernel, size, quick size)
+KERNELS = {
+    'fibonacci':    (fib_kernel,            18,     12),
+    'factorial':    (factorial_kernel,      12,     12),
+    'memcpy':       (memcpy_kernel,         8192,   1024),
+    'bubble_sort':  (bubble_sort_kernel,    150,    40),
+    'matmul':       (matmul_kernel,         20,     8),
+    'count_loop':   (count_loop_kernel,     100000, 10000),
+}
+
+BACKENDS = ['numpy', 'native', 'paged']
+# 'fused': the interpreter with macro-op fusion (see fusion.py), 'vector': the block engine with
+# numpy-vectorized hot loops (see vectorizer.py)
+ENGINES = ['interpreter', 'fused', 'block', 'vector']
+
+
+def write_words(m, addr, words):
+    for i, word in enumerate(np.asarray(words).tolist()):
+        m.write_i32(word, addr + 4 * i)
+
+def read_words(m, addr, n):
+    return [m.read_i32(addr + 4 * i) for i in range(n)]
+
+def kernel_machine(image, setup, mem_size=MEM_SIZE, backend='numpy'):
+    """
+    machine with a kernel image loaded at 0, the stack at the top of the memory and the input data written
+    """
+    m = machine(mem_size, backend=backend)
+    image.load(m, 0)
+    m.registers[sp] = wrap32(m.memory_size - 16)
+    setup(m)
+    return m
+
+def load_kernel(name, size, mem_size=MEM_SIZE, backend='numpy'):
+    """
+    kernel_machine for kernel name at problem size, returns the machine and the result check
+    """
+    program, setup, check = KERNELS[name][0](size)
+    return kernel_machine(program.assemble(), setup, mem_size, backend), check
+
+def machine_state(m):
+    """
+    registers, pc and memory of m, to compare the end states of two runs
+    """
+    return [int(r) for r in m.registers], m.pc, m.memory.read(0, m.memory_size) if m.paged else bytes(m.memory)
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Measurement
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+def measure(name, backend, engine, size, repeat=3):
+    """
+    benchmark one kernel on one backend / engine, returns a result dict
+    """
+    program, setup, check = KERNELS[name][0](size)
+
+    t = time.perf_counter()
+    image = program.assemble(cache=False)
+    assembly = time.perf_counter() - t
+
+    t = time.perf_counter()
+    m = kernel_machine(image, setup, MEM_SIZE if backend != 'paged' else 1 << 32, backend)
+    startup = time.perf_counter() - t
+    run_engine = engine
+    if engine == 'fused':
+        m.enable_fusion(count=False)
+        run_engine = 'interpreter'
+    elif engine == 'vector':
+        m.enable_vectorizer()
+        run_engine = 'block'
+
+    m.snapshot()
+    prof = m.start_profiler()                                   # count the instructions once
+    m.execute('start', 'end', engine=run_engine)
+    m.stop_profiler()
+    instructions = prof.total()
+    m.restore()
+
+    t = time.perf_counter()
+    m.execute('start', 'end', engine=run_engine)
+    first_run = time.perf_counter() - t
+    if not check(m):
+        raise AssertionError("wrong result: %s on %s / %s" % (name, backend, engine))
+
+    runs = []
+    for i in range(repeat):
+        m.restore()
+        t = time.perf_counter()
+        m.execute('start', 'end', engine=run_engine)
+        runs.append(time.perf_counter() - t)
+        if not check(m):
+            raise AssertionError("wrong result: %s on %s / %s" % (name, backend, engine))
+    run = min(runs)
+
+    return {'kernel': name, 'backend': backend, 'engine': engine, 'size': size,
+            'instructions': instructions, 'assembly_s': assembly, 'startup_s': startup,
+            'first_run_s': first_run, 'run_s': run,
+            'mips': instructions / run / 1e6, 'ns_per_instruction': run / instructions * 1e9}
+
+def run_suite(kernels=None, backends=BACKENDS, engines=ENGINES, quick=False, repeat=3):
+    """
+    benchmark every kernel on every backend and engine
+    """
+    results = []
+    for name in kernels or KERNELS:
+        size = KERNELS[name][2 if quick else 1]
+        for backend in backends:
+            for engine in engines:
+                results.append(measure(name, backend, engine, size, repeat))
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'quick': quick, 'results': results}
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Reports
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+def compare(baseline, current, threshold=0.1):
+    """
+    compare ns per instruction of two runs of the suite
+    returns [(kernel, backend, engine, baseline ns, current ns, change, regression)] for every common entry,
+    a regression is a slowdown of more than threshold (0.1 = 10%)
+    """
+    key = lambda r: (r['kernel'], r['backend'], r['engine'], r['size'])
+    old = {key(r): r for r in baseline['results']}
+    rows = []
+    for r in current['results']:
+        if key(r) in old:
+            before, after = old[key(r)]['ns_per_instruction'], r['ns_per_instruction']
+            change = after / before - 1
+            rows.append((r['kernel'], r['backend'], r['engine'], before, after, change, change > threshold))
+    return rows
+
+def format_results(suite):
+    lines = ['%-12s %-7s %-12s %10s %8s %8s %10s %10s %10s' %
+             ('kernel', 'backend', 'engine', 'insts', 'MIPS', 'ns/inst', 'asm ms', 'start ms', 'first ms')]
+    for r in suite['results']:
+        lines.append('%-12s %-7s %-12s %10d %8.2f %8.0f %10.2f %10.2f %10.1f' %
+                     (r['kernel'], r['backend'], r['engine'], r['instructions'], r['mips'], r['ns_per_instruction'],
+                      r['assembly_s'] * 1e3, r['startup_s'] * 1e3, r['first_run_s'] * 1e3))
+    return '\n'.join(lines)
+
+def format_comparison(rows):
+    lines = ['%-12s %-7s %-12s %10s %10s %8s' % ('kernel', 'backend', 'engine', 'before', 'after', 'change')]
+    for kernel, backend, engine, before, after, change, regression in rows:
+        lines.append('%-12s %-7s %-12s %7.0f ns %7.0f ns %+7.1f%%%s' %
+                     (kernel, backend, engine, before, after, 100 * change, '  REGRESSION' if regression else ''))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark suite of the risc machine')
+    parser.add_argument('--quick', action='store_true', help='small problem sizes')
+    parser.add_argument('--kernels', nargs='+', choices=list(KERNELS), default=None)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per measurement (best is kept)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown reported as regression (0.1 = 10%%)')
+    args = parser.parse_args()
+
+    suite = run_suite(args.kernels, args.backends, args.engines, args.quick, args.repeat)
+    print(format_results(suite))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(suite, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            rows = compare(json.load(f), suite, args.threshold)
+        print('')
+        print(format_comparison(rows))
+        if any(row[-1] for row in rows):
+            sys.exit(1)
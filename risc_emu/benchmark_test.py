@@ -0,0 +1,35 @@
+"""
+This is a test for the benchmark suite: every kernel runs (and is checked) on every backend / engine,
+results survive a JSON round trip and compare() flags regressions
+"""
+
+import json
+from benchmark import run_suite, compare, format_comparison, KERNELS, BACKENDS, ENGINES
+
+#-------------------------------------------------------------------------------
+# Test 1: quick suite, every kernel result is checked inside measure()
+#-------------------------------------------------------------------------------
+suite = run_suite(quick=True, repeat=1)
+assert(len(suite['results']) == len(KERNELS) * len(BACKENDS) * len(ENGINES))
+for r in suite['results']:
+    assert(r['instructions'] > 0 and r['mips'] > 0 and r['run_s'] > 0)
+
+counts = {}
+for r in suite['results']:
+    counts.setdefault(r['kernel'], set()).add(r['instructions'])
+assert(all(len(c) == 1 for c in counts.values()))              # same instruction count everywhere
+print("Test 1: " + str(len(suite['results'])) + " measurements, instructions: " +
+      str({k: c.pop() for k, c in counts.items()}))
+
+#-------------------------------------------------------------------------------
+# Test 2: compare mode
+#-------------------------------------------------------------------------------
+baseline = json.loads(json.dumps(suite))
+for r in baseline['results']:
+    if r['kernel'] == 'count_loop':
+        r['ns_per_instruction'] /= 2                            # pretend count_loop used to be twice as fast
+rows = compare(baseline, suite, threshold=0.1)
+assert(len(rows) == len(suite['results']))
+assert(all(regression == (kernel == 'count_loop') for kernel, b, e, before, after, change, regression in rows))
+print("Test 2: compare")
+print(format_comparison([row for row in rows if row[-1]]))
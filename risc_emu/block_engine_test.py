@@ -0,0 +1,107 @@
+"""
+This is a test for the basic-block translation engine: execute(..., engine='block') has to leave
+the machine in exactly the same state as the interpreter
+"""
+
+import numpy as np
+from machine import machine
+
+zero, ra, sp, t0, t1, t2, s0, a0, a1, a2 = 0, 1, 2, 5, 6, 7, 8, 10, 11, 12
+
+def fibonacci(n):
+    m = machine(mem_size=8000)
+    m.reset_machine()
+    m.clear_memory()
+    m.registers[sp] = 8000
+    m.pc = 4000
+    m.addLabel('BaseCase')
+    m.storeAssembly('JALR', ra, ra, 0)
+    m.addLabel('fibonacci')
+    m.storeAssembly('BEQ', s0, a0, 'BaseCase')
+    m.storeAssembly('BLT', a0, s0, 'BaseCase')
+    m.storeAssembly('ADDi', sp, sp, -12)
+    m.storeAssembly('SW', ra, 8, sp)
+    m.storeAssembly('SW', a0, 4, sp)
+    m.storeAssembly('ADDi', a0, a0, -1)
+    m.storeAssembly('JAL', ra, 'fibonacci')
+    m.storeAssembly('SW', a0, 0, sp)
+    m.storeAssembly('LW', a0, 4, sp)
+    m.storeAssembly('ADDi', a0, a0, -2)
+    m.storeAssembly('JAL', ra, 'fibonacci')
+    m.storeAssembly('LW', t0, 0, sp)
+    m.storeAssembly('ADD', a0, a0, t0)
+    m.storeAssembly('LW', ra, 8, sp)
+    m.storeAssembly('ADDi', sp, sp, 12)
+    m.storeAssembly('JALR', ra, ra, 0)
+    m.addLabel('start')
+    m.storeAssembly('ADDi', a0, 0, n)
+    m.storeAssembly('ADDi', s0, 0, 1)
+    m.storeAssembly('JAL', ra, 'fibonacci')
+    m.addLabel('end')
+    m.storeAssembly('ADD', t2, 0, a0)
+    return m
+
+#-------------------------------------------------------------------------------
+# Test 1: fibonacci, block engine vs interpreter
+#-------------------------------------------------------------------------------
+m1 = fibonacci(12)
+m2 = fibonacci(12)
+m1.execute('start', 'end')
+m2.execute('start', 'end', engine='block')
+print("Test 1: Fibonacci of 12 = " + str(m2.registers[a0]) + " (" + str(m2.translator.blocks_translated) + " blocks)")
+assert(m2.registers[a0] == 144)
+assert((m1.registers == m2.registers).all() and (m1.memory == m2.memory).all() and m1.pc == m2.pc)
+
+#-------------------------------------------------------------------------------
+# Test 2: instructionCount stops at the same instruction, also inside a block
+#-------------------------------------------------------------------------------
+for count in [1, 7, 100, 1001]:
+    m1 = fibonacci(12)
+    m2 = fibonacci(12)
+    m1.execute('start', None, count)
+    m2.execute('start', None, count, engine='block')
+    assert((m1.registers == m2.registers).all() and m1.pc == m2.pc)
+print("Test 2: instructionCount matches the interpreter")
+
+#-------------------------------------------------------------------------------
+# Test 3: 32-bit wraparound and x0 writes
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1000)
+m.reset_machine()
+m.addLabel('start')
+m.storeAssembly('ADDi', a0, 0, 2047)
+m.storeAssembly('MUL', a0, a0, a0)          # 4190209
+m.storeAssembly('MUL', a0, a0, a0)          # wraps around
+m.storeAssembly('SUB', a1, 0, a0)
+m.storeAssembly('ADDi', zero, a0, 5)        # discarded
+m.storeAssembly('XOR', a2, a0, a1)
+m.addLabel('end')
+m.execute('start', 'end', engine='block')
+print("Test 3: wraparound: " + str(m.registers[a0]) + " " + str(m.registers[a1]))
+expected = (4190209 * 4190209) & 0xFFFFFFFF
+expected = expected - (1 << 32) if expected & 0x80000000 else expected
+assert(m.registers[a0] == expected)
+assert(m.registers[a1] == -m.registers[a0] and m.registers[zero] == 0)
+
+#-------------------------------------------------------------------------------
+# Test 4: self-modifying code inside a translated block
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1000)
+m.reset_machine()
+m.pc = 100
+m.storeAssembly('ADDi', a1, 0, 7)           # template instruction, only used as data
+m.pc = 0
+m.addLabel('start')
+m.storeAssembly('ADDi', t0, 0, 100)
+m.storeAssembly('LW', t1, 0, t0)
+m.storeAssembly('ADDi', t2, 0, 2)
+m.addLabel('loop')                          # pc = 12
+m.storeAssembly('SW', t1, 20, 0)            # patch the instruction at pc = 20, in this block
+m.storeAssembly('ADDi', t2, t2, -1)
+m.storeAssembly('ADDi', a1, 0, 1)
+m.storeAssembly('ADD', a2, a2, a1)
+m.storeAssembly('BNE', t2, 0, 'loop')
+m.addLabel('end')
+m.execute('start', 'end', engine='block')
+print("Test 4: self-modifying code: " + str(m.registers[a2]))
+assert(m.registers[a2] == 7 + 7)
@@ -0,0 +1,258 @@
+"""
+Incremental checkpoints of long runs: a log file of the registers, pc and the memory pages written since the
+previous checkpoint, from which a run resumes after a crash or preemption.
+
+    m.pc = m.getLabel('start')
+    log = m.enable_checkpoints('run.ckpt', interval=1000000)     # checkpoint 0: the state now (every used page)
+    log.run(None, 'end')                                        # a checkpoint every interval instructions
+    ...
+    m = resume('run.ckpt')                                      # machine at the newest checkpoint
+    m.checkpoints.run(None, 'end')                              # goes on appending to the same log
+
+Checkpoint 0 stores every page that is not all zero (the resident pages of a paged memory), later checkpoints
+only the pages written since the previous one (the machine tracks them like for snapshots, see mark_dirty), so
+their cost is proportional to the working set, not to mem_size. Enable checkpoints after loading the program:
+memory written around the machine (m.memory[...] = ...) is not tracked.
+
+File layout (little-endian):
+    header      magic 'RVCKPT01', flags, mem_size, page size, number of labels + (address, name length, name) each
+    checkpoints CHECKPOINT (tag, sequence, pc, flag, pages, size of the rest, crc32 of the rest)
+                + registers (32 x int32) + (page number, length) and the page bytes (zlib-compressed if
+                FLAG_COMPRESSED) for every page
+A checkpoint is only valid if it is complete and its crc matches, so a checkpoint torn by a crash is ignored
+(and cut off when the log is appended to again). Labels are the ones of the machine when the log was created.
+"""
+
+import mmap
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from paged_memory import PAGE_SHIFT, PAGE_SIZE, paged_memory
+from interrupts import STOP_COUNT
+
+MAGIC               = b'RVCKPT01'
+TAG                 = b'CKPT'
+FLAG_COMPRESSED     = 1
+
+# instructions between two checkpoints of checkpoint_log.run
+INTERVAL            = 1000000
+
+# magic, flags, mem_size, page size, labels
+HEADER              = struct.Struct('<8sIQII')
+SYMBOL              = struct.Struct('<qH')
+# tag, sequence, pc, flag, pages, size, crc32
+CHECKPOINT          = struct.Struct('<4sIqIIQI')
+REGISTERS           = struct.Struct('<32i')
+PAGE                = struct.Struct('<II')
+
+
+def used_pages(m):
+    """
+    page numbers of the memory of m that are not all zero (resident pages of a paged memory)
+    """
+    if isinstance(m.memory, paged_memory):
+        return set(m.memory.pages)
+    memory = np.frombuffer(m.memory, dtype=np.uint8)
+    pages = -(-len(memory) >> PAGE_SHIFT)
+    padded = np.zeros(pages << PAGE_SHIFT, dtype=np.uint8)
+    padded[:len(memory)] = memory
+    return set(np.flatnonzero(padded.reshape(pages, PAGE_SIZE).any(axis=1)).tolist())
+
+
+class checkpoint_log:
+    def __init__(self, m, path, interval=INTERVAL, compress=True, sync=False, reader=None):
+        """
+        log checkpoints of machine m to path
+        interval:   instructions between two checkpoints of run()
+        compress:   zlib-compress the pages
+        sync:       fsync the file after every checkpoint (survives a power loss, not only a crash)
+        reader:     checkpoint_reader of an existing log at path whose last checkpoint is the state of m: go on
+                    appending to it (see resume), None starts a new log with a checkpoint of every used page
+        """
+        self.m          = m
+        self.path       = path
+        self.interval   = interval
+        self.sync       = sync
+        # pages written since the last checkpoint (kept up to date by the machine)
+        self.dirty      = set()
+        self.sequence   = 0
+        self.bytes      = 0         # size of the pages written by the last checkpoint
+
+        if reader is not None:
+            if reader.memory_size != m.memory_size:
+                raise ValueError("checkpoint log of a %d byte memory: %s" % (reader.memory_size, path))
+            self.compress = reader.compress
+            self.sequence = len(reader.checkpoints)
+            reader.close()
+            self.file = open(path, 'r+b')
+            self.file.truncate(reader.end)          # torn / later checkpoints
+            self.file.seek(reader.end)
+            return
+
+        self.compress = compress
+        labels = list(m.label_dictionary.items())
+        self.file = open(path, 'w+b')
+        self.file.write(HEADER.pack(MAGIC, FLAG_COMPRESSED if compress else 0, m.memory_size, PAGE_SIZE, len(labels)))
+        for name, addr in labels:
+            self.file.write(SYMBOL.pack(int(addr), len(name.encode())) + name.encode())
+        self.dirty = used_pages(m)
+        self.checkpoint()
+
+    def checkpoint(self):
+        """
+        append the registers, pc and the pages written since the last checkpoint, returns its sequence number
+        """
+        m = self.m
+        pages, self.dirty = sorted(self.dirty), set()
+        parts = [REGISTERS.pack(*[int(r) for r in m.registers])]
+        paged = isinstance(m.memory, paged_memory)
+        view = None if paged else memoryview(m.memory)
+        zero = bytes(PAGE_SIZE)
+        for page in pages:
+            lo = page << PAGE_SHIFT
+            if paged:
+                data = bytes(m.memory.pages.get(page, zero))
+            else:
+                data = view[lo:min(lo + PAGE_SIZE, m.memory_size)]
+            if self.compress:
+                data = zlib.compress(data, 1)
+            parts.append(PAGE.pack(page, len(data)))
+            parts.append(data)
+        body = b''.join(parts)
+        self.file.write(CHECKPOINT.pack(TAG, self.sequence, int(m.pc), int(bool(m.flag)), len(pages), len(body),
+                                        zlib.crc32(body)))
+        self.file.write(body)
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+        self.bytes = len(body)
+        self.sequence += 1
+        return self.sequence - 1
+
+    def run(self, start=None, end=None, engine='interpreter'):
+        """
+        execute from start to end (or until the machine stops) with a checkpoint every interval instructions
+        and one when execution stops, returns why it stopped (see machine.execute)
+        """
+        m = self.m
+        if start is not None:
+            m.pc = m.getLabel(start)
+        while True:
+            reason = m.execute(None, end, self.interval, engine)
+            self.checkpoint()
+            if reason != STOP_COUNT:
+                return reason
+
+    def close(self):
+        self.file.close()
+
+
+class checkpoint_reader:
+    def __init__(self, path):
+        """
+        read the header of the log at path and find its complete checkpoints
+        """
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, flags, self.memory_size, page_size, n_labels = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or page_size != PAGE_SIZE:
+            raise ValueError("not a checkpoint log: " + str(path))
+        self.compress = bool(flags & FLAG_COMPRESSED)
+
+        self.labels = {}
+        offset = HEADER.size
+        for i in range(n_labels):
+            addr, length = SYMBOL.unpack_from(self.data, offset)
+            offset += SYMBOL.size
+            self.labels[self.data[offset:offset + length].decode()] = addr
+            offset += length
+
+        # (sequence, pc, flag, pages, offset of the body, end) of every complete checkpoint
+        self.checkpoints = []
+        while offset + CHECKPOINT.size <= len(self.data):
+            tag, sequence, pc, flag, pages, size, crc = CHECKPOINT.unpack_from(self.data, offset)
+            body = offset + CHECKPOINT.size
+            if tag != TAG or sequence != len(self.checkpoints) or body + size > len(self.data) or \
+                    zlib.crc32(memoryview(self.data)[body:body + size]) != crc:
+                break
+            self.checkpoints.append((sequence, pc, flag, pages, body, body + size))
+            offset = body + size
+        # end of the last complete checkpoint
+        self.end = offset
+
+    def close(self):
+        self.data.close()
+
+    def registers(self, sequence):
+        """
+        registers of checkpoint sequence
+        """
+        return list(REGISTERS.unpack_from(self.data, self.checkpoints[sequence][4]))
+
+    def pages(self, sequence):
+        """
+        {page number: (offset, length)} of the pages stored in checkpoint sequence
+        """
+        pages, offset = {}, self.checkpoints[sequence][4] + REGISTERS.size
+        for i in range(self.checkpoints[sequence][3]):
+            page, length = PAGE.unpack_from(self.data, offset)
+            pages[page] = (offset + PAGE.size, length)
+            offset += PAGE.size + length
+        return pages
+
+    def page(self, offset, length):
+        """
+        bytes of a stored page
+        """
+        data = self.data[offset:offset + length]
+        return zlib.decompress(data) if self.compress else data
+
+    def memory(self, m, sequence):
+        """
+        write the memory at checkpoint sequence into machine m: the newest copy of every page up to it
+        """
+        newest = {}
+        for i in range(sequence, -1, -1):
+            for page, location in self.pages(i).items():
+                newest.setdefault(page, location)
+        view = None if m.paged else memoryview(m.memory)
+        for page, location in newest.items():
+            data = self.page(*location)
+            if m.paged:
+                if data.count(0) != len(data):
+                    m.memory.pages[page] = bytearray(data)
+                    m.memory.update_access(page)
+            else:
+                view[page << PAGE_SHIFT:(page << PAGE_SHIFT) + len(data)] = data
+        return len(newest)
+
+
+def resume(path, backend='numpy', sequence=None, interval=INTERVAL, sync=False):
+    """
+    create a machine at the newest checkpoint of the log at path (or at checkpoint sequence);
+    its checkpoints go on being appended to the log (checkpoints after sequence are cut off)
+    """
+    from machine import machine
+
+    reader = checkpoint_reader(path)
+    if not reader.checkpoints:
+        raise ValueError("checkpoint log without a complete checkpoint: " + str(path))
+    if sequence is None:
+        sequence = len(reader.checkpoints) - 1
+    m = machine(0, backend=backend)
+    m.memory_size = reader.memory_size
+    m.memory = m.backend.memory(reader.memory_size)
+    m.flush_decode()
+    reader.memory(m, sequence)
+    for i, value in enumerate(reader.registers(sequence)):
+        m.registers[i] = value
+    m.pc, m.flag = reader.checkpoints[sequence][1], bool(reader.checkpoints[sequence][2])
+    m.label_dictionary = dict(reader.labels)
+
+    reader.checkpoints = reader.checkpoints[:sequence + 1]
+    reader.end = reader.checkpoints[-1][5]
+    m.enable_checkpoints(path, interval, reader.compress, sync, reader)
+    return m
@@ -0,0 +1,100 @@
+"""
+This is a test for incremental checkpoints: checkpoints only hold the pages written since the previous one,
+runs resumed from any checkpoint (or after a torn checkpoint) end in the same state as an uninterrupted run
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from checkpoint import checkpoint_reader, resume
+from benchmark import load_kernel, machine_state
+
+directory = tempfile.mkdtemp()
+path = os.path.join(directory, 'run.ckpt')
+
+def kernel(name, size, mem_size, backend='numpy'):
+    m, check = load_kernel(name, size, mem_size, backend)
+    m.pc = m.getLabel('start')                                  # checkpoint 0 resumes at start
+    return m, check
+
+#-------------------------------------------------------------------------------
+# Test 1: checkpointed run, incremental checkpoints
+#-------------------------------------------------------------------------------
+m, check = kernel('bubble_sort', 40, 1 << 20)
+m.execute(None, 'end')
+expected = machine_state(m)
+
+m, check = kernel('bubble_sort', 40, 1 << 20)
+log = m.enable_checkpoints(path, interval=500)
+assert(log.run(None, 'end') == 'end' and check(m) and machine_state(m) == expected)
+reader = checkpoint_reader(path)
+pages = [c[3] for c in reader.checkpoints]
+reader.close()
+assert(pages[0] == 2 and max(pages[1:]) == 1 and len(pages) > 5)
+print("Test 1: %d checkpoints, pages per checkpoint %s" % (len(pages), pages))
+
+#-------------------------------------------------------------------------------
+# Test 2: resume from every checkpoint, and after a torn checkpoint
+#-------------------------------------------------------------------------------
+copy = os.path.join(directory, 'copy.ckpt')
+for sequence in range(len(pages)):
+    shutil.copy(path, copy)
+    m = resume(copy, sequence=sequence)
+    assert(m.checkpoints.run(None, 'end') == 'end' and machine_state(m) == expected)
+print("Test 2: resumed from each of %d checkpoints" % len(pages))
+
+shutil.copy(path, copy)
+with open(copy, 'r+b') as f:
+    f.truncate(os.path.getsize(copy) - 10)                  # crash while writing the last checkpoint
+m = resume(copy)
+assert(m.checkpoints.sequence == len(pages) - 1)
+m.checkpoints.run(None, 'end')
+assert(machine_state(m) == expected)
+m.disable_checkpoints()
+reader = checkpoint_reader(copy)
+assert(len(reader.checkpoints) == len(pages))
+reader.close()
+
+for backend in ['native', 'paged']:
+    m, check = kernel('bubble_sort', 40, 1 << 20, backend)
+    m.enable_checkpoints(copy, interval=1000, compress=False).run(None, 'end')
+    m.disable_checkpoints()
+    m = resume(copy, backend=backend, sequence=3)
+    m.checkpoints.run(None, 'end')
+    assert(check(m) and machine_state(m)[:2] == expected[:2])
+print("Test 2: torn checkpoint, native / paged backends")
+
+#-------------------------------------------------------------------------------
+# Test 3: checkpoint cost does not depend on mem_size
+#-------------------------------------------------------------------------------
+results = []
+for mem_size in [1 << 20, 64 << 20]:
+    m, check = kernel('memcpy', 4096, mem_size)
+    t = time.perf_counter()
+    log = m.enable_checkpoints(path, interval=20000)
+    first = time.perf_counter() - t
+    t = time.perf_counter()
+    log.run(None, 'end')
+    t = time.perf_counter() - t
+    reader = checkpoint_reader(path)
+    results.append([c[3] for c in reader.checkpoints])
+    reader.close()
+    m.disable_checkpoints()
+    assert(check(m))
+    print("Test 3: %3d MiB: first checkpoint %.1f ms, run with %d checkpoints %.1f ms, log %d bytes"
+          % (mem_size >> 20, first * 1000, len(results[-1]), t * 1000, os.path.getsize(path)))
+assert(results[0] == results[1])
+
+# snapshot restores are written by the next checkpoint
+m, check = kernel('memcpy', 512, 1 << 20)
+m.snapshot()
+log = m.enable_checkpoints(path)
+m.execute('start', 'end')
+m.restore()
+log.checkpoint()
+m.disable_checkpoints()
+assert(resume(path).read_i32(0x40000) == 0 and m.read_i32(0x40000) == 0)
+print("Test 3: restore() after a checkpoint")
+
+shutil.rmtree(directory)
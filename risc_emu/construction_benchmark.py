@@ -0,0 +1,58 @@
+"""
+This is a micro-benchmark of machine construction, for workloads that create many short-lived machines:
+- machine(mem_size) on every backend
+- template.clone(): a copy of a machine with a loaded program (no assembling / loading)
+- template.fork(): a copy-on-write clone of a snapshot of the template
+For each: instances per second and bytes per live instance (tracemalloc, memory included).
+
+usage: python construction_benchmark.py [instances] [mem_size]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from machine import machine
+from programs import fibonacci
+
+def measure(create, n):
+    """
+    instances per second of create(), and bytes allocated per instance while n of them are alive
+    """
+    create()
+    t = time.perf_counter()
+    for i in range(n):
+        create()
+    rate = n / (time.perf_counter() - t)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    alive = [create() for i in range(n)]
+    size = (tracemalloc.get_traced_memory()[0] - before) / n
+    tracemalloc.stop()
+    del alive
+    return rate, size
+
+def template(mem_size, backend):
+    m = machine(mem_size, backend=backend)
+    fibonacci().assemble().load(m, 0)
+    m.registers[2] = mem_size
+    return m
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    mem_size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+
+    print("%d instances, mem_size %d" % (n, mem_size))
+    print("construction             instances/s   bytes/instance")
+    for backend in ['numpy', 'native', 'paged']:
+        rate, size = measure(lambda: machine(mem_size, backend=backend), n)
+        print("%-22s %13.0f %16.0f" % ('machine / ' + backend, rate, size))
+        m = template(mem_size, backend)
+        rate, size = measure(m.clone, n)
+        print("%-22s %13.0f %16.0f" % ('clone / ' + backend, rate, size))
+    m = template(mem_size, 'numpy')
+    m.snapshot()
+    rate, size = measure(m.fork, n)
+    print("%-22s %13.0f %16.0f" % ('fork / numpy', rate, size))
@@ -0,0 +1,54 @@
+"""
+This is a test for lightweight machine construction: shared ISA tables, slots instead of an instance dict,
+and clones of a template machine that run independently of it
+"""
+
+import time
+from machine import machine, DECODER_MASKS
+from programs import fibonacci
+
+sp, a0 = 2, 10
+
+#-------------------------------------------------------------------------------
+# Test 1: shared tables and slots
+#-------------------------------------------------------------------------------
+m1, m2 = machine(1000), machine(1000, backend='native')
+assert(m1.decoder_masks is m2.decoder_masks is DECODER_MASKS and m1.asm_dict is m2.asm_dict)
+assert(m1.a0 == 10 and m2.t6 == 31 and not hasattr(m1, '__dict__'))
+assert(m1.instruciton_dictionary['ADD'] == m1.ADD and m2.instruciton_dictionary['ADD'] != m1.ADD)
+try:
+    m1.registers_copy = None
+    assert(False)
+except AttributeError:
+    pass
+
+t = time.perf_counter()
+machines = [machine(4096) for i in range(10000)]
+t = time.perf_counter() - t
+print("Test 1: 10000 machines in %.1f ms" % (t * 1000))
+
+#-------------------------------------------------------------------------------
+# Test 2: clones of a template
+#-------------------------------------------------------------------------------
+for backend in ['numpy', 'native', 'paged']:
+    template = machine(1 << 16, backend=backend)
+    fibonacci().assemble().load(template, 0)
+    template.registers[sp], template.registers[a0] = 1 << 16, 10
+    template.execute('start', 'end')                        # the template has decoded its program
+    template.registers[a0] = 12
+    memory = template.memory.copy()
+
+    clones = [template.clone() for i in range(20)]
+    for n, clone in enumerate(clones):
+        clone.registers[a0] = n
+        clone.addLabel('extra')
+        assert(clone.execute('start', 'end') == 'end')
+    fib = [0, 1]
+    for i in range(20): fib.append(fib[-1] + fib[-2])
+    assert([int(c.registers[a0]) for c in clones] == fib[:20])
+    assert(template.registers[a0] == 12 and 'extra' not in template.label_dictionary)
+    assert(bytes(template.memory.read(0, 1 << 16) if backend == 'paged' else template.memory) ==
+           bytes(memory.read(0, 1 << 16) if backend == 'paged' else memory))
+    template.execute('start', 'end')
+    assert(template.registers[a0] == 144)
+    print("Test 2: %-6s 20 clones of a fibonacci template" % backend)
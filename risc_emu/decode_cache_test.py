@@ -0,0 +1,65 @@
+"""
+This is a test for the decoded-instruction cache used by execute() (predecode + SW invalidation)
+"""
+
+import numpy as np
+from machine import machine
+
+#-------------------------------------------------------------------------------
+# Test 1: predecode matches the bit-string decoder
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1000)
+m.reset_machine()
+
+m.addLabel('top')
+m.storeAssembly('ADDi', 10, 0, -5)
+m.storeAssembly('SW', 1, -8, 2)
+m.storeAssembly('BEQ', 10, 11, 'top')
+m.storeAssembly('JAL', 1, 'top')
+
+for pc, expected in zip([0, 4, 8, 12], [(m.ADDi, (10, 0, -5)), (m.SW, (1, -8, 2)), (m.BEQ, (10, 11, -8)), (m.JAL, (1, -12))]):
+    handler, operands, inst = m.predecode(pc)
+    assert(handler == expected[0] and operands == expected[1])
+print("Test 1: predecode: " + str(len(m.decode_cache)) + " cached instructions")
+
+#-------------------------------------------------------------------------------
+# Test 2: self-modifying code, SW into a cached instruction invalidates it
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1000)
+m.reset_machine()
+
+t0, t1, t2, a1, a2 = 5, 6, 7, 11, 12
+
+m.pc = 100
+m.addLabel('patch')                     # template instruction, only used as data
+m.storeAssembly('ADDi', a1, 0, 7)
+
+m.pc = 0
+m.addLabel('start')
+m.storeAssembly('ADDi', t0, 0, 100)
+m.storeAssembly('LW', t1, 0, t0)        # t1 = encoded 'ADDi a1, x0, 7'
+m.storeAssembly('ADDi', t2, 0, 2)       # loop twice
+m.addLabel('loop')                      # pc = 12
+m.storeAssembly('ADDi', a1, 0, 1)       # patched after the first pass
+m.storeAssembly('ADD', a2, a2, a1)
+m.storeAssembly('SW', t1, 12, 0)        # overwrite the instruction at 'loop'
+m.storeAssembly('ADDi', t2, t2, -1)
+m.storeAssembly('BNE', t2, 0, 'loop')
+m.addLabel('end')
+
+m.execute('start', 'end')
+print("Test 2: self-modifying code: " + str(m.registers[a2]))
+assert(m.registers[a2] == 1 + 7)
+
+#-------------------------------------------------------------------------------
+# Test 3: host writes invalidate the cache as well
+#-------------------------------------------------------------------------------
+m.pc = 200
+m.storeAssembly('ADDi', a1, 0, 3)
+m.write_i32(m.read_i32(200), 12)        # host patches 'loop' to 'ADDi a1, x0, 3'
+assert(12 not in m.decode_cache)
+
+m.registers[a2] = 0
+m.execute('start', 'end')
+print("Test 3: host write invalidation: " + str(m.registers[a2]))
+assert(m.registers[a2] == 3 + 7)
@@ -0,0 +1,156 @@
+"""
+This is a test for resumable execution with budgets: time budgets stop endless guests, instruction and time
+budgets combine, many guests are time-sliced, and loads / stores outside the memory stop with STOP_FAULT
+"""
+
+import time
+from machine import machine
+from assembler import assembler
+from programs import fibonacci
+from paged_memory import page_fault, PROT_READ, PROT_ALL
+from interrupts import STOP_END, STOP_COUNT, STOP_TIME, STOP_FAULT
+
+zero, a0, a1, a2, a3, sp = 0, 10, 11, 12, 13, 2
+
+def spin():
+    """
+    count in a0 forever
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', a0, zero, 0)
+    a.addLabel('loop')
+    a.storeAssembly('ADDi', a0, a0, 1)
+    a.storeAssembly('JAL', zero, 'loop')
+    a.addLabel('end')
+    return a
+
+#-------------------------------------------------------------------------------
+# Test 1: a time budget stops an endless loop, execution resumes where it stopped
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    m = machine(mem_size=1000)
+    spin().assemble().load(m, 0)
+    t = time.perf_counter()
+    assert(m.execute('start', 'end', engine=engine, seconds=0.05) == STOP_TIME and m.stop_reason == STOP_TIME)
+    t = time.perf_counter() - t
+    count = int(m.registers[a0])
+    assert(count > 0 and m.pc in (m.getLabel('loop'), m.getLabel('loop') + 4))     # stopped inside the loop
+    assert(m.execute(None, 'end', engine=engine, seconds=0.02) == STOP_TIME and m.registers[a0] > count)
+    print("Test 1: %-11s %d instructions in %.1f ms" % (engine, 2 * count, t * 1000))
+
+#-------------------------------------------------------------------------------
+# Test 2: instruction and time budgets, whichever runs out first
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    m = machine(mem_size=1000)
+    spin().assemble().load(m, 0)
+    assert(m.execute('start', 'end', 20001, engine=engine, seconds=60) == STOP_COUNT and m.registers[a0] == 10000)
+    assert(m.execute(None, 'end', 10 ** 9, engine=engine, seconds=0.01) == STOP_TIME)
+
+    m = machine(1 << 16)
+    fibonacci().assemble().load(m, 0)
+    m.registers[sp], m.registers[a0] = 1 << 16, 12
+    assert(m.execute('start', 'end', 10 ** 9, engine=engine, seconds=60) == STOP_END and m.registers[a0] == 144)
+print("Test 2: instruction / time budgets")
+
+#-------------------------------------------------------------------------------
+# Test 3: time-slicing many guests
+#-------------------------------------------------------------------------------
+guests = []
+for n in range(10):
+    m = machine(1 << 16)
+    fibonacci().assemble().load(m, 0)
+    m.registers[sp], m.registers[a0] = 1 << 16, n + 8
+    m.pc = m.getLabel('start')
+    guests.append(m)
+
+slices, running = 0, list(guests)
+while running:
+    running = [m for m in running if m.execute(None, 'end', engine='block', seconds=0.002) == STOP_TIME]
+    slices += 1
+fib = [0, 1]
+for i in range(20): fib.append(fib[-1] + fib[-2])
+assert([int(m.registers[a0]) for m in guests] == fib[8:18] and slices > 2)
+print("Test 3: 10 guests finished in %d rounds of 2 ms slices" % slices)
+
+#-------------------------------------------------------------------------------
+# Test 4: faults stop execution on the faulting instruction
+#-------------------------------------------------------------------------------
+def store_loop():
+    """
+    store a0 at a1, a1 + 4, ... until a fault
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.addLabel('loop')
+    a.storeAssembly('ADDi', a0, a0, 1)
+    a.storeAssembly('SW', a0, 0, a1)
+    a.storeAssembly('ADDi', a1, a1, 4)
+    a.storeAssembly('JAL', zero, 'loop')
+    a.addLabel('end')
+    return a
+
+def negative_store():
+    """
+    store a0 at address -4 and load it back into a2
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', a1, zero, -4)
+    a.storeAssembly('SW', a0, 0, a1)
+    a.storeAssembly('LW', a2, 0, a1)
+    a.addLabel('end')
+    return a
+
+for backend in ['numpy', 'native', 'paged']:
+    for engine in ['interpreter', 'block']:
+        m = machine(1 << 13, backend=backend)
+        store_loop().assemble().load(m, 0)
+        m.registers[a1] = 0x800
+        if backend == 'paged':
+            m.memory.protect(0x1000, 4, PROT_READ)
+        assert(m.execute('start', 'end', engine=engine) == STOP_FAULT)
+        fault = 0x1000 if backend == 'paged' else 1 << 13
+        # both engines stop on the SW with the ADDi before it done
+        value = int(m.registers[a0])
+        assert(m.registers[a1] == fault and m.pc == 4)
+        assert(m.read_i32(fault - 4) == value - 1 and isinstance(m.fault, page_fault) == (backend == 'paged'))
+
+        if backend == 'paged':
+            m.memory.protect(0x1000, 4, PROT_ALL)
+            assert(m.execute(None, 'end', 32, engine=engine) == STOP_COUNT and m.read_i32(0x1000) == value)
+
+        # a negative address is 0xFFFFFFFC, outside the memory: it must not write the last word of the memory
+        m = machine(1 << 13, backend=backend)
+        negative_store().assemble().load(m, 0)
+        m.registers[a0] = 7
+        assert(m.execute('start', 'end', engine=engine) == STOP_FAULT and m.read_i32((1 << 13) - 4) == 0)
+        print("Test 4: %-6s %-11s %s" % (backend, engine, m.fault))
+
+#-------------------------------------------------------------------------------
+# Test 5: resuming after a fault does not repeat the instructions before it
+#-------------------------------------------------------------------------------
+def count_and_store():
+    """
+    add 1 to the word at a2, then store the count at a1
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('LW', a3, 0, a2)
+    a.storeAssembly('ADDi', a3, a3, 1)
+    a.storeAssembly('SW', a3, 0, a2)
+    a.storeAssembly('SW', a3, 0, a1)
+    a.addLabel('end')
+    return a
+
+for backend in ['numpy', 'native', 'paged']:
+    for engine in ['interpreter', 'block']:
+        m = machine(1 << 13, backend=backend)
+        count_and_store().assemble().load(m, 0)
+        m.registers[a1], m.registers[a2] = 1 << 13, 0x800
+        assert(m.execute('start', 'end', engine=engine) == STOP_FAULT and m.pc == 12 and m.read_i32(0x800) == 1)
+        m.registers[a1] = 0x900
+        assert(m.execute(None, 'end', engine=engine) == STOP_END)
+        assert(m.read_i32(0x800) == 1 and m.read_i32(0x900) == 1 and m.registers[a3] == 1)
+print("Test 5: resumed after the fault without repeating the count")
@@ -0,0 +1,312 @@
+"""
+Binary execution trace of the risc machine: writer, reader and replayer.
+
+Every executed instruction is one fixed-size record (RECORD / RECORD_DTYPE):
+    pc, instruction word, value, memory address, rd, flags
+    FLAG_REGISTER:  rd was written with value
+    FLAG_LOAD:      value was loaded from address (LW, rd is written as well)
+    FLAG_STORE:     value was stored at address (SW)
+    FLAG_DEVICE:    the address of the LW / SW is a device register (the replayer does not store device words)
+    FLAG_MEMORY:    not an instruction: rd bytes (1..4, little-endian in value) were written at address while the
+                    instruction of the next record ran (memory written by a system call or a DMA transfer)
+ECALL records its result as a write of a0. SC / AMOSWAP / AMOADD record rd and the memory word at their address
+after the instruction (a FLAG_MEMORY record).
+
+    w = m.start_trace('run.trace', compress=True)
+    m.execute('start', 'end')           # tracing runs on the interpreter, whatever engine is asked for
+    m.stop_trace()
+
+    for chunk in trace_reader('run.trace').chunks(): ...    # numpy structured arrays
+    trace_replayer(m0, 'run.trace').seek(1000)              # m0 = machine as it was when tracing started
+
+Records are packed into a bytearray of buffer_records records. A full buffer is handed to a writer
+thread through a bounded queue (compression with zlib and the file writes happen there, in parallel with
+execution), so memory stays bounded for runs of any length.
+
+File layout:
+    header      magic 'RVTRACE1', flags, record size, registers and pc when tracing started
+    chunks      (number of records, number of bytes) + the records (zlib-compressed if FLAG_COMPRESSED)
+    end         a chunk header with 0 records, followed by the registers and pc when tracing stopped
+"""
+
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from paged_memory import PROT_WRITE
+
+MAGIC               = b'RVTRACE1'
+FLAG_COMPRESSED     = 1
+
+FLAG_REGISTER       = 1
+FLAG_LOAD           = 2
+FLAG_STORE          = 4
+FLAG_MEMORY         = 8
+FLAG_DEVICE         = 16
+
+# pc, word, value, address, rd, flags (2 bytes padding)
+RECORD              = struct.Struct('<IIiIBBxx')
+RECORD_DTYPE        = np.dtype({'names':   ['pc', 'word', 'value', 'addr', 'rd', 'flags'],
+                                'formats': ['<u4', '<u4', '<i4', '<u4', 'u1', 'u1'],
+                                'offsets': [0, 4, 8, 12, 16, 17], 'itemsize': RECORD.size})
+HEADER              = struct.Struct('<8sII')
+STATE               = struct.Struct('<32iq')
+CHUNK               = struct.Struct('<II')
+
+BUFFER_RECORDS      = 1 << 16
+QUEUE_CHUNKS        = 4
+
+A0                  = 10
+
+# registers written by each instruction kind (operands[0] is rd)
+WRITES_RD           = ('ADD', 'SUB', 'MUL', 'XOR', 'OR', 'AND', 'ADDi', 'LW', 'JAL', 'JALR', 'LR', 'SC', 'AMOSWAP', 'AMOADD')
+
+# atomic instructions that may store (operands[1] is the address register)
+ATOMIC_STORES       = ('SC', 'AMOSWAP', 'AMOADD')
+
+
+class trace_writer:
+    def __init__(self, m, path, compress=False, buffer_records=BUFFER_RECORDS):
+        """
+        open a trace of machine m at path, the header records the current registers and pc
+        """
+        self.m              = m
+        self.compress       = compress
+        self.buffer_records = buffer_records
+        self.buffer         = bytearray(buffer_records * RECORD.size)
+        self.count          = 0         # records in the buffer
+        self.records        = 0         # records written in total
+        self.pc             = m.pc      # pc of the instruction running (memory records carry it)
+
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, FLAG_COMPRESSED if compress else 0, RECORD.size))
+        self.file.write(STATE.pack(*[int(r) for r in m.registers], int(m.pc)))
+
+        # writer thread: compresses and writes full buffers
+        self.queue = queue.Queue(maxsize=QUEUE_CHUNKS)
+        self.thread = threading.Thread(target=self.write_chunks, daemon=True)
+        self.thread.start()
+
+    def step(self, m):
+        """
+        execute the instruction at m.pc and record it, returns the decoded entry
+        """
+        pc = self.pc = m.pc
+        entry = m.decode_cache.get(pc) or m.predecode(pc)
+        handler, operands, inst = entry
+        word = (m.memory.fetch_i32(pc) if m.paged else m.read_i32(pc)) & 0xFFFFFFFF   # code may be execute-only
+        addr = device = 0
+        if inst == 'LW' or inst == 'SW':
+            addr = (int(m.registers[operands[2]]) + operands[1]) & 0xFFFFFFFF
+            if m.bus is not None and m.bus.find(addr) is not None:
+                device = FLAG_DEVICE
+        elif inst in ATOMIC_STORES:
+            addr = int(m.registers[operands[1]]) & 0xFFFFFFFF
+
+        handler(*operands)
+
+        if inst in ATOMIC_STORES:
+            self.record(pc, 0, m.read_i32(addr), addr, 4, FLAG_MEMORY)  # the word after the store (or the failed SC)
+
+        rd = flags = value = 0
+        if inst == 'SW':
+            flags, value = FLAG_STORE, int(m.registers[operands[0]])   # the stored word
+        elif inst in WRITES_RD and operands[0] != 0:
+            rd = operands[0]
+            flags, value = FLAG_REGISTER | (FLAG_LOAD if inst == 'LW' else 0), int(m.registers[rd])
+        elif inst == 'ECALL':
+            rd = A0
+            flags, value = FLAG_REGISTER, int(m.registers[rd])      # the result of the system call
+        self.record(pc, word, value, addr, rd, flags | device)
+        return entry
+
+    def memory_written(self, addr, length):
+        """
+        length bytes at addr were written by the running instruction outside of a SW (system call, DMA):
+        record them as FLAG_MEMORY records of up to 4 bytes
+        """
+        m = self.m
+        if m.paged:
+            data = m.memory.read(addr, length, PROT_WRITE)
+        else:
+            data = bytes(memoryview(m.memory)[addr:addr + length])
+        for i in range(0, length, 4):
+            chunk = data[i:i + 4]
+            value = int.from_bytes(chunk.ljust(4, b'\0'), 'little', signed=True)
+            self.record(self.pc, 0, value, addr + i, len(chunk), FLAG_MEMORY)
+
+    def record(self, pc, word, value, addr, rd, flags):
+        """
+        append one record to the buffer
+        """
+        RECORD.pack_into(self.buffer, self.count * RECORD.size, pc & 0xFFFFFFFF, word, value, addr, rd, flags)
+        self.count += 1
+        if self.count == self.buffer_records:
+            self.flush()
+
+    def flush(self):
+        """
+        hand the buffered records to the writer thread and start a new buffer
+        """
+        if self.count:
+            self.queue.put((self.count, self.buffer))
+            self.records += self.count
+            self.buffer = bytearray(self.buffer_records * RECORD.size)
+            self.count = 0
+
+    def write_chunks(self):
+        """
+        writer thread: compress / write chunks until close() sends None
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            count, buffer = item
+            data = memoryview(buffer)[:count * RECORD.size]
+            if self.compress:
+                data = zlib.compress(data, 1)
+            self.file.write(CHUNK.pack(count, len(data)))
+            self.file.write(data)
+
+    def close(self):
+        """
+        write the remaining records and the final registers / pc, and close the file
+        """
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.file.write(CHUNK.pack(0, STATE.size))
+        self.file.write(STATE.pack(*[int(r) for r in self.m.registers], int(self.m.pc)))
+        self.file.close()
+
+
+class trace_reader:
+    def __init__(self, path):
+        """
+        open the trace at path and read its header
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, flags, record_size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError("not a trace file: " + str(path))
+            state = STATE.unpack(f.read(STATE.size))
+        self.compressed = bool(flags & FLAG_COMPRESSED)
+        self.registers  = list(state[:32])
+        self.pc         = state[32]
+
+    def chunks(self):
+        """
+        generator of the records as numpy structured arrays (RECORD_DTYPE), one chunk at a time
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(HEADER.size + STATE.size)
+            while True:
+                count, size = CHUNK.unpack(f.read(CHUNK.size))
+                data = f.read(size)
+                if count == 0:
+                    state = STATE.unpack(data)
+                    self.final_registers, self.final_pc = list(state[:32]), state[32]
+                    return
+                if self.compressed:
+                    data = zlib.decompress(data)
+                yield np.frombuffer(data, dtype=RECORD_DTYPE)
+
+    def records(self):
+        """
+        generator of every record as a tuple (pc, word, value, addr, rd, flags)
+        """
+        for chunk in self.chunks():
+            for record in RECORD.iter_unpack(chunk.tobytes()):
+                yield record
+
+    def array(self):
+        """
+        the whole trace as one structured array (only for traces that fit in memory)
+        """
+        chunks = list(self.chunks())
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=RECORD_DTYPE)
+
+    def __len__(self):
+        """
+        number of traced instructions (memory records are not counted)
+        """
+        return sum(int(np.count_nonzero(chunk['flags'] & FLAG_MEMORY == 0)) for chunk in self.chunks())
+
+
+class trace_replayer:
+    def __init__(self, m, path):
+        """
+        replay the trace at path on machine m, which has to hold the memory as it was when tracing started
+        (registers and pc are taken from the trace)
+        """
+        self.m      = m
+        self.reader = trace_reader(path)
+        self.origin = m.snapshot()
+        self.rewind()
+
+    def rewind(self):
+        """
+        back to the state before the first traced instruction
+        """
+        m = self.m
+        m.restore(self.origin)
+        for i in range(32):
+            m.registers[i] = self.reader.registers[i]
+        self.step_count = 0
+        self.stream = self.reader.chunks()
+        self.pending = np.zeros(0, dtype=RECORD_DTYPE)
+        m.pc = self.next_pc()
+
+    def seek(self, step):
+        """
+        rebuild the machine state after 'step' traced instructions (rewinds for steps in the past)
+        returns the number of steps actually replayed (less than step if the trace is shorter)
+        """
+        if step < self.step_count:
+            self.rewind()
+        m = self.m
+        while self.step_count < step and len(self.pending):
+            n = 0
+            for pc, word, value, addr, rd, flags in self.pending.tolist():
+                n += 1
+                if flags & FLAG_MEMORY:
+                    write_bytes(m, addr, value.to_bytes(4, 'little', signed=True)[:rd])
+                    continue
+                if flags & FLAG_STORE:
+                    if not flags & FLAG_DEVICE:         # device registers are not part of the machine state
+                        m.write_i32(value, addr)
+                elif flags & FLAG_REGISTER:
+                    m.registers[rd] = value
+                self.step_count += 1
+                if self.step_count == step:
+                    break
+            self.pending = self.pending[n:]
+            m.pc = int(self.pending['pc'][0]) if len(self.pending) else self.next_pc()
+        return self.step_count
+
+    def next_pc(self):
+        """
+        load the next chunk of records and return the pc of its first record
+        (at the end of the trace: the pc when tracing stopped)
+        """
+        self.pending = next(self.stream, None)
+        if self.pending is None:
+            self.pending = np.zeros(0, dtype=RECORD_DTYPE)
+            return self.reader.final_pc
+        return int(self.pending['pc'][0])
+
+
+def write_bytes(m, addr, data):
+    """
+    write data into the memory of machine m at addr (memory records of a replayed trace)
+    """
+    if m.paged:
+        m.memory.write(addr, data)
+    else:
+        memoryview(m.memory)[addr:addr + len(data)] = data
+    m.memory_written(addr, len(data))
@@ -0,0 +1,240 @@
+"""
+This is a test for the binary execution trace (writer, reader and replayer)
+"""
+
+import io
+import os
+import tempfile
+import numpy as np
+from machine import machine
+from assembler import assembler
+from programs import fibonacci
+from syscalls import syscall_table, SYS_WRITE, SYS_READ
+from mmio import block_device, dma_engine, BLOCK_DATA, DMA_SRC, DMA_DST, DMA_LENGTH, DMA_CONTROL
+from execution_trace import trace_reader, trace_replayer, FLAG_STORE, FLAG_LOAD, FLAG_DEVICE, FLAG_MEMORY
+from paged_memory import PAGE_SIZE, PROT_EXEC
+
+zero, sp, t0, t1, a0, a1, a2, a7 = 0, 2, 5, 6, 10, 11, 12, 17
+folder = tempfile.mkdtemp()
+
+def program():
+    m = machine(mem_size=8000)
+    fibonacci(10).assemble().load(m, 0)
+    m.registers[sp] = 7000
+    return m
+
+#-------------------------------------------------------------------------------
+# Test 1: trace a run (small buffers, so several chunks), plain and compressed
+#-------------------------------------------------------------------------------
+reference = program()
+states = []                                                     # (registers, memory, pc) before every step
+reference.pc = reference.getLabel('start')
+while reference.pc != reference.getLabel('end'):
+    states.append((list(reference.registers), bytes(reference.memory), reference.pc))
+    reference.step()
+states.append((list(reference.registers), bytes(reference.memory), reference.pc))
+steps = len(states) - 1
+
+for compress in [False, True]:
+    path = os.path.join(folder, 'fib%d.trace' % compress)
+    m = program()
+    m.start_trace(path, compress, buffer_records=100)
+    m.execute('start', 'end', engine='block')                   # traced on the interpreter
+    m.stop_trace()
+    assert(m.registers[a0] == 55)
+
+    reader = trace_reader(path)
+    records = reader.array()
+    assert(len(records) == steps == len(reader) and reader.compressed == compress)
+    assert(records['pc'].tolist() == [s[2] for s in states[:-1]])
+    assert(reader.final_pc == m.getLabel('end') and reader.final_registers == [int(r) for r in m.registers])
+    assert(next(reader.records())[0] == m.getLabel('start'))
+    print("Test 1: %d records, %d bytes (compress=%s)" % (len(records), os.path.getsize(path), compress))
+
+stores = records[records['flags'] & FLAG_STORE != 0]
+loads = records[records['flags'] & FLAG_LOAD != 0]
+assert(len(stores) and len(loads) and (stores['addr'] < 7000).all() and (stores['addr'] >= 7000 - 12 * 10).all())
+
+#-------------------------------------------------------------------------------
+# Test 2: the replayer rebuilds the machine state at any step
+#-------------------------------------------------------------------------------
+replay = trace_replayer(program(), path)
+for step in [0, 1, 57, 250, steps // 2, steps, 10, 0, steps + 5]:
+    replayed = replay.seek(step)
+    registers, memory, pc = states[min(step, steps)]
+    assert(replayed == min(step, steps))
+    assert([int(r) for r in replay.m.registers] == registers and bytes(replay.m.memory) == memory and replay.m.pc == pc)
+print("Test 2: replayed states match the reference run at every step")
+
+#-------------------------------------------------------------------------------
+# Test 3: tracing code on an execute-only page
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1 << 16, backend='paged')
+fibonacci(10).assemble().load(m, 0)
+m.registers[sp] = 7000
+m.memory.protect(0, PAGE_SIZE, PROT_EXEC)
+path = os.path.join(folder, 'paged.trace')
+m.start_trace(path)
+m.execute('start', 'end')
+m.stop_trace()
+records = trace_reader(path).array()
+assert(m.registers[a0] == 55 and records['pc'].tolist() == [s[2] for s in states[:-1]])
+assert(records['word'].tolist() == [m.memory.fetch_i32(pc) & 0xFFFFFFFF for pc in records['pc'].tolist()])
+print("Test 3: %d records of code on an execute-only page" % len(records))
+
+#-------------------------------------------------------------------------------
+# Test 4: system call results and the memory they write are replayed
+#-------------------------------------------------------------------------------
+def echo():
+    """
+    write 3 bytes at 100, read 10 bytes to 200, load the first word read
+    """
+    a = assembler()
+    a.addLabel('start')
+    for number, buffer, length in [(SYS_WRITE, 100, 3), (SYS_READ, 200, 10)]:
+        a.storeAssembly('ADDi', a7, zero, number)
+        a.storeAssembly('ADDi', a0, zero, 0 if number == SYS_READ else 1)
+        a.storeAssembly('ADDi', a1, zero, buffer)
+        a.storeAssembly('ADDi', a2, zero, length)
+        a.storeAssembly('ECALL')
+        a.storeAssembly('ADD', t0 if number == SYS_WRITE else t1, a0, zero)
+    a.storeAssembly('LW', a2, 0, a1)
+    a.addLabel('end')
+    return a
+
+def console(m):
+    m.syscalls = syscall_table(m, stdin=io.BytesIO(b'0123456789abc'), stdout=io.BytesIO())
+    return m
+
+def program():
+    m = machine(mem_size=4096)
+    echo().assemble().load(m, 0)
+    m.memory[100:103] = list(b'abc')
+    return m
+
+reference = console(program())
+reference.pc = reference.getLabel('start')
+states = []
+while reference.pc != reference.getLabel('end'):
+    states.append((list(reference.registers), bytes(reference.memory), reference.pc))
+    reference.step()
+states.append((list(reference.registers), bytes(reference.memory), reference.pc))
+
+m = console(program())
+path = os.path.join(folder, 'syscalls.trace')
+m.start_trace(path)
+m.execute('start', 'end')
+m.stop_trace()
+assert(m.registers[t0] == 3 and m.registers[t1] == 10 and m.memory[200:210].tobytes() == b'0123456789')
+assert(len(trace_reader(path)) == len(states) - 1)
+
+replay = trace_replayer(program(), path)
+for step in list(range(len(states))) + [3, 0]:
+    replay.seek(step)
+    registers, memory, pc = states[step]
+    assert([int(r) for r in replay.m.registers] == registers and bytes(replay.m.memory) == memory and replay.m.pc == pc)
+print("Test 4: write / read system calls replayed at every step")
+
+#-------------------------------------------------------------------------------
+# Test 5: stores to device registers are not replayed into memory, DMA writes are
+#-------------------------------------------------------------------------------
+def transfer():
+    """
+    store 77 in the first disk block (data at a2), copy 8 bytes of it to 300 by DMA (engine at a1), load them
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', t0, zero, 77)
+    a.storeAssembly('SW', t0, 0, a2)
+    a.storeAssembly('SW', a2, DMA_SRC, a1)
+    a.storeAssembly('ADDi', t1, zero, 300)
+    a.storeAssembly('SW', t1, DMA_DST, a1)
+    a.storeAssembly('ADDi', t1, zero, 8)
+    a.storeAssembly('SW', t1, DMA_LENGTH, a1)
+    a.storeAssembly('SW', zero, DMA_CONTROL, a1)
+    a.storeAssembly('LW', a0, 300, zero)
+    a.addLabel('end')
+    return a
+
+def program(name):
+    m = machine(mem_size=4096)
+    transfer().assemble().load(m, 0)
+    disk = block_device(os.path.join(folder, name), blocks=4)
+    m.map_device(disk)
+    m.registers[a1], m.registers[a2] = m.map_device(dma_engine()), disk.base + BLOCK_DATA
+    return m
+
+reference = program('reference.img')
+reference.pc = reference.getLabel('start')
+states = []
+while reference.pc != reference.getLabel('end'):
+    states.append((list(reference.registers), bytes(reference.memory), reference.pc))
+    reference.step()
+states.append((list(reference.registers), bytes(reference.memory), reference.pc))
+
+m = program('traced.img')
+path = os.path.join(folder, 'devices.trace')
+m.start_trace(path)
+m.execute('start', 'end')
+m.stop_trace()
+records = trace_reader(path).array()
+assert(m.registers[a0] == 77 and len(records[records['flags'] & FLAG_DEVICE != 0]) == 5)
+assert(records[records['flags'] & FLAG_MEMORY != 0]['addr'].tolist() == [300, 304])
+
+replay = trace_replayer(program('replayed.img'), path)
+for step in list(range(len(states))) + [2, 0]:
+    replay.seek(step)
+    registers, memory, pc = states[step]
+    assert([int(r) for r in replay.m.registers] == registers and bytes(replay.m.memory) == memory and replay.m.pc == pc)
+print("Test 5: device stores and a DMA transfer replayed at every step")
+
+#-------------------------------------------------------------------------------
+# Test 6: the memory words written by atomic instructions are replayed
+#-------------------------------------------------------------------------------
+def atomics():
+    """
+    AMOADD, AMOSWAP, LR / SC (one that succeeds, one that fails) and an AMOADD to zero on the word at 1024
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', t0, zero, 1024)
+    a.storeAssembly('ADDi', t1, zero, 5)
+    a.storeAssembly('AMOADD', a0, t0, t1)
+    a.storeAssembly('ADDi', t1, zero, 9)
+    a.storeAssembly('AMOSWAP', a1, t0, t1)
+    a.storeAssembly('LR', a2, t0)
+    a.storeAssembly('ADDi', t1, t1, 1)
+    a.storeAssembly('SC', a2, t0, t1)
+    a.storeAssembly('SC', t1, t0, t1)
+    a.storeAssembly('AMOADD', zero, t0, t0)
+    a.storeAssembly('LW', t1, 0, t0)
+    a.addLabel('end')
+    return a
+
+def program():
+    m = machine(mem_size=4096)
+    atomics().assemble().load(m, 0)
+    return m
+
+reference = program()
+reference.pc = reference.getLabel('start')
+states = []
+while reference.pc != reference.getLabel('end'):
+    states.append((list(reference.registers), bytes(reference.memory), reference.pc))
+    reference.step()
+states.append((list(reference.registers), bytes(reference.memory), reference.pc))
+
+m = program()
+path = os.path.join(folder, 'atomics.trace')
+m.start_trace(path)
+m.execute('start', 'end')
+m.stop_trace()
+assert(m.registers[a0] == 0 and m.registers[a1] == 5 and m.registers[a2] == 0 and m.registers[t1] == 1034)
+assert(len(trace_reader(path)) == len(states) - 1)
+
+replay = trace_replayer(program(), path)
+for step in list(range(len(states))) + [4, 0]:
+    replay.seek(step)
+    registers, memory, pc = states[step]
+    assert([int(r) for r in replay.m.registers] == registers and bytes(replay.m.memory) == memory and replay.m.pc == pc)
+print("Test 6: atomic memory writes replayed at every step")
@@ -74,6 +74,7 @@ m.storeAssembly('JAL', ra, 'factorial')
 m.addLabel('end')
 m.storeAssembly('ADDi', t2, 0, 1)
 
+m.registers[sp] = 4000                  # the stack grows down from the top of the memory
 m.execute('start', 'end', 0)
 
 print("Factorial of " + str(m.registers[t1]) + " = " + str(m.registers[a0]))
\ No newline at end of file
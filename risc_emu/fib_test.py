@@ -81,6 +81,7 @@ m.storeAssembly('JAL', ra, 'fibonacci')
 m.addLabel('end')
 m.storeAssembly('ADD', t6, 0, a0)
 
+m.registers[sp] = 8000                  # the stack grows down from the top of the memory
 m.execute('start', 'end', 0)
 
 print("Fibonacci of " + str(m.registers[t2]) + " = " + str(m.registers[a0]))
\ No newline at end of file
@@ -0,0 +1,207 @@
+"""
+Macro-op fusion for the interpreter: recurring instruction pairs / triples run as one superinstruction.
+
+    f = m.enable_fusion()
+    f.fuse('start', 'end')              # fusion pass over loaded code (optional, code is also fused when first run)
+    m.execute('start', 'end')
+    print(f.report())
+
+Fused patterns (longest match first, see FUSIONS):
+    ADDi + BNE / BLT / BEQ / BGE    loop counter and branch
+    LW + LW                         two loads (typically from the same base)
+    ADDi + SW (+ SW)                stack frame allocation and register saves
+    LW (+ ADDi) + JALR              restore ra (pop the frame) and return
+
+A superinstruction is the instructions of the pattern compiled into one python function by the block
+translator (see translator.py): it updates the registers, memory and pc exactly as the instructions
+would one after the other (a store into the following instructions of the pattern leaves it early),
+but registers are loaded / written back once and there is one dispatch round trip instead of two or three.
+Only execute(start, end) with no instructionCount on the interpreter uses fused code: the fused
+entries live in their own cache, so step(), the instrumented loop (debug / profiler / trace) and
+instruction counting still see single instructions. A pattern is not fused across the end label of any
+execute() (the loop only checks for it between superinstructions), and stores into code drop the fused
+entries covering the written word.
+"""
+
+from contextlib import nullcontext
+from struct import error as struct_error
+
+from translator import translator
+from interrupts import machine_stop
+from paged_memory import page_fault
+
+# fused patterns, longest first
+FUSIONS = [
+    ('ADDi', 'SW', 'SW'),
+    ('LW', 'ADDi', 'JALR'),
+    ('ADDi', 'BNE'),
+    ('ADDi', 'BLT'),
+    ('ADDi', 'BEQ'),
+    ('ADDi', 'BGE'),
+    ('LW', 'LW'),
+    ('ADDi', 'SW'),
+    ('LW', 'JALR'),
+]
+
+LONGEST = max(len(pattern) for pattern in FUSIONS)
+
+# instructions a superinstruction can not continue after (they do not fall through to pc + 4)
+CONTROL = ('BEQ', 'BNE', 'BLT', 'BGE', 'JAL', 'JALR', 'WFI', 'HALT', 'ECALL')
+
+
+class fusion:
+    def __init__(self, m, count=True):
+        """
+        fusion state of machine m
+        count: count how often every pattern runs (for the report)
+        """
+        self.m      = m
+        self.count  = count
+
+        # pc -> decode entry for the fused loop: a superinstruction or the single decoded instruction
+        self.cache  = {}
+        # addresses a pattern may not continue into (end labels of execute)
+        self.stops  = set()
+
+        # pc -> pattern fused there, pattern -> number of executions
+        self.fused  = {}
+        self.fired  = dict.fromkeys(FUSIONS, 0)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Fusion pass
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def fuse(self, start, end):
+        """
+        fuse the code between labels / addresses start and end
+        """
+        m = self.m
+        for pc in range(m.getLabel(start), m.getLabel(end), 4):
+            if pc not in self.cache:
+                try:
+                    self.lookup(pc)
+                except (machine_stop, struct_error, page_fault):
+                    continue  # data between the code
+
+    def stop_at(self, end):
+        """
+        make sure no superinstruction runs past address end
+        """
+        if end not in self.stops:
+            self.stops.add(end)
+            for pc in range(end - 4 * (LONGEST - 1), end):
+                self.cache.pop(pc, None)
+                self.fused.pop(pc, None)
+
+    def lookup(self, pc):
+        """
+        decode entry for the fused loop at pc, fusing the instructions starting there if they match a pattern
+        """
+        m = self.m
+        entries = [m.decode_cache.get(pc) or m.predecode(pc)]
+        a = pc + 4
+        while len(entries) < LONGEST and entries[-1][2] not in CONTROL and a not in self.stops:
+            try:
+                entries.append(m.decode_cache.get(a) or m.predecode(a))
+            except (machine_stop, struct_error, page_fault):
+                break
+            a += 4
+        names = tuple(entry[2] for entry in entries)
+        entry = entries[0]
+        for pattern in FUSIONS:
+            if names[:len(pattern)] == pattern:
+                entry = (self.superinstruction(pc, pattern, entries[:len(pattern)]), (), '+'.join(pattern))
+                self.fused[pc] = pattern
+                break
+        self.cache[pc] = entry
+        return entry
+
+    def superinstruction(self, pc, pattern, entries):
+        """
+        one function running the decoded instructions of pattern at pc: the instructions are compiled
+        together by the block translator (translator.compile_body), so registers are loaded once
+        """
+        m = self.m
+        fired = self.fired
+        if m.translator is None:
+            m.translator = translator(m)
+        if 'SW' in pattern and not isinstance(m.atomic_lock, nullcontext):
+            # stores of harts sharing memory between processes take the atomic lock: call the handlers
+            calls = [(handler, operands) for handler, operands, _ in entries]
+            count = self.count
+            def fused():
+                for handler, operands in calls:
+                    handler(*operands)
+                if count:
+                    fired[pattern] += 1
+            return fused
+
+        fn, source = m.translator.compile_body([(pc + 4 * i, entry[1], entry[2]) for i, entry in enumerate(entries)])
+        if self.count:
+            def fused():
+                m.pc = fn(m, m.registers, m.memory)
+                fired[pattern] += 1
+        else:
+            def fused():
+                m.pc = fn(m, m.registers, m.memory)
+        return fused
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Execution
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def run(self, end):
+        """
+        execute from m.pc until pc == end with the fused entries
+        """
+        m = self.m
+        self.stop_at(end)
+        cache = self.cache
+        while m.pc != end:
+            entry = cache.get(m.pc) or self.lookup(m.pc)
+            entry[0](*entry[1])
+
+    def invalidate(self, addr):
+        """
+        drop the entries covering the word written at addr
+        """
+        for pc in range(addr - 4 * LONGEST + 1, addr + 4):
+            self.cache.pop(pc, None)
+            self.fused.pop(pc, None)
+
+    def flush(self):
+        self.cache.clear()
+        self.fused.clear()
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Report
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def dispatches_saved(self):
+        """
+        dispatch round trips saved so far (each execution of an n-instruction pattern saves n - 1)
+        """
+        return sum((len(pattern) - 1) * n for pattern, n in self.fired.items())
+
+    def sites(self):
+        """
+        {pattern: number of places it is fused at}
+        """
+        sites = dict.fromkeys(FUSIONS, 0)
+        for pattern in self.fused.values():
+            sites[pattern] += 1
+        return sites
+
+    def report(self):
+        """
+        fused sites, executions and saved dispatches of every pattern
+        """
+        sites = self.sites()
+        lines = ['%-18s %8s %12s %12s' % ('pattern', 'sites', 'fired', 'saved')]
+        for pattern in FUSIONS:
+            if sites[pattern] or self.fired[pattern]:
+                lines.append('%-18s %8d %12d %12d' % ('+'.join(pattern), sites[pattern], self.fired[pattern],
+                                                     (len(pattern) - 1) * self.fired[pattern]))
+        lines.append('%-18s %8d %12d %12d' % ('total', len(self.fused), sum(self.fired.values()),
+                                             self.dispatches_saved()))
+        return '\n'.join(lines)
@@ -0,0 +1,89 @@
+"""
+This is a test for macro-op fusion: fused execution leaves exactly the same state as single-instruction
+dispatch, the end label is never run past, stores into fused code and the fusion report
+"""
+
+import time
+from machine import machine
+from assembler import assembler
+from benchmark import KERNELS, load_kernel, machine_state
+
+zero, t0, a0, a1 = 0, 5, 10, 11
+
+def kernel(name, size, fuse):
+    m, check = load_kernel(name, size)
+    f = m.enable_fusion() if fuse else None
+    t = time.perf_counter()
+    m.execute('start', 'end')
+    t = time.perf_counter() - t
+    assert(check(m))
+    return m, f, t
+
+#-------------------------------------------------------------------------------
+# Test 1: every benchmark kernel, with and without fusion
+#-------------------------------------------------------------------------------
+for name in KERNELS:
+    size = KERNELS[name][2]
+    plain, _, t_plain = kernel(name, size, False)
+    fused, f, t_fused = kernel(name, size, True)
+    assert(machine_state(plain) == machine_state(fused))
+    print("Test 1: %-12s %6.1f ms -> %6.1f ms, %d sites, %d dispatches saved"
+          % (name, t_plain * 1000, t_fused * 1000, len(f.fused), f.dispatches_saved()))
+
+m, f, t = kernel('count_loop', 1000, True)
+assert(f.fired[('ADDi', 'BNE')] == 1000 and f.sites()[('ADDi', 'BNE')] == 1)
+print(f.report())
+
+#-------------------------------------------------------------------------------
+# Test 2: the end label / instruction counts split patterns
+#-------------------------------------------------------------------------------
+def counter():
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', a0, zero, 0)
+    a.addLabel('loop')
+    a.storeAssembly('ADDi', a0, a0, 1)
+    a.addLabel('middle')
+    a.storeAssembly('BNE', a0, a1, 'loop')
+    a.addLabel('end')
+    return a
+
+for fuse in [False, True]:
+    m = machine(mem_size=1000)
+    counter().assemble().load(m, 0)
+    m.registers[a1] = 50
+    if fuse:
+        m.enable_fusion().fuse('start', 'end')
+        assert(m.fusion.sites()[('ADDi', 'BNE')] == 1)
+    results = [m.execute('start', 'middle'), m.registers[a0], m.pc]
+    results += [m.execute('start', 'end', 7), m.registers[a0], m.pc]
+    results += [m.execute('start', 'end'), m.registers[a0], m.pc]
+    if fuse:
+        assert(results == expected)
+    expected = results
+print("Test 2: " + str(expected))
+
+#-------------------------------------------------------------------------------
+# Test 3: a fused store overwriting the rest of its own pattern
+#-------------------------------------------------------------------------------
+patch = machine(mem_size=100)
+patch.storeAssembly('ADDi', a0, a0, 100)
+word = patch.read_i32(0)
+
+for fuse in [False, True]:
+    m = machine(mem_size=1000)
+    m.addLabel('start')
+    m.storeAssembly('ADDi', t0, zero, 500)
+    m.storeAssembly('SW', a1, 12, zero)                     # overwrites the instruction after the next one
+    m.storeAssembly('SW', a1, 500, zero)
+    m.storeAssembly('ADDi', a0, a0, 1)
+    m.addLabel('end')
+    m.registers[a1] = word
+    if fuse:
+        m.enable_fusion()
+    m.execute('start', 'end')
+    m.execute('start', 'end')
+    if fuse:
+        assert(machine_state(m) == expected and m.registers[a0] == 200 and m.fusion.sites()[('ADDi', 'SW', 'SW')] == 1)
+    expected = machine_state(m)
+print("Test 3: self-modifying code inside a fused pattern")
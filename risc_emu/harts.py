@@ -0,0 +1,191 @@
+"""
+Several harts (hardware threads) sharing the memory of one risc machine.
+
+Every hart is a machine with its own registers, pc and decode cache, whose memory is the memory of the
+template machine (hart 0 is the template itself). a0 holds the hart number when a hart starts.
+
+    group = hart_group(m, 4)
+    group.run('start', 'end')                       # deterministic: round robin, quantum instructions each
+    group.run_processes('start', 'end', groups=2)   # harts split over 2 processes, memory in shared memory
+
+Guest code synchronizes with the RV32A instructions (LR / SC / AMOSWAP / AMOADD, see machine.py).
+In one process harts only switch between quanta, so atomic instructions are atomic by construction.
+With run_processes, atomic instructions and SW of all processes take one multiprocessing lock.
+Stores into code are only seen by the decode cache of the hart that made them.
+"""
+
+import gc
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from machine import machine
+from interrupts import STOP_COUNT, STOP_WFI
+
+# instructions a hart runs before the scheduler switches to the next one
+QUANTUM = 1000
+
+# seconds between checks that the hart processes are still alive while waiting for their results
+POLL = 0.1
+
+a0 = 10
+
+
+def share_memory(m, hart_id):
+    """
+    new hart (machine) sharing the memory and labels of machine m
+    """
+    hart = machine(0, backend=m.backend)
+    hart.memory = m.memory
+    hart.memory_size = m.memory_size
+    hart.label_dictionary = m.label_dictionary
+    hart.flush_decode()
+    hart.hart_id = hart_id
+    hart.atomic_lock = m.atomic_lock
+    return hart
+
+
+def schedule(harts, start, end, quantum, engine):
+    """
+    run harts round robin, quantum instructions at a time, until every hart stopped (end / HALT / illegal)
+    or every remaining hart waits in WFI; returns the stop reason of every hart
+    """
+    for hart in harts:
+        hart.pc = hart.getLabel(start)
+    reasons = [STOP_COUNT] * len(harts)
+    active = list(range(len(harts)))
+    while active:
+        running = []
+        for i in active:
+            reasons[i] = harts[i].execute(None, end, quantum, engine)
+            if reasons[i] in (STOP_COUNT, STOP_WFI):
+                running.append(i)
+        if all(reasons[i] == STOP_WFI for i in running):
+            break  # nothing left to run until an interrupt arrives
+        active = running
+    return reasons
+
+
+class hart_group:
+    def __init__(self, m, harts=2, quantum=QUANTUM):
+        """
+        m:          machine holding the program, becomes hart 0
+        harts:      number of harts
+        quantum:    instructions per turn of the round-robin scheduler
+        """
+        self.m          = m
+        self.quantum    = quantum
+        self.harts      = [m] + [share_memory(m, i) for i in range(1, harts)]
+        for i, hart in enumerate(self.harts):
+            hart.hart_id = i
+            hart.registers[a0] = i
+
+    def __len__(self):
+        return len(self.harts)
+
+    def __getitem__(self, i):
+        return self.harts[i]
+
+    def run(self, start='start', end='end', engine='interpreter'):
+        """
+        interleave all harts in one process (deterministic), returns the stop reason of every hart
+        """
+        return schedule(self.harts, start, end, self.quantum, engine)
+
+    def run_processes(self, start='start', end='end', groups=None, engine='interpreter'):
+        """
+        run the harts in 'groups' processes (default: one per hart), each process interleaves its harts
+        the memory is moved into shared memory for the run and copied back afterwards
+        returns the stop reason of every hart, raises RuntimeError if a process failed or died
+        """
+        m = self.m
+        if m.paged:
+            raise ValueError("run_processes needs a flat memory (numpy or native backend)")
+        groups = groups or len(self.harts)
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        context = context or multiprocessing.get_context()
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, m.memory_size))
+        processes = []
+        try:
+            shm.buf[:m.memory_size] = bytes(m.memory)
+            lock = context.Lock()
+            results = context.Queue()
+            states = [(hart.hart_id, [int(r) for r in hart.registers]) for hart in self.harts]
+            processes = [context.Process(target=run_group,
+                                         args=(shm.name, m.memory_size, dict(m.label_dictionary), m.backend.name,
+                                               states[g::groups], start, end, self.quantum, engine, lock, results))
+                         for g in range(groups)]
+            for p in processes:
+                p.start()
+            reasons = [None] * len(self.harts)
+            for p in processes:
+                status, record = wait_result(results, processes)
+                if status == 'error':
+                    raise RuntimeError("hart process failed: " + record)
+                for hart_id, registers, pc, reason in record:
+                    hart = self.harts[hart_id]
+                    for i in range(32):
+                        hart.registers[i] = registers[i]
+                    hart.pc = pc
+                    reasons[hart_id] = reason
+            for p in processes:
+                p.join()
+            memoryview(m.memory)[:] = shm.buf[:m.memory_size]
+            for hart in self.harts:
+                hart.flush_decode()
+            return reasons
+        finally:
+            for p in processes:
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+            shm.close()
+            shm.unlink()
+
+
+def wait_result(results, processes):
+    """
+    next record of the results queue, raises RuntimeError if a hart process died without sending one
+    """
+    while True:
+        try:
+            return results.get(timeout=POLL)
+        except queue.Empty:
+            for p in processes:
+                if p.exitcode not in (None, 0):
+                    raise RuntimeError("hart process %d exited with code %d" % (p.pid, p.exitcode))
+
+
+def run_group(name, mem_size, labels, backend, states, start, end, quantum, engine, lock, results):
+    """
+    worker process: build the harts of one group on the shared memory and interleave them
+    states: [(hart number, registers)]
+    puts ('ok', [(hart number, registers, pc, stop reason)]) or ('error', message) on results
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    template = machine(0, backend=backend)
+    template.memory = np.frombuffer(shm.buf, dtype=np.uint8, count=mem_size)
+    template.memory_size = mem_size
+    template.label_dictionary = labels
+    template.atomic_lock = lock
+
+    harts = []
+    try:
+        for hart_id, registers in states:
+            hart = share_memory(template, hart_id)
+            for i in range(32):
+                hart.registers[i] = registers[i]
+            harts.append(hart)
+        reasons = schedule(harts, start, end, quantum, engine)
+        results.put(('ok', [(hart.hart_id, [int(r) for r in hart.registers], int(hart.pc), reason)
+                            for hart, reason in zip(harts, reasons)]))
+    except Exception as error:
+        results.put(('error', '%s: %s' % (type(error).__name__, error)))
+
+    # release every view of the shared memory before detaching from it
+    template = harts = hart = None
+    gc.collect()
+    shm.close()
@@ -0,0 +1,119 @@
+"""
+This is a test for multi-hart execution (hart_group) and the RV32A atomic instructions
+"""
+
+from machine import machine
+from assembler import assembler
+from harts import hart_group
+
+zero, t0, t1, t2, s1, a0, t3, t4, t5 = 0, 5, 6, 7, 9, 10, 28, 29, 30
+LOCK, COUNTER, ATOMIC = 1024, 1028, 1032
+
+#-------------------------------------------------------------------------------
+# Test 1: atomic instructions on one hart
+#-------------------------------------------------------------------------------
+m = machine(mem_size=2048)
+m.write_i32(10, ATOMIC)
+m.registers[t0], m.registers[t1] = ATOMIC, 5
+
+m.AMOADD(t2, t0, t1)
+assert(m.registers[t2] == 10 and m.read_i32(ATOMIC) == 15)
+m.AMOSWAP(t2, t0, t1)
+assert(m.registers[t2] == 15 and m.read_i32(ATOMIC) == 5)
+
+m.LR(t2, t0, zero)
+m.SC(t3, t0, t0)                                            # reservation holds: store succeeds
+assert(m.registers[t3] == 0 and m.read_i32(ATOMIC) == ATOMIC)
+m.LR(t2, t0, zero)
+m.write_i32(99, ATOMIC)                                     # someone else changed the word
+m.SC(t3, t0, t1)
+assert(m.registers[t3] == 1 and m.read_i32(ATOMIC) == 99)
+m.SC(t3, t0, t1)                                            # no reservation left
+assert(m.registers[t3] == 1)
+
+m.pc = 0
+for inst in ['LR', 'SC', 'AMOSWAP', 'AMOADD']:
+    m.storeAssembly(inst, t2, t0, zero if inst == 'LR' else t1)
+for pc, inst in zip(range(0, 16, 4), ['LR', 'SC', 'AMOSWAP', 'AMOADD']):
+    handler, operands, name = m.predecode(pc)
+    assert(name == inst and operands == (t2, t0, zero if inst == 'LR' else t1))
+print("Test 1: LR / SC / AMOSWAP / AMOADD")
+
+#-------------------------------------------------------------------------------
+# Guest program: every hart adds 1 to three counters, n times each
+#   ATOMIC:     AMOADD
+#   COUNTER:    LW / ADDi / SW inside a spinlock taken with AMOSWAP
+#   LOCK + 12:  LR / SC retry loop
+#-------------------------------------------------------------------------------
+def program(n):
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', t0, zero, LOCK)
+    a.storeAssembly('ADDi', t1, zero, COUNTER)
+    a.storeAssembly('ADDi', s1, zero, 1)
+    a.storeAssembly('ADDi', t2, zero, n)
+    a.addLabel('loop')
+    a.addLabel('acquire')
+    a.storeAssembly('AMOSWAP', t3, t0, s1)
+    a.storeAssembly('BNE', t3, zero, 'acquire')
+    a.storeAssembly('LW', t4, 0, t1)
+    a.storeAssembly('ADDi', t4, t4, 1)
+    a.storeAssembly('SW', t4, 0, t1)
+    a.storeAssembly('SW', zero, 0, t0)                      # release
+    a.storeAssembly('ADDi', t5, t1, 4)
+    a.storeAssembly('AMOADD', t4, t5, s1)
+    a.storeAssembly('ADDi', t5, t1, 8)
+    a.addLabel('retry')
+    a.storeAssembly('LR', t4, t5)
+    a.storeAssembly('ADDi', t4, t4, 1)
+    a.storeAssembly('SC', t3, t5, t4)
+    a.storeAssembly('BNE', t3, zero, 'retry')
+    a.storeAssembly('ADDi', t2, t2, -1)
+    a.storeAssembly('BNE', t2, zero, 'loop')
+    a.addLabel('end')
+    a.storeAssembly('HALT')
+    return a
+
+def counters(m):
+    return [m.read_i32(COUNTER), m.read_i32(COUNTER + 4), m.read_i32(COUNTER + 8)]
+
+#-------------------------------------------------------------------------------
+# Test 2: 4 harts interleaved in one process (small quanta preempt inside the critical section)
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    for quantum in [3, 7, 1000]:
+        m = machine(mem_size=2048)
+        program(200).assemble().load(m, 0)
+        group = hart_group(m, 4, quantum)
+        reasons = group.run('start', 'end', engine=engine)
+        assert(reasons == ['end'] * 4 and [h.registers[a0] for h in group] == [0, 1, 2, 3])
+        assert(counters(m) == [800, 800, 800])
+print("Test 2: 4 harts x 200 increments = " + str(counters(m)))
+
+# the same increments without the lock lose updates when harts are preempted
+m = machine(mem_size=2048)
+unlocked = program(200)
+unlocked.statements = [s for s in unlocked.statements if s[0] not in ('AMOSWAP',) and s[1:] != (t3, zero, 'acquire')]
+unlocked.assemble().load(m, 0)
+hart_group(m, 4, 7).run()
+assert(m.read_i32(COUNTER) < 800 and m.read_i32(COUNTER + 4) == 800)
+print("Test 2: without the lock: " + str(m.read_i32(COUNTER)))
+
+#-------------------------------------------------------------------------------
+# Test 3: harts in separate processes over shared memory
+#-------------------------------------------------------------------------------
+m = machine(mem_size=2048)
+program(300).assemble().load(m, 0)
+group = hart_group(m, 4, 50)
+reasons = group.run_processes('start', 'end', groups=2)
+assert(reasons == ['end'] * 4 and counters(m) == [1200, 1200, 1200])
+assert(all(h.pc == m.getLabel('end') and h.registers[t2] == 0 for h in group))
+print("Test 3: 4 harts in 2 processes = " + str(counters(m)))
+
+# a failing hart process is reported instead of blocking the parent
+try:
+    hart_group(m, 2).run_processes('start', 'nolabel')
+    assert(False)
+except RuntimeError as error:
+    message = str(error)
+print("Test 3: " + message)
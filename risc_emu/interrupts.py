@@ -0,0 +1,120 @@
+"""
+Stop reasons and the interrupt / timer controller of the risc machine.
+
+execute() returns why it stopped instead of spinning in HALT:
+    STOP_END        pc reached the end label
+    STOP_COUNT      instructionCount instructions were executed
+    STOP_HALT       the guest executed HALT (pc is after the HALT, execute(None, ...) resumes)
+    STOP_WFI        the guest executed WFI with no interrupt pending (pc stays on the WFI, so resuming
+                    re-executes it: it continues once an interrupt is pending, otherwise it stops again)
+    STOP_ILLEGAL    the instruction at pc is not supported
+    STOP_EXIT       the guest made the exit system call (m.exit_code holds its status, see syscalls.py)
+    STOP_TIME       the time budget of execute(..., seconds=...) ran out
+    STOP_FAULT      a load / store left the memory or had no permission (m.fault holds the exception, pc stays
+                    on the instruction, also on the block engine)
+
+HALT / WFI / exit / illegal instructions raise machine_stop, which execute() catches, so the execution loops
+do not check for them on every instruction.
+
+Interrupts are numbered bits in a pending mask. raise_interrupt() sets one (and wakes a machine waiting
+in run(), see machine.run), WFI takes the lowest pending enabled interrupt (it is cleared and kept in
+'cause'). The timer raises TIMER_INTERRUPT when its deadline (time.monotonic) has passed, once or periodically.
+From another thread, use loop.call_soon_threadsafe(controller.raise_interrupt, n).
+"""
+
+import asyncio
+import time
+
+STOP_END        = 'end'
+STOP_COUNT      = 'count'
+STOP_HALT       = 'halt'
+STOP_WFI        = 'wfi'
+STOP_ILLEGAL    = 'illegal'
+STOP_EXIT       = 'exit'
+STOP_TIME       = 'time'
+STOP_FAULT      = 'fault'
+
+# machine timer interrupt number (as in the RISC-V mip / mie registers)
+TIMER_INTERRUPT = 7
+
+
+class machine_stop(Exception):
+    def __init__(self, reason):
+        """
+        stop execution with one of the STOP_* reasons
+        """
+        super().__init__(reason)
+        self.reason = reason
+
+
+class interrupt_controller:
+    def __init__(self):
+        """
+        no interrupt pending, all interrupts enabled, timer off
+        """
+        self.pending    = 0
+        self.enabled    = ~0
+        self.cause      = None      # interrupt taken by the last WFI
+
+        self.deadline   = None      # time.monotonic() at which the timer fires
+        self.period     = None      # seconds between timer interrupts (None = one-shot)
+
+        # asyncio event of a machine waiting in run(), set when an interrupt arrives
+        self.event      = None
+
+    def raise_interrupt(self, n):
+        """
+        set interrupt n pending and wake the machine if it waits for an interrupt
+        """
+        self.pending |= 1 << n
+        if self.event is not None:
+            self.event.set()
+
+    def set_timer(self, seconds, period=None):
+        """
+        raise TIMER_INTERRUPT in seconds from now (and every period seconds after that, if given)
+        """
+        self.deadline = time.monotonic() + seconds
+        self.period = period
+
+    def cancel_timer(self):
+        self.deadline = None
+        self.period = None
+
+    def poll(self):
+        """
+        fire the timer if its deadline has passed, returns the pending enabled interrupts
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.pending |= 1 << TIMER_INTERRUPT
+            if self.period is None:
+                self.deadline = None
+            else:
+                self.deadline = max(self.deadline + self.period, time.monotonic())
+        return self.pending & self.enabled
+
+    def acknowledge(self):
+        """
+        take the lowest pending enabled interrupt: clear it and return its number (None if nothing is pending)
+        """
+        active = self.poll()
+        if not active:
+            return None
+        n = (active & -active).bit_length() - 1
+        self.pending &= ~(1 << n)
+        self.cause = n
+        return n
+
+    async def wait(self):
+        """
+        sleep until an interrupt is pending (raise_interrupt or the timer), without using the cpu
+        """
+        while not self.poll():
+            self.event = asyncio.Event()
+            timeout = None if self.deadline is None else max(0, self.deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.event = None
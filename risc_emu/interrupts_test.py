@@ -0,0 +1,103 @@
+"""
+This is a test for HALT / WFI, stop reasons, the interrupt / timer controller and the run() coroutine
+"""
+
+import asyncio
+import time
+from machine import machine
+from assembler import assembler
+from programs import fibonacci
+from interrupts import STOP_END, STOP_COUNT, STOP_HALT, STOP_WFI, STOP_ILLEGAL, TIMER_INTERRUPT
+
+a0, a1, sp = 10, 11, 2
+
+def ticker():
+    """
+    count a1 interrupts in a0
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', a0, 0, 0)
+    a.addLabel('loop')
+    a.storeAssembly('WFI')
+    a.storeAssembly('ADDi', a0, a0, 1)
+    a.storeAssembly('BNE', a0, a1, 'loop')
+    a.addLabel('end')
+    a.storeAssembly('HALT')
+    return a
+
+#-------------------------------------------------------------------------------
+# Test 1: HALT and illegal instructions return a stop reason (both engines)
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    m = machine(mem_size=1000)
+    m.addLabel('start')
+    m.storeAssembly('ADDi', a0, 0, 5)
+    m.storeAssembly('HALT')
+    m.storeAssembly('ADDi', a0, a0, 1)
+    m.addLabel('illegal')
+    m.write_i32(-1, m.pc)
+    m.pc += 4
+    m.addLabel('end')
+
+    assert(m.execute('start', 'end', engine=engine) == STOP_HALT and m.registers[a0] == 5 and m.pc == 8)
+    assert(m.execute(None, 'end', engine=engine) == STOP_ILLEGAL and m.registers[a0] == 6)
+    assert(m.pc == m.getLabel('illegal'))
+    assert(m.execute('start', 'end', 1, engine=engine) == STOP_COUNT and m.pc == 4)
+    assert(m.execute(None, 'illegal', 100, engine=engine) == STOP_HALT)
+    assert(m.execute(None, 'illegal', 100, engine=engine) == STOP_END)
+print("Test 1: HALT / illegal instructions stop execute()")
+
+try:
+    m.storeAssembly('CMP', 1, 2)
+    assert(False)
+except ValueError as error:
+    print("Test 1: " + str(error))
+
+#-------------------------------------------------------------------------------
+# Test 2: WFI waits until an interrupt is pending
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    m = machine(mem_size=1000)
+    ticker().assemble().load(m, 0)
+    m.registers[a1] = 2
+    assert(m.execute('start', 'end', engine=engine) == STOP_WFI and m.pc == 4)
+    assert(m.execute(None, 'end', engine=engine) == STOP_WFI and m.pc == 4)  # still nothing pending
+
+    m.interrupts.raise_interrupt(3)
+    assert(m.execute(None, 'end', engine=engine) == STOP_WFI and m.registers[a0] == 1 and m.interrupts.cause == 3)
+    m.interrupts.raise_interrupt(5)
+    assert(m.execute(None, 'end', engine=engine) == STOP_END and m.registers[a0] == 2)
+print("Test 2: WFI stops and resumes on interrupts")
+
+#-------------------------------------------------------------------------------
+# Test 3: one event loop multiplexes idle guests (timer interrupts) and busy guests
+#-------------------------------------------------------------------------------
+async def main(idle, busy):
+    guests = []
+    for i in range(idle):
+        m = machine(mem_size=1000)
+        ticker().assemble().load(m, 0)
+        m.registers[a1] = 3
+        m.interrupts.set_timer(0.02, period=0.02)
+        guests.append(m)
+    for n in range(busy):
+        m = machine(mem_size=8000)
+        fibonacci(15).assemble().load(m, 0)
+        m.registers[sp] = 7000
+        guests.append(m)
+    reasons = await asyncio.gather(*[m.run('start', 'end', slice_instructions=1000) for m in guests])
+    return guests, reasons
+
+wall, cpu = time.perf_counter(), time.process_time()
+guests, reasons = asyncio.run(main(200, 0))
+wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+assert(reasons == [STOP_END] * 200 and all(m.registers[a0] == 3 for m in guests))
+assert(all(m.interrupts.cause == TIMER_INTERRUPT for m in guests))
+print("Test 3: 200 idle guests, 3 timer ticks each: %.0f ms wall, %.0f ms cpu" % (wall * 1000, cpu * 1000))
+assert(cpu < wall)
+
+guests, reasons = asyncio.run(main(100, 4))
+assert(reasons == [STOP_END] * 104)
+assert([m.registers[a0] for m in guests] == [3] * 100 + [610] * 4)
+print("Test 3: 100 idle and 4 busy guests on one event loop")
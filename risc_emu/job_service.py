@@ -0,0 +1,552 @@
+"""
+Local job service of the risc machine: an asyncio server on a Unix socket or a localhost TCP port that runs
+assembled programs (assembler.program_image) with their inputs on a pool of warm worker processes.
+
+    service = job_service(workers=4, queue_size=256)
+    await service.start(path='/tmp/risc.sock')              # or host='127.0.0.1', port=0 (see service.port)
+
+    client = await connect(path='/tmp/risc.sock')
+    future = await client.submit(image, registers={a0: 20, sp: 1 << 16}, ranges=[(0x1000, 64)], seconds=1.0)
+    result = await future                                   # service_result: registers, pc, memory, stop_reason
+    print(await client.metrics())
+    await client.close()
+    await service.close()
+
+or as a process: python job_service.py --unix /tmp/risc.sock --workers 4
+
+Submitted jobs wait in a bounded asyncio queue. While it is full the server stops reading from the connections
+that submit, their socket buffers fill up and the clients wait in submit() (drain): the backpressure reaches
+the clients instead of growing the memory of the server. One dispatcher per worker takes jobs from the queue
+and streams every result back to its connection as soon as it is done (in completion order, by job id).
+
+The worker processes start with the service and construct an empty machine for every (mem_size, backend) in
+warm. The first job of a program image in a worker loads it into a clone of the empty machine and snapshots
+it; every job of that image restores the snapshot (copies back only the pages the previous job wrote, decoded
+instructions stay cached), resets the system calls, interrupts and exit status, writes its inputs and runs.
+A result carries the stop reason (see interrupts.py), the exit status and the queue / run time of its job,
+metrics() the totals, throughput and latency percentiles of the service.
+
+Protocol: frames of FRAME (header length, payload length) + a JSON header + a binary payload
+    submit      {'op': 'submit', 'id', 'mem_size', 'backend', 'base', 'symbols', 'image': length,
+                 'memory': [[address, length]], 'registers': [[register, value]], 'start', 'end',
+                 'instructions', 'seconds', 'engine', 'ranges': [[address, length]]}
+                payload: the image words, then the memory inputs
+    result      {'op': 'result', 'id', 'stop_reason', 'fault', 'exit_code', 'registers', 'pc', 'ranges',
+                 'queue_ms', 'run_ms', 'latency_ms'}, payload: the bytes of the ranges
+    metrics     {'op': 'metrics', 'id'}, answered by {'op': 'metrics', 'id', 'metrics'}
+    error       {'op': 'error', 'id', 'message'}: the job could not run (bad request, exception in the worker)
+"""
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from machine import machine, wrap32
+from runner import job_result, write_memory
+from interrupts import interrupt_controller, STOP_FAULT
+
+# header length, payload length
+FRAME               = struct.Struct('<II')
+MAX_FRAME           = 64 << 20
+MAX_MEM_SIZE        = 64 << 20
+
+# jobs waiting for a worker before the server stops reading submissions
+QUEUE_SIZE          = 256
+# (mem_size, backend) of the empty machines every worker constructs when it starts
+WARM                = ((1 << 16, 'numpy'), (1 << 20, 'numpy'))
+# snapshotted machines with a loaded image kept per worker
+WARM_IMAGES         = 16
+# time budget of a job in seconds (also the longest a job may ask for), None: no limit
+JOB_SECONDS         = 10.0
+# completed jobs the latency percentiles and the recent throughput are taken from
+LATENCY_WINDOW      = 1000
+
+MEM_SIZE            = 1 << 16
+# backends with a flat memory (see runner.write_memory)
+BACKENDS            = ('numpy', 'native')
+ENGINES             = ('interpreter', 'block')
+
+
+class job_error(Exception):
+    """
+    a job the service could not run
+    """
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Framing
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+async def read_frame(reader):
+    """
+    (header, payload) of the next frame, (None, None) at the end of the stream
+    """
+    try:
+        head = await reader.readexactly(FRAME.size)
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            raise
+        return None, None
+    header_length, payload_length = FRAME.unpack(head)
+    if header_length + payload_length > MAX_FRAME:
+        raise ValueError("frame of %d bytes" % (header_length + payload_length))
+    header = json.loads(await reader.readexactly(header_length))
+    return header, await reader.readexactly(payload_length)
+
+def write_frame(writer, header, payload=b''):
+    data = json.dumps(header).encode()
+    writer.write(FRAME.pack(len(data), len(payload)) + data)
+    writer.write(payload)
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Worker side
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+# per worker process: (mem_size, backend) -> empty machine, image key -> snapshotted machine with the image loaded
+worker_machines = {}
+worker_images = collections.OrderedDict()
+
+def worker_init(warm):
+    """
+    construct the empty machines of the worker
+    """
+    for mem_size, backend in warm:
+        worker_machines[(mem_size, backend)] = machine(mem_size, backend=backend)
+
+def worker_ready():
+    return os.getpid()
+
+def image_machine(key, mem_size, backend, words, symbols, base):
+    """
+    the snapshotted machine of an image, loaded into a clone of the empty machine on first use
+    """
+    m = worker_images.get(key)
+    if m is not None:
+        worker_images.move_to_end(key)
+        return m
+    empty = worker_machines.get((mem_size, backend))
+    if empty is None:
+        empty = worker_machines[(mem_size, backend)] = machine(mem_size, backend=backend)
+    m = empty.clone()
+    memoryview(m.memory)[base:base + len(words)] = words
+    m.label_dictionary = {label: base + offset for label, offset in symbols.items()}
+    m.snapshot()
+    worker_images[key] = m
+    if len(worker_images) > WARM_IMAGES:
+        worker_images.popitem(last=False)
+    return m
+
+def reset_job_state(m):
+    """
+    forget the state of the previous job that is not part of the snapshot: system calls (program break, files
+    opened by the guest), exit status, interrupts, LR reservation and fault
+    """
+    if m.syscalls is not None:
+        m.syscalls.close_all()
+        m.syscalls = None
+    m.exit_code = None
+    m.interrupts = interrupt_controller()
+    m.reservation = None
+    m.fault = None
+
+def run_service_job(task):
+    """
+    run one job in a worker, returns (stop reason, fault, exit code, registers, pc, [bytes of every range],
+    run seconds)
+    """
+    key, mem_size, backend, words, symbols, base, registers, memory, start, end, count, seconds, engine, ranges = task
+    m = image_machine(key, mem_size, backend, words, symbols, base)
+    m.restore()
+    reset_job_state(m)
+    for reg, value in registers:
+        m.registers[reg] = value
+    write_memory(m, memory)
+
+    t = time.perf_counter()
+    reason = m.execute(start, end, count, engine, seconds)
+    t = time.perf_counter() - t
+    return (reason, str(m.fault) if reason == STOP_FAULT else None, m.exit_code, [int(r) for r in m.registers],
+            int(m.pc), [bytes(m.memory[addr:addr + length]) for addr, length in ranges], t)
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Server side
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+class job_service:
+    def __init__(self, workers=None, queue_size=QUEUE_SIZE, warm=WARM, job_seconds=JOB_SECONDS):
+        """
+        workers:        worker processes (None: one per core)
+        queue_size:     jobs waiting for a worker before the server stops reading submissions
+        warm:           [(mem_size, backend)] of the empty machines every worker constructs when it starts
+        job_seconds:    time budget of a job (also the longest a job may ask for), None: no limit
+        """
+        self.workers        = workers or os.cpu_count() or 1
+        self.queue_size     = queue_size
+        self.warm           = [tuple(w) for w in warm]
+        self.job_seconds    = job_seconds
+
+        self.pool           = None
+        self.server         = None
+        self.queue          = None
+        self.dispatchers    = []
+        self.connections    = set()
+        self.worker_pids    = set()
+        self.pool_restarts  = 0
+        self.path           = None
+        self.host           = None
+        self.port           = None
+
+        self.started        = None
+        self.submitted      = 0
+        self.completed      = 0
+        self.failed         = 0
+        self.running        = 0
+        # (done, queue seconds, run seconds, latency seconds) of the most recent jobs
+        self.recent         = collections.deque(maxlen=LATENCY_WINDOW)
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        """
+        start the workers and listen on the Unix socket path, or on host:port (port 0: any free port, see self.port)
+        """
+        await self.start_pool()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.dispatchers = [asyncio.create_task(self.dispatch()) for i in range(self.workers)]
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.serve, path=path)
+            self.path = path
+        else:
+            self.server = await asyncio.start_server(self.serve, host, port)
+            self.host, self.port = self.server.sockets[0].getsockname()[:2]
+        self.started = time.perf_counter()
+        return self
+
+    async def start_pool(self):
+        """
+        start a new pool of workers, they start (and construct their machines) now, not with the first jobs
+        """
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        pool = self.pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=worker_init,
+                                               initargs=(self.warm,))
+        loop = asyncio.get_running_loop()
+        self.worker_pids = set(await asyncio.gather(*[loop.run_in_executor(pool, worker_ready)
+                                                      for i in range(self.workers)]))
+
+    async def replace_pool(self, broken):
+        """
+        a worker process of the pool broken died: shut it down and start a new pool (once, whichever
+        dispatcher sees the broken pool first)
+        """
+        if self.pool is broken:
+            self.pool_restarts += 1
+            broken.shutdown(wait=False, cancel_futures=True)
+            await self.start_pool()
+
+    async def close(self):
+        """
+        stop listening, close the connections, drop the queued jobs and stop the workers
+        """
+        self.server.close()
+        for writer in list(self.connections):
+            writer.close()
+        await self.server.wait_closed()
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        # a running job finishes first (at most job_seconds), without blocking the event loop
+        await asyncio.get_running_loop().run_in_executor(None, lambda: self.pool.shutdown(cancel_futures=True))
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def serve(self, reader, writer):
+        """
+        read the frames of one connection: queue its jobs (waits while the queue is full), answer metrics
+        """
+        self.connections.add(writer)
+        try:
+            while True:
+                header, payload = await read_frame(reader)
+                if header is None:
+                    break
+                op, job_id = header.get('op'), header.get('id')
+                if op == 'submit':
+                    try:
+                        task = self.task(header, payload)
+                    except (KeyError, TypeError, ValueError) as error:
+                        write_frame(writer, {'op': 'error', 'id': job_id, 'message': 'bad job: %s' % error})
+                        await writer.drain()
+                        continue
+                    self.submitted += 1
+                    await self.queue.put((writer, job_id, task, time.perf_counter()))
+                elif op == 'metrics':
+                    write_frame(writer, {'op': 'metrics', 'id': job_id, 'metrics': self.metrics()})
+                    await writer.drain()
+                else:
+                    write_frame(writer, {'op': 'error', 'id': job_id, 'message': 'unknown operation %r' % op})
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass                # broken connection or frame: drop the connection
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    def task(self, header, payload):
+        """
+        the worker task of a submit frame, raises ValueError / KeyError / TypeError for a bad job
+        """
+        mem_size = int(header.get('mem_size', MEM_SIZE))
+        backend = header.get('backend', 'numpy')
+        engine = header.get('engine', 'interpreter')
+        if not 0 < mem_size <= MAX_MEM_SIZE or backend not in BACKENDS or engine not in ENGINES:
+            raise ValueError("mem_size %d, backend %r, engine %r" % (mem_size, backend, engine))
+
+        base, length = int(header.get('base', 0)), int(header['image'])
+        words = bytes(payload[:length])
+        symbols = {str(label): int(offset) for label, offset in header.get('symbols', {}).items()}
+        if base < 0 or base + length > mem_size or length % 4:
+            raise ValueError("image of %d bytes at %d" % (length, base))
+        memory, offset = {}, length
+        for addr, size in header.get('memory', []):
+            if addr < 0 or addr + size > mem_size:
+                raise ValueError("input of %d bytes at %d" % (size, addr))
+            memory[int(addr)] = payload[offset:offset + size]
+            offset += size
+        if offset != len(payload):
+            raise ValueError("payload of %d bytes for %d bytes of image and inputs" % (len(payload), offset))
+        registers = [(int(reg), wrap32(int(value))) for reg, value in header.get('registers', [])]
+        if any(not 0 < reg < 32 for reg, value in registers):
+            raise ValueError("registers %s" % registers)
+        ranges = [(int(addr), int(size)) for addr, size in header.get('ranges', [])]
+        if any(addr < 0 or size < 0 or addr + size > mem_size for addr, size in ranges):
+            raise ValueError("ranges %s" % ranges)
+
+        seconds = header.get('seconds')
+        if seconds is None or (self.job_seconds is not None and float(seconds) > self.job_seconds):
+            seconds = self.job_seconds
+        key = (hashlib.sha1(words + json.dumps(symbols, sort_keys=True).encode()).hexdigest(), base, mem_size,
+               backend)
+        return (key, mem_size, backend, words, symbols, base, registers, memory, header.get('start', 'start'),
+                header.get('end', 'end'), int(header.get('instructions', 0)),
+                None if seconds is None else float(seconds), engine, ranges)
+
+    async def dispatch(self):
+        """
+        run queued jobs on the pool one at a time and send each result to the connection of its job
+        if a worker process dies, the jobs running on the pool fail and the pool is replaced for the next jobs
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            writer, job_id, task, received = await self.queue.get()
+            started = time.perf_counter()
+            self.running += 1
+            pool = self.pool
+            try:
+                reason, fault, exit_code, registers, pc, ranges, run = \
+                    await loop.run_in_executor(pool, run_service_job, task)
+            except Exception as error:
+                if isinstance(error, BrokenProcessPool):
+                    await self.replace_pool(pool)
+                self.failed += 1
+                header = {'op': 'error', 'id': job_id, 'message': '%s: %s' % (type(error).__name__, error)}
+                payload = b''
+            else:
+                done = time.perf_counter()
+                self.completed += 1
+                self.recent.append((done, started - received, run, done - received))
+                header = {'op': 'result', 'id': job_id, 'stop_reason': reason, 'fault': fault,
+                          'exit_code': exit_code, 'registers': registers, 'pc': pc,
+                          'ranges': [[addr, len(data)] for (addr, size), data in zip(task[-1], ranges)],
+                          'queue_ms': (started - received) * 1e3, 'run_ms': run * 1e3,
+                          'latency_ms': (done - received) * 1e3}
+                payload = b''.join(ranges)
+            finally:
+                self.running -= 1
+            if not writer.is_closing():
+                write_frame(writer, header, payload)
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+    def metrics(self):
+        """
+        job counts, pool restarts (after a worker died), throughput (jobs / s since the start and over the recent
+        jobs) and the mean / p50 / p95 / max
+        queue time, run time and latency (queue + run + transfer to the worker) of the recent jobs, in ms
+        """
+        uptime = time.perf_counter() - self.started if self.started is not None else 0.0
+        recent = np.array(self.recent, dtype=np.float64).reshape(-1, 4)
+        window = recent[-1, 0] - recent[0, 0] if len(recent) > 1 else 0.0
+        metrics = {'workers': self.workers, 'pool_restarts': self.pool_restarts, 'submitted': self.submitted, 'completed': self.completed,
+                   'failed': self.failed, 'queued': self.queue.qsize() if self.queue is not None else 0,
+                   'running': self.running, 'uptime_s': uptime,
+                   'throughput': self.completed / uptime if uptime else 0.0,
+                   'recent_throughput': (len(recent) - 1) / window if window else 0.0}
+        for column, name in [(1, 'queue_ms'), (2, 'run_ms'), (3, 'latency_ms')]:
+            values = recent[:, column] * 1e3
+            metrics[name] = {'mean': float(values.mean()), 'p50': float(np.percentile(values, 50)),
+                             'p95': float(np.percentile(values, 95)), 'max': float(values.max())} \
+                            if len(values) else {'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'max': 0.0}
+        return metrics
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Client side
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+class service_result(job_result):
+    def __init__(self, header, payload):
+        """
+        job_result of a job run by the service, with its stop reason (and fault message for STOP_FAULT, exit
+        status for STOP_EXIT) and its queue / run / latency times in ms
+        """
+        memory, offset = {}, 0
+        for addr, length in header['ranges']:
+            memory[addr] = payload[offset:offset + length]
+            offset += length
+        job_result.__init__(self, np.array(header['registers'], dtype=np.int32), header['pc'], memory)
+        self.stop_reason    = header['stop_reason']
+        self.fault          = header['fault']
+        self.exit_code      = header['exit_code']
+        self.queue_ms       = header['queue_ms']
+        self.run_ms         = header['run_ms']
+        self.latency_ms     = header['latency_ms']
+
+
+class job_client:
+    def __init__(self, reader, writer):
+        """
+        client of a job service on the connection (reader, writer), see connect
+        """
+        self.reader     = reader
+        self.writer     = writer
+        self.next_id    = 0
+        # job / request id -> future of its answer
+        self.pending    = {}
+        self.receiver   = asyncio.create_task(self.receive())
+
+    async def submit(self, image, registers=None, memory=None, start='start', end='end', instructionCount=0,
+                     seconds=None, ranges=(), engine='interpreter', mem_size=MEM_SIZE, base=0, backend='numpy'):
+        """
+        send a job, returns an asyncio future of its service_result (waits while the service pushes back)
+        image:          assembler.program_image, loaded at base into a machine of mem_size bytes
+        registers:      {register: value} set before the run
+        memory:         {address: bytes or int} written before the run (an int is written as a 32-bit word)
+        start, end, instructionCount, seconds, engine: as for machine.execute (seconds is capped by the service)
+        ranges:         [(address, length)] memory ranges returned with the result
+        """
+        segments, data = [], [image.words.astype('<u4').tobytes()]
+        for addr, value in (memory or {}).items():
+            value = struct.pack('<I', int(value) & 0xFFFFFFFF) if isinstance(value, (int, np.integer)) else bytes(value)
+            segments.append([addr, len(value)])
+            data.append(value)
+        header = {'op': 'submit', 'id': self.next_id, 'mem_size': mem_size, 'backend': backend, 'base': base,
+                  'symbols': image.symbols, 'image': len(data[0]), 'memory': segments,
+                  'registers': [[int(reg), int(value)] for reg, value in (registers or {}).items()],
+                  'start': start, 'end': end, 'instructions': instructionCount, 'seconds': seconds,
+                  'engine': engine, 'ranges': [list(r) for r in ranges]}
+        future = self.request(header, b''.join(data))
+        await self.writer.drain()
+        return future
+
+    async def run(self, image, **kwargs):
+        """
+        submit a job and wait for its service_result
+        """
+        return await (await self.submit(image, **kwargs))
+
+    async def metrics(self):
+        """
+        the metrics of the service (see job_service.metrics)
+        """
+        future = self.request({'op': 'metrics', 'id': self.next_id})
+        await self.writer.drain()
+        return await future
+
+    def request(self, header, payload=b''):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[header['id']] = future
+        self.next_id += 1
+        write_frame(self.writer, header, payload)
+        return future
+
+    async def receive(self):
+        """
+        hand every answer of the service to the future of its request
+        """
+        try:
+            while True:
+                header, payload = await read_frame(self.reader)
+                if header is None:
+                    break
+                future = self.pending.pop(header.get('id'), None)
+                if future is None or future.done():
+                    continue
+                if header['op'] == 'result':
+                    future.set_result(service_result(header, payload))
+                elif header['op'] == 'metrics':
+                    future.set_result(header['metrics'])
+                else:
+                    future.set_exception(job_error(header.get('message')))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("the job service closed the connection"))
+            self.pending.clear()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self.receiver
+
+
+async def connect(path=None, host='127.0.0.1', port=None):
+    """
+    job_client of the service listening on the Unix socket path, or on host:port
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    return job_client(reader, writer)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local job service of the risc machine')
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7411)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help='queued jobs before backpressure')
+    parser.add_argument('--job-seconds', type=float, default=JOB_SECONDS, help='time budget of a job')
+    args = parser.parse_args()
+
+    async def main():
+        service = job_service(args.workers, args.queue_size, job_seconds=args.job_seconds)
+        await service.start(args.unix, args.host, args.port)
+        print("job service: %d workers on %s" % (service.workers, args.unix or '%s:%d' % (service.host, service.port)))
+        try:
+            await service.server.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,180 @@
+"""
+This is a test for the local job service: a client submits assembled programs with inputs over a Unix socket
+and over localhost TCP, and gets back results, stop reasons, errors and the metrics of the service
+"""
+
+import asyncio
+import os
+import signal
+import tempfile
+import time
+
+import numpy as np
+
+from assembler import assembler
+from programs import fibonacci, memcpy
+from job_service import job_service, connect, job_error
+from interrupts import STOP_END, STOP_TIME, STOP_FAULT, STOP_COUNT, STOP_EXIT
+from syscalls import SYS_BRK, SYS_EXIT
+
+zero, sp, s1, a0, a1, a2, a7 = 0, 2, 9, 10, 11, 12, 17
+MEM_SIZE = 1 << 16
+
+fib = [0, 1]
+for i in range(30): fib.append(fib[-1] + fib[-2])
+
+def spin():
+    """
+    count in a0 forever
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.addLabel('loop')
+    a.storeAssembly('ADDi', a0, a0, 1)
+    a.storeAssembly('JAL', zero, 'loop')
+    a.addLabel('end')
+    return a
+
+def grow_heap():
+    """
+    s1 = brk(brk(0) + 64), exit(3)
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', a7, zero, SYS_BRK)
+    a.storeAssembly('ADDi', a0, zero, 0)
+    a.storeAssembly('ECALL')
+    a.storeAssembly('ADDi', a0, a0, 64)
+    a.storeAssembly('ECALL')
+    a.storeAssembly('ADD', s1, zero, a0)
+    a.storeAssembly('ADDi', a7, zero, SYS_EXIT)
+    a.storeAssembly('ADDi', a0, zero, 3)
+    a.storeAssembly('ECALL')
+    a.addLabel('end')
+    return a
+
+async def main(path):
+    service = await job_service(workers=2, queue_size=4, job_seconds=2.0).start(path=path)
+    tcp = await job_service(workers=1).start(port=0)
+    fib_image, memcpy_image, spin_image = fibonacci().assemble(), memcpy().assemble(), spin().assemble()
+
+    #-------------------------------------------------------------------------------
+    # Test 1: results over a Unix socket and TCP
+    #-------------------------------------------------------------------------------
+    client = await connect(path=path)
+    result = await client.run(fib_image, registers={a0: 15, sp: MEM_SIZE})
+    assert(result.stop_reason == STOP_END and result.registers[a0] == fib[15] and result.pc == fib_image.symbols['end'])
+    assert(result.latency_ms >= result.run_ms > 0)
+
+    data = (np.arange(100, dtype=np.int32) * 3 - 7).astype('<i4').tobytes()
+    result = await client.run(memcpy_image, registers={a0: 0x1000, a1: 0x2000, a2: 100}, memory={0x1000: data, 0x1400: 5},
+                              ranges=[(0x2000, 400), (0x1400, 4)])
+    assert(result.memory == {0x2000: data, 0x1400: (5).to_bytes(4, 'little')})
+
+    other = await connect(port=tcp.port)
+    result = await other.run(fib_image, registers={a0: 20, sp: 1 << 20}, mem_size=1 << 20, backend='native',
+                             engine='block')
+    assert(result.registers[a0] == fib[20])
+    await other.close()
+    print("Test 1: fibonacci and memcpy over a Unix socket, fibonacci on the block engine over TCP")
+
+    #-------------------------------------------------------------------------------
+    # Test 2: stop reasons and errors
+    #-------------------------------------------------------------------------------
+    t = time.perf_counter()
+    result = await client.run(spin_image, seconds=0.05)
+    assert(result.stop_reason == STOP_TIME and result.registers[a0] > 0 and time.perf_counter() - t < 1)
+    result = await client.run(spin_image, end=None, instructionCount=1001)
+    assert(result.stop_reason == STOP_COUNT and result.registers[a0] == 501)
+    result = await client.run(spin_image)                                       # capped by job_seconds
+    assert(result.stop_reason == STOP_TIME and 2000 <= result.run_ms < 3000)
+
+    result = await client.run(memcpy_image, registers={a0: 0x1000, a1: MEM_SIZE - 8, a2: 100})
+    assert(result.stop_reason == STOP_FAULT and result.fault)
+    for kwargs in [{'start': 'nowhere'}, {'mem_size': 1 << 40}, {'ranges': [(MEM_SIZE, 4)]}, {'engine': 'gpu'}]:
+        try:
+            await client.run(fib_image, **kwargs)
+            assert(False)
+        except job_error as error:
+            message = str(error)
+    result = await client.run(fib_image, registers={a0: 10, sp: MEM_SIZE})    # the connection still works
+    assert(result.registers[a0] == fib[10])
+
+    # the program break and exit status of a job do not leak into the next job on the same worker
+    heap_image = grow_heap().assemble()
+    results = [await client.run(heap_image) for i in range(3)]
+    assert(all(r.stop_reason == STOP_EXIT and r.exit_code == 3 for r in results))
+    assert(len(set(int(r.registers[s1]) for r in results)) == 1)
+    result = await client.run(fib_image, registers={a0: 10, sp: MEM_SIZE})
+    assert(result.stop_reason == STOP_END and result.exit_code is None)
+    print("Test 2: time / count / fault stop reasons, errors (%s)" % message)
+
+    #-------------------------------------------------------------------------------
+    # Test 3: many jobs through a short queue, results in completion order
+    #-------------------------------------------------------------------------------
+    n = 200
+    t = time.perf_counter()
+    futures = []
+    for i in range(n):
+        futures.append(await client.submit(fib_image, registers={a0: i % 10, sp: MEM_SIZE}))
+        metrics = await client.metrics() if i % 50 == 0 else metrics
+        assert(metrics['queued'] <= 4)
+    results = await asyncio.gather(*futures)
+    t = time.perf_counter() - t
+    assert([int(r.registers[a0]) for r in results] == [fib[i % 10] for i in range(n)])
+
+    clients = [await connect(path=path) for i in range(4)]
+    results = await asyncio.gather(*[c.run(fib_image, registers={a0: i + 5, sp: MEM_SIZE}) for i, c in enumerate(clients)])
+    assert([int(r.registers[a0]) for r in results] == fib[5:9])
+    for c in clients:
+        await c.close()
+
+    metrics = await client.metrics()
+    # 'nowhere' failed in the worker, the other bad jobs were not queued
+    assert(metrics['submitted'] == n + 16 and metrics['completed'] == n + 15 and metrics['failed'] == 1)
+    assert(metrics['queued'] == 0 and metrics['running'] == 0 and metrics['throughput'] > 0)
+    assert(0 < metrics['run_ms']['p50'] <= metrics['latency_ms']['p95'] <= metrics['latency_ms']['max'])
+    print("Test 3: %d jobs in %.2fs (%.0f jobs/s), latency p50 %.2f ms, p95 %.2f ms, run p50 %.2f ms"
+          % (n, t, n / t, metrics['latency_ms']['p50'], metrics['latency_ms']['p95'], metrics['run_ms']['p50']))
+
+    #-------------------------------------------------------------------------------
+    # Test 4: closing the service fails pending jobs
+    #-------------------------------------------------------------------------------
+    future = await client.submit(spin_image)
+    await service.close()
+    try:
+        await future
+        assert(False)
+    except ConnectionError:
+        pass
+    await client.close()
+    await tcp.close()
+    assert(not os.path.exists(path))
+    print("Test 4: closed with a running job")
+
+    #-------------------------------------------------------------------------------
+    # Test 5: a worker that dies fails its job, the next jobs run on a new pool
+    #-------------------------------------------------------------------------------
+    service = await job_service(workers=1).start(port=0)
+    client = await connect(port=service.port)
+    future = await client.submit(spin_image, seconds=5)
+    while (await client.metrics())['running'] == 0:
+        await asyncio.sleep(0.01)
+    pids = set(service.worker_pids)
+    os.kill(pids.pop(), signal.SIGKILL)
+    try:
+        await future
+        assert(False)
+    except job_error as error:
+        message = str(error)
+    result = await client.run(fib_image, registers={a0: 12, sp: MEM_SIZE})
+    assert(result.registers[a0] == fib[12] and not (service.worker_pids & pids))
+    metrics = await client.metrics()
+    assert(metrics['pool_restarts'] == 1 and metrics['failed'] == 1 and metrics['completed'] == 1)
+    await client.close()
+    await service.close()
+    print("Test 5: killed worker (%s), new pool" % message.split(':')[0])
+
+directory = tempfile.mkdtemp()
+asyncio.run(main(os.path.join(directory, 'jobs.sock')))
+os.rmdir(directory)
@@ -4,19 +4,193 @@ The current implementation does not support encoding / decoding instructionself.
 """
 
 import numpy as np  #not necessarily needed, but it will make things easier
+import asyncio
 import fnmatch
 import time
+from contextlib import nullcontext
+from struct import pack_into, unpack_from, error as struct_error
+
+from translator import translator
+from backends import get_backend
+from snapshot import snapshot, PAGE_SHIFT
+from profiler import profiler, BUFFER_SIZE
+from execution_trace import trace_writer, BUFFER_RECORDS as TRACE_BUFFER_RECORDS
+from mmio import mmio_bus
+from syscalls import syscall_table
+from fusion import fusion
+from vectorizer import loop_vectorizer, HOT_THRESHOLD, MIN_ITERATIONS
+from predecoder import decode_table
+from memoizer import call_memo, MAX_ENTRIES as MEMO_ENTRIES
+from checkpoint import checkpoint_log, INTERVAL as CHECKPOINT_INTERVAL
+from timing import timing_model, DATA_BASE, BRANCH_PENALTY, MISS_PENALTY
+from paged_memory import page_fault, PAGE_MASK, PROT_EXEC
+from interrupts import interrupt_controller, machine_stop, STOP_END, STOP_COUNT, STOP_HALT, STOP_WFI, STOP_ILLEGAL, \
+                       STOP_TIME, STOP_FAULT
+
+# instructions per slice of the run() coroutine (between two yields to the event loop)
+SLICE_INSTRUCTIONS = 10000
+
+# time budgets: instructions run before the clock is read first, longest time between two reads of the clock
+TIME_SLICE_INSTRUCTIONS = 1000
+TIME_SLICE_SECONDS = 0.005
+
+# lock of a machine whose memory is not shared with harts in other processes (see harts.py)
+NO_LOCK = nullcontext()
+
+#create instruction encoding for assembly (shared by every machine and the assembler)
+DECODER_DICTIONARY = {
+    '0000000_?????_000_0110011': ['R',  'ADD'      ],
+    '0100000_?????_000_0110011': ['R',  'SUB'      ],
+    '0000000_?????_100_0110011': ['R',  'XOR'      ],
+    '0000000_?????_110_0110011': ['R',  'OR'       ],
+    '0000000_?????_111_0110011': ['R',  'AND'      ],
+    '0000001_?????_000_0110011': ['R',  'MUL'      ],
+    '???????_?????_010_0100011': ['S',  'SW'       ],
+    '???????_?????_000_0010011': ['I',  'ADDi'     ],
+    '???????_?????_010_0000011': ['I',  'LW'       ],
+    '???????_?????_000_1100011': ['B',  'BEQ'      ],
+    '???????_?????_001_1100011': ['B',  'BNE'      ],
+    '???????_?????_101_1100011': ['B',  'BGE'      ],
+    '???????_?????_100_1100011': ['B',  'BLT'      ],
+    '???????_?????_???_1101111': ['J',  'JAL'      ],
+    '???????_?????_000_1100111': ['I',  'JALR'     ],
+    '00010??_00000_010_0101111': ['R',  'LR'       ],      # RV32A, aq / rl bits are ignored
+    '00011??_?????_010_0101111': ['R',  'SC'       ],
+    '00001??_?????_010_0101111': ['R',  'AMOSWAP'  ],
+    '00000??_?????_010_0101111': ['R',  'AMOADD'   ],
+    '0001000_00101_000_1110011': ['N',  'WFI'      ],
+    '0000000_00001_000_1110011': ['N',  'HALT'     ],     # encoded as EBREAK
+    '0000000_00000_000_1110011': ['N',  'ECALL'    ]
+}
+
+# generate assembler dictionary by inverting the decoder dictionary
+# so that key = 'instruction' and value = ['opcode-bits', 'format-type']
+ASM_DICT = {DECODER_DICTIONARY[k][1]: [k, DECODER_DICTIONARY[k][0]] for k in DECODER_DICTIONARY}
+
+# integer fields for the encoder: key = 'instruction' and value = ['format-type', funct7, funct3, opcode]
+# ('?' bits are encoded as 0, format 'N' has no operands and its funct7 field holds the whole funct12)
+ASM_FIELDS = {inst: [typ, int((bits[0:7] + bits[8:13] if typ == 'N' else bits[0:7]).replace('?', '0'), 2),
+                     int(bits[14:17].replace('?', '0'), 2), int(bits[18:25], 2)]
+              for inst, (bits, typ) in ASM_DICT.items()}
+
+
+def pattern_2_mask(pattern):
+    """
+    convert a decoder pattern (funct7_rs2_funct3_opcode, '?' = don't care) into an integer [mask, match] pair
+    """
+    mask = match = 0
+    for bits, lo in zip(pattern.split('_'), (25, 20, 12, 0)):
+        for i, b in enumerate(reversed(bits)):
+            if b != '?':
+                mask  |= 1 << (lo + i)
+                match |= int(b) << (lo + i)
+    return [mask, match]
+
+# integer version of the decoder dictionary: (mask, match, format-type, 'instruction')
+# so a word can be matched with (word & mask) == match instead of fnmatch over a bit-string
+DECODER_MASKS = tuple(tuple(pattern_2_mask(k) + DECODER_DICTIONARY[k]) for k in DECODER_DICTIONARY)
+
+# instructions of excAssembly / instruciton_dictionary (handled by the machine method of the same name)
+INSTRUCTIONS = ('NOP', 'HALT', 'CMP', 'JMP', 'LW', 'SW', 'ADD', 'ADDi', 'SUB', 'XOR', 'AND', 'OR', 'BEQ', 'BNE', 'Li',
+                'BGE', 'BLT', 'JAL', 'MUL', 'JALR', 'WFI', 'LR', 'SC', 'AMOSWAP', 'AMOADD', 'ECALL')
+
+
+# instruction formats: see the table above machine.storeAssembly
+def encode(typ, funct7, funct3, opcode, arg1, arg2, arg3):
+    """
+    encode instructions with integer bit operations, arguments in storeAssembly order after
+    label resolution (LW arguments swapped, B / J targets as offsets from the instruction)
+    works on python ints (one instruction) or numpy int64 arrays (many instructions of one format)
+    """
+    if typ == 'R':
+        return (funct7 << 25) | ((arg3 & 0x1F) << 20) | ((arg2 & 0x1F) << 15) | (funct3 << 12) | ((arg1 & 0x1F) << 7) | opcode
+    if typ == 'I':
+        return ((arg3 & 0xFFF) << 20) | ((arg2 & 0x1F) << 15) | (funct3 << 12) | ((arg1 & 0x1F) << 7) | opcode
+    if typ == 'S':
+        return (((arg2 >> 5) & 0x7F) << 25) | ((arg1 & 0x1F) << 20) | ((arg3 & 0x1F) << 15) | (funct3 << 12) | \
+               ((arg2 & 0x1F) << 7) | opcode
+    if typ == 'B':
+        return (((arg3 >> 12) & 0x1) << 31) | (((arg3 >> 5) & 0x3F) << 25) | ((arg2 & 0x1F) << 20) | ((arg1 & 0x1F) << 15) | \
+               (funct3 << 12) | (((arg3 >> 1) & 0xF) << 8) | (((arg3 >> 11) & 0x1) << 7) | opcode
+    if typ == 'J':
+        return (((arg2 >> 20) & 0x1) << 31) | (((arg2 >> 1) & 0x3FF) << 21) | (((arg2 >> 11) & 0x1) << 20) | \
+               (((arg2 >> 12) & 0xFF) << 12) | ((arg1 & 0x1F) << 7) | opcode
+    if typ == 'N':
+        return (funct7 << 20) | (funct3 << 12) | opcode
+
+
+def wrap32(value):
+    """
+    wrap an int to a signed 32-bit value (two's complement), like an int32 register would
+    """
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
 
 class machine:
-    def __init__(self, mem_size):
+    # instruction encoding tables, shared by all machines
+    decoder_dictionary  = DECODER_DICTIONARY
+    decoder_masks       = DECODER_MASKS
+    asm_dict            = ASM_DICT
+    asm_fields          = ASM_FIELDS
+
+    # per-machine state (no instance __dict__: a machine costs a fixed number of slots, see clone)
+    __slots__ = ('backend', 'memory', 'memory_size', 'paged', 'registers', 'pc', 'flag', 'label_dictionary',
+                 'decode_cache', 'decode_lo', 'decode_hi', 'translator', 'dirty', 'last_snapshot', 'checkpoints',
+                 'profiler', 'tracer', 'timing', 'interrupts', 'stop_reason', 'fault', 'hart_id', 'reservation', 'atomic_lock',
+                 'bus', 'fusion', 'vectorizer', 'memo', 'syscalls', 'exit_code', 'debug', 'excution_time',
+                 'memory_used', 'total_number_of_instructions', 'number_of_branches', 'number_of_arithmatic',
+                 'number_of_load_store')
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Register Names ( RiscV )
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    zero = 0
+    ra = 1
+    sp = 2
+    gp = 3
+    tp = 4
+    t0 = 5
+    t1 = 6
+    t2 = 7
+    s0 = 8
+    s1 = 9
+    a0 = 10
+    a1 = 11
+    a2 = 12
+    a3 = 13
+    a4 = 14
+    a5 = 15
+    a6 = 16
+    a7 = 17
+    s2 = 18
+    s3 = 19
+    s4 = 20
+    s5 = 21
+    s6 = 22
+    s7 = 23
+    s8 = 24
+    s9 = 25
+    s10 = 26
+    s11 = 27
+    t3 = 28
+    t4 = 29
+    t5 = 30
+    t6 = 31
+
+    def __init__(self, mem_size, backend='numpy'):
         """
         Create a CPU state with memory = mem_size, and initialize all registerself.
+        backend selects how registers / memory are stored: 'numpy', 'native' or 'paged' (see backends.py)
         """
-        
+        self.backend        = get_backend(backend)
+
         # create a memory block of mem_size of datatype uint8 and fill it with zeroself.
-        self.memory         = np.zeros(mem_size, dtype=np.uint8)
+        self.memory         = self.backend.memory(mem_size)
         self.memory_size    = mem_size
 
+        # sparse paged memory: words go through memory.read_i32 / write_i32 instead of struct on a flat buffer
+        self.paged          = self.backend.paged
+
         # set registers to 0 ( 32 registers of type: int32)
         # x0        zero        hard-wired zero
         # x1        ra          return address
@@ -31,13 +205,10 @@ class machine:
         # x12-17    a2..a7      function args
         # x18-27    s2..s11     saved registers
         # x28-31    t3..t6      temp
-        self.registers      = np.zeros(32, dtype=np.int32)
+        self.registers      = self.backend.registers()
 
-        # set program counter to 0
-        self.pc             = np.zeros(1, dtype=np.int32)
-
-        #set dictionary with supported instructions
-        self.instruciton_dictionary = {'NOP': self.NOP, 'HALT': self.HALT, 'CMP': self.CMP, 'JMP': self.JMP, 'LW': self.LW, 'SW': self.SW, 'ADD': self.ADD, 'ADDi': self.ADDi, 'SUB': self.SUB, 'XOR': self.XOR, 'AND': self.AND, 'OR': self.OR, 'BEQ': self.BEQ, 'BNE': self.BNE, 'Li': self.Li, 'BGE': self.BGE, 'BLT': self.BLT, 'JAL': self.JAL, 'MUL': self.MUL, 'Li': self.Li, 'JALR': self.JALR}
+        # set program counter to 0 (always a python int)
+        self.pc             = 0
 
         #set flag for comparisons to false
         self.flag           = False
@@ -45,64 +216,56 @@ class machine:
         #create label dictionary empty till a program is loaded
         self.label_dictionary = {}
 
-        #create instruction encoding for assembly
-        self.decoder_dictionary = {
-            '0000000_?????_000_0110011': ['R',  'ADD'      ],
-            '0100000_?????_000_0110011': ['R',  'SUB'      ],
-            '0000000_?????_100_0110011': ['R',  'XOR'      ],
-            '0000000_?????_110_0110011': ['R',  'OR'       ],
-            '0000000_?????_111_0110011': ['R',  'AND'      ],
-            '0000001_?????_000_0110011': ['R',  'MUL'      ],
-            '???????_?????_010_0100011': ['S',  'SW'       ],
-            '???????_?????_000_0010011': ['I',  'ADDi'     ],
-            '???????_?????_010_0000011': ['I',  'LW'       ],
-            '???????_?????_000_1100011': ['B',  'BEQ'      ],
-            '???????_?????_001_1100011': ['B',  'BNE'      ],
-            '???????_?????_101_1100011': ['B',  'BGE'      ],
-            '???????_?????_100_1100011': ['B',  'BLT'      ],
-            '???????_?????_???_1101111': ['J',  'JAL'      ],
-            '???????_?????_000_1100111': ['I',  'JALR'     ]
-        }
-
-        # generate assembler dictionary by inverting the decoder dictionary
-        # so that key = 'instruction' and value = ['opcode-bits', 'format-type']
-        self.asm_dict = {self.decoder_dictionary[k][1]: [k, self.decoder_dictionary[k][0]] for k in self.decoder_dictionary}
+        # decoded-instruction cache: pc -> (handler, operands, 'instruction')
+        # decode_lo / decode_hi bound the cached addresses so stores outside the code skip invalidation
+        self.decode_cache = {}
+        self.decode_lo = mem_size
+        self.decode_hi = -1
 
-        #------------------------------------------------------------------------------------------------------------------------------------------------
-        # Register Names ( RiscV )
-        #------------------------------------------------------------------------------------------------------------------------------------------------
-        self.zero = 0
-        self.ra = 1
-        self.sp = 2
-        self.gp = 3
-        self.tp = 4
-        self.t0 = 5
-        self.t1 = 6
-        self.t2 = 7
-        self.s0 = 8
-        self.s1 = 9
-        self.a0 = 10
-        self.a1 = 11
-        self.a2 = 12
-        self.a3 = 13
-        self.a4 = 14
-        self.a5 = 15
-        self.a6 = 16
-        self.a7 = 17
-        self.s2 = 18
-        self.s3 = 19
-        self.s4 = 20
-        self.s5 = 21
-        self.s6 = 22
-        self.s7 = 23
-        self.s8 = 24
-        self.s9 = 25
-        self.s10 = 26
-        self.s11 = 27
-        self.t3 = 28
-        self.t4 = 29
-        self.t5 = 30
-        self.t6 = 31
+        # basic-block translator, created on first use by execute(engine='block')
+        self.translator = None
+
+        # pages written since the last snapshot (None = no snapshot taken, writes are not tracked)
+        self.dirty = None
+        self.last_snapshot = None
+
+        # checkpoint log of long runs, None while checkpoints are off (see enable_checkpoints)
+        self.checkpoints = None
+
+        # execution profiler, None while profiling is off (see start_profiler)
+        self.profiler = None
+
+        # execution trace writer, None while tracing is off (see start_trace)
+        self.tracer = None
+
+        # cache / cycle timing model, None while it is off (see enable_timing)
+        self.timing = None
+
+        # pending interrupts and timer (see interrupts.py), why the last execute() stopped, the exception of STOP_FAULT
+        self.interrupts = interrupt_controller()
+        self.stop_reason = None
+        self.fault = None
+
+        # hart number, (address, value) reserved by LR, lock held by atomic instructions (see harts.py)
+        self.hart_id = 0
+        self.reservation = None
+        self.atomic_lock = NO_LOCK
+
+        # memory-mapped I/O bus, None until the first device is mapped (see map_device)
+        self.bus = None
+
+        # macro-op fusion of the interpreter, None while fusion is off (see enable_fusion)
+        self.fusion = None
+
+        # hot-loop vectorizer of the block engine, None while it is off (see enable_vectorizer)
+        self.vectorizer = None
+
+        # memoization of pure guest function calls, None while it is off (see enable_memo)
+        self.memo = None
+
+        # system call table, created by the first ECALL unless one is set (see syscalls.py), status of exit
+        self.syscalls = None
+        self.exit_code = None
 
         #------------------------------------------------------------------------------------------------------------------------------------------------
         # Program execution metric
@@ -140,23 +303,36 @@ class machine:
     
     def HALT(self):
         """
-        This instruction halts the CPU and stops further instructions until the next external interrupt is fired.
-        External interrupts are not supported yet. 
+        This instruction halts the CPU: execute() returns with STOP_HALT and pc after the HALT (encoded as EBREAK)
         """
-        while True:
-            #Do Nothing
-            pass
+        self.incrementPC()
+        raise machine_stop(STOP_HALT)
 
-            #TODO: future improvement
-            #if(EXTERNAL_INTERRUPT):
-            #   break
+    def WFI(self):
+        """
+        Wait for interrupt: continue if an interrupt is pending (it is taken, see interrupts.cause),
+        otherwise execute() returns with STOP_WFI and pc stays on the WFI, so resuming waits again
+        """
+        if self.interrupts.acknowledge() is None:
+            raise machine_stop(STOP_WFI)
+        self.incrementPC()
+
+    def ECALL(self):
+        """
+        System call a7 with the arguments in a0..a5, result in a0 (see syscalls.py)
+        pc moves past the ECALL first, so after exit execute(None, ...) would resume after it
+        """
+        if self.syscalls is None:
+            self.syscalls = syscall_table(self)
+        self.incrementPC()
+        self.syscalls.call()
 
     def JMP(self, rd, offset):
         """ 
         save next instruction offset in rd
         increment program counter by offset
         """
-        self.registers[rd] = self.pc + 4
+        self.registers[rd] = wrap32(self.pc + 4)
         self.incrementPC(offset)
 
     def JAL(self, rd, offset):
@@ -167,8 +343,8 @@ class machine:
 
     def JALR(self, rd, rs1, imm): 
         temp = self.pc + 4
-        self.pc = (self.registers[rs1] + imm) & ~1
-        self.registers[rd] = temp
+        self.pc = (int(self.registers[rs1]) + imm) & 0xFFFFFFFE
+        self.registers[rd] = wrap32(temp)
         self.registers[0] = 0
 
     def CMP(self, rs1, rs2):
@@ -183,17 +359,36 @@ class machine:
         """
         Loads a word (32bits) from a memory offset into a general purpose register
         """
-        self.registers[rd] = ((self.memory[self.registers[rs1] + offset + 3] << 24) + (self.memory[self.registers[rs1] + offset + 2] << 16) + (self.memory[self.registers[rs1] + offset + 1] << 8) + (self.memory[self.registers[rs1] + offset]))
+        if self.paged:
+            self.registers[rd] = self.memory.read_i32(int(self.registers[rs1]) + offset)
+        else:
+            # unsigned like the paged path, a negative address must fault instead of indexing from the end
+            self.registers[rd] = unpack_from('<i', self.memory, (int(self.registers[rs1]) + offset) & 0xFFFFFFFF)[0]
         self.incrementPC()
 
+    def LW_io(self, rd, offset, rs1):
+        """
+        LW while devices are mapped: addresses in the bus window are read from the devices (see mmio.py)
+        """
+        addr = (int(self.registers[rs1]) + offset) & 0xFFFFFFFF
+        if self.bus.lo <= addr < self.bus.hi:
+            self.registers[rd] = self.bus.load(addr)
+            self.incrementPC()
+        else:
+            self.LW(rd, offset, rs1)
+
     def SW(self, rs2, offset, rs1):
         """
         Stores a word (32bits) into memory
         """
-        self.memory[self.registers[rs1] + offset]       = self.registers[rs2]
-        self.memory[self.registers[rs1] + offset + 1]   = self.registers[rs2] >> 8
-        self.memory[self.registers[rs1] + offset + 2]   = self.registers[rs2] >> 16
-        self.memory[self.registers[rs1] + offset + 3]   = self.registers[rs2] >> 24
+        addr = (int(self.registers[rs1]) + offset) & 0xFFFFFFFF
+        if self.paged:
+            self.memory.write_i32(self.registers[rs2], addr)
+        else:
+            pack_into('<i', self.memory, addr, self.registers[rs2])
+        self.invalidate_decode(addr)
+        if self.dirty is not None:
+            self.mark_dirty(addr)
         self.incrementPC()
 
     def Li(self, rd, imm):
@@ -209,28 +404,28 @@ class machine:
         """
         Add rs1 and rs2 and store the result in rd
         """
-        self.registers[rd] = self.registers[rs1] + self.registers[rs2]
+        self.registers[rd] = wrap32(int(self.registers[rs1]) + int(self.registers[rs2]))
         self.incrementPC()
 
     def SUB(self, rd, rs1, rs2):
         """
         Subtract rs2 from rs1 and store the result in rd
         """
-        self.registers[rd] = self.registers[rs1] - self.registers[rs2]
+        self.registers[rd] = wrap32(int(self.registers[rs1]) - int(self.registers[rs2]))
         self.incrementPC()
 
     def ADDi(self, rd, rs1, val):
         """
         Add an immediate value (val) to rs1 and store the result in rd
         """
-        self.registers[rd] = self.registers[rs1] + val;
+        self.registers[rd] = wrap32(int(self.registers[rs1]) + val)
         self.incrementPC()
     
     def MUL(self, rd, rs1, rs2):
         """"
         Performs multiplication between rs1 and rs2 and stores the value in rd
         """
-        self.registers[rd] = self.registers[rs1] * self.registers[rs2]
+        self.registers[rd] = wrap32(int(self.registers[rs1]) * int(self.registers[rs2]))
         self.incrementPC()
 
     #------------------------------------------------------------------------------------------------------------------------------------------------
@@ -298,6 +493,76 @@ class machine:
         else:
             self.incrementPC()
     #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Atomic Instructions (RV32A, word only: rd, rs1 = address, rs2)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def LR(self, rd, rs1, rs2):
+        """
+        load reserved: rd = memory[rs1] and reserve the address for SC
+        """
+        addr = int(self.registers[rs1])
+        with self.atomic_lock:
+            value = self.read_i32(addr)
+        self.reservation = (addr, value)
+        self.registers[rd] = value
+        self.incrementPC()
+
+    def SC(self, rd, rs1, rs2):
+        """
+        store conditional: memory[rs1] = rs2 and rd = 0 if the reservation of LR still holds, otherwise rd = 1
+        (the reservation holds while the word still has the value LR loaded, like a compare-and-swap)
+        """
+        addr = int(self.registers[rs1])
+        reservation, self.reservation = self.reservation, None
+        with self.atomic_lock:
+            success = reservation is not None and reservation[0] == addr and self.read_i32(addr) == reservation[1]
+            if success:
+                self.write_i32(self.registers[rs2], addr)
+        self.registers[rd] = 0 if success else 1
+        self.incrementPC()
+
+    def SW_io(self, rs2, offset, rs1):
+        """
+        SW while devices are mapped: addresses in the bus window are written to the devices (see mmio.py)
+        """
+        addr = (int(self.registers[rs1]) + offset) & 0xFFFFFFFF
+        if self.bus.lo <= addr < self.bus.hi:
+            self.bus.store(self.registers[rs2], addr)
+            self.incrementPC()
+        else:
+            self.SW(rs2, offset, rs1)
+
+    def SW_locked(self, rs2, offset, rs1):
+        """
+        SW under the atomic lock, used while harts in other processes share the memory (see harts.py),
+        so a plain store can not fall between the load and the store of an atomic instruction
+        """
+        with self.atomic_lock:
+            self.SW(rs2, offset, rs1)
+
+    def AMOSWAP(self, rd, rs1, rs2):
+        """
+        atomically swap memory[rs1] and rs2, rd = old memory value
+        """
+        addr = int(self.registers[rs1])
+        with self.atomic_lock:
+            value = self.read_i32(addr)
+            self.write_i32(self.registers[rs2], addr)
+        self.registers[rd] = value
+        self.incrementPC()
+
+    def AMOADD(self, rd, rs1, rs2):
+        """
+        atomically add rs2 to memory[rs1], rd = old memory value
+        """
+        addr = int(self.registers[rs1])
+        with self.atomic_lock:
+            value = self.read_i32(addr)
+            self.write_i32(value + int(self.registers[rs2]), addr)
+        self.registers[rd] = value
+        self.incrementPC()
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
     # Program Instructions
     #------------------------------------------------------------------------------------------------------------------------------------------------
 
@@ -324,6 +589,13 @@ class machine:
  
         return 0
         
+    @property
+    def instruciton_dictionary(self):
+        """
+        dictionary with supported instructions: {'instruction': handler} (bound on use, see INSTRUCTIONS)
+        """
+        return {name: getattr(self, name) for name in INSTRUCTIONS}
+
     def excAssembly(self, instruction, arg1, arg2, arg3=0, arg4 =0):
         """
         captures the assembly instructions and store it into memory for future operation
@@ -372,10 +644,14 @@ class machine:
         """
         write 32-bit int to memory (takes 4 byte-addresses)
         """
-        self.memory[addr]     = (x     )  & 0xFF
-        self.memory[addr + 1] = (x >> 8)  & 0xFF
-        self.memory[addr + 2] = (x >> 16) & 0xFF
-        self.memory[addr + 3] = (x >> 24) & 0xFF
+        addr &= 0xFFFFFFFF
+        if self.paged:
+            self.memory.write_i32(wrap32(int(x)), addr)
+        else:
+            pack_into('<i', self.memory, addr, wrap32(int(x)))
+        self.invalidate_decode(addr)
+        if self.dirty is not None:
+            self.mark_dirty(addr)
 
     def bits_2_uint(self, bits):
         """
@@ -391,9 +667,17 @@ class machine:
     
     def read_i32(self, addr):
         """"read 32-bit int from memory"""
-        ret = np.int8(self.memory[addr + 3]) << 3*8
-        for i in range(3): ret += self.memory[addr + i] << i*8
-        return ret
+        if self.paged:
+            return self.memory.read_i32(addr)
+        return unpack_from('<i', self.memory, addr & 0xFFFFFFFF)[0]
+
+    def sext(self, value, bits):
+        """
+        sign-extend the lowest 'bits' bits of an unsigned int
+        """
+        return value - (1 << bits) if value & (1 << (bits - 1)) else value
+
+    pattern_2_mask = staticmethod(pattern_2_mask)
 
     #------------------------------------------------------------------------------------------------------------------------------------------------
     # Encoding functions
@@ -407,27 +691,17 @@ class machine:
     # imm[11:5]         | rs2   |  rs1  | funct3| imm[4:0]          |opcode          S-type
     # imm[12]|imm[10:5] | rs2   |  rs1  | funct3| imm[4:1] imm[11]  |opcode          B-type
     # imm[20]|imm[10:1] imm[11] | imm[19:12]    | rd                |opcode          J-type
-    def storeAssembly(self, instruction, arg1, arg2, arg3=0, arg4 =0):
+    def storeAssembly(self, instruction, arg1=0, arg2=0, arg3=0, arg4 =0):
         """
         stores instruction and arguments into memory after encoding using RiscV user level ISA.
         Using: Volume I: RISC-V User-Level ISA V2.2
         """
-        instr = self.instruciton_dictionary.get(instruction)
-        if(instr):
-            # Use CS 61C Reference Card
-            [opcode_bits, typ] = self.asm_dict[instruction]
-            
-            funct7 = opcode_bits[0:7]
-            funct3 = opcode_bits[14:17]
-            opcode = opcode_bits[18:25]
-     
+        if instruction in self.asm_fields:
+            [typ, funct7, funct3, opcode] = self.asm_fields[instruction]
+
             # swap arg2 and arg3 if instruction is LW 
             if instruction == 'LW':
-                temp2 = arg2
-                temp3 = arg3
-
-                arg2 = temp3
-                arg3 = temp2
+                arg2, arg3 = arg3, arg2
             
             if typ == 'B':
                 arg3 = self.getLabel(arg3)
@@ -437,39 +711,16 @@ class machine:
                 arg2 = self.getLabel(arg2)
                 arg2 -= self.pc
 
-            # TODO: loop throughout the code, find labels and store their offset first, then loop and encode+store into memory
-            #       this will allow the code to be written in a non-linear matter
-
-            rd    = np.binary_repr(arg1, 5)
-            rs1   = np.binary_repr(arg2, 5)
-            rs2   = np.binary_repr(arg3, 5)
-            imm_i = np.binary_repr(arg3, 12)
-            imm_s = np.binary_repr(arg2, 12)
-            imm_j = np.binary_repr(arg2, 21)
-            imm_b = np.binary_repr(arg3, 13)
-
-            if   typ == 'R' : bits = funct7 + rs2  + rs1 + funct3 + rd + opcode
-            elif typ == 'I' : bits = imm_i + rs1 + funct3 + rd + opcode 
-            elif typ == 'S' : bits = self.field(imm_s,11,5) + rd + rs2 + funct3 + \
-                                     self.field(imm_s,4,0) + opcode
-            
-            elif typ == 'J' : bits = self.field(imm_j,20,20) + self.field(imm_j,10,1) + \
-                             self.field(imm_j,11,11) + self.field(imm_j,19,12) + rd + opcode
-            
-            elif typ == 'B' : bits = self.field(imm_b,12,12) + self.field(imm_b,10,5) + rs1 + rd + \
-                        funct3 + self.field(imm_b,4,1)   + self.field(imm_b,11,11) + opcode
-                
+            # labels have to be defined before they are used here, assembler.py resolves forward labels
+
             # write instruction into memory at address 'self.pc'
-            self.write_i32(self.bits_2_uint(bits), self.pc)
+            self.write_i32(encode(typ, funct7, funct3, opcode, arg1, arg2, arg3), self.pc)
             self.incrementPC()
 
             if self.debug == True:
                 self.memory_used += 1
         else:
-            print("ERROR: instruction not supported")
-            if self.debug == True:
-                self.dump()
-            self.HALT()
+            raise ValueError("instruction not supported: " + str(instruction))
         
 
     #------------------------------------------------------------------------------------------------------------------------------------------------
@@ -507,61 +758,507 @@ class machine:
             print('ERROR: this instruction is not supported: ' + bits)
             if self.debug == True:
                 self.dump()
-            self.HALT()
-
-        if inst   == 'JAL'      : self.JAL      (rd,  imm_j)
-        elif inst == 'JALR'     : self.JALR     (rd,  rs1,   imm_i)
-        elif inst == 'BEQ'      : self.BEQ      (rs1, rs2,   imm_b)
-        elif inst == 'BNE'      : self.BNE      (rs1, rs2,   imm_b)
-        elif inst == 'BLT'      : self.BLT      (rs1, rs2,   imm_b)
-        elif inst == 'SW'       : self.SW       (rs2, imm_s, rs1)
-        elif inst == 'ADDi'     : self.ADDi     (rd,  rs1,   imm_i)
-        elif inst == 'ADD'      : self.ADD      (rd,  rs1,   rs2)
-        elif inst == 'SUB'      : self.SUB      (rd,  rs1,   rs2)
-        elif inst == 'XOR'      : self.XOR      (rd,  rs1,   rs2)
-        elif inst == 'OR'       : self.OR       (rd,  rs1,   rs2)
-        elif inst == 'AND'      : self.AND      (rd,  rs1,   rs2)
-        elif inst == 'MUL'      : self.MUL      (rd,  rs1,   rs2)
-        elif inst == 'LW'       : self.LW       (rd,  imm_i, rs1)
-        
+            raise machine_stop(STOP_ILLEGAL)
+
+        handler, operands = self.bind(inst, rd, rs1, rs2, imm_i, imm_s, imm_b, imm_j)
+        handler(*operands)
+
         #print(inst)
         if self.debug == True:
-            self.total_number_of_instructions += 1
-            if inst == 'LW':
-                self.number_of_load_store += 1
-            elif inst in ['ADD', 'ADDi', 'MUL', 'SUB']:
-                self.number_of_arithmatic += 1
-            elif inst in ['BLT', 'BNE', 'BEQ']:
-                self.number_of_branches += 1
+            self.count_instruction(inst)
+
+    def bind(self, inst, rd, rs1, rs2, imm_i, imm_s, imm_b, imm_j):
+        """
+        select the instruction handler and its operands out of the decoded fields
+        """
+        if inst   == 'JAL'      : return self.JAL,  (rd,  imm_j)
+        elif inst == 'JALR'     : return self.JALR, (rd,  rs1,   imm_i)
+        elif inst == 'BEQ'      : return self.BEQ,  (rs1, rs2,   imm_b)
+        elif inst == 'BNE'      : return self.BNE,  (rs1, rs2,   imm_b)
+        elif inst == 'BLT'      : return self.BLT,  (rs1, rs2,   imm_b)
+        elif inst == 'BGE'      : return self.BGE,  (rs1, rs2,   imm_b)
+        elif inst == 'SW'       : return self.store_handler(), (rs2, imm_s, rs1)
+        elif inst == 'ADDi'     : return self.ADDi, (rd,  rs1,   imm_i)
+        elif inst == 'ADD'      : return self.ADD,  (rd,  rs1,   rs2)
+        elif inst == 'SUB'      : return self.SUB,  (rd,  rs1,   rs2)
+        elif inst == 'XOR'      : return self.XOR,  (rd,  rs1,   rs2)
+        elif inst == 'OR'       : return self.OR,   (rd,  rs1,   rs2)
+        elif inst == 'AND'      : return self.AND,  (rd,  rs1,   rs2)
+        elif inst == 'MUL'      : return self.MUL,  (rd,  rs1,   rs2)
+        elif inst == 'LW'       : return self.LW if self.bus is None else self.LW_io, (rd, imm_i, rs1)
+        elif inst == 'LR'       : return self.LR,   (rd,  rs1,   rs2)
+        elif inst == 'SC'       : return self.SC,   (rd,  rs1,   rs2)
+        elif inst == 'AMOSWAP'  : return self.AMOSWAP, (rd, rs1, rs2)
+        elif inst == 'AMOADD'   : return self.AMOADD,  (rd, rs1, rs2)
+        elif inst == 'WFI'      : return self.WFI,  ()
+        elif inst == 'HALT'     : return self.HALT, ()
+        elif inst == 'ECALL'    : return self.ECALL, ()
+
+    def store_handler(self):
+        """
+        handler bound to SW: plain, checking the I/O bus, or under the atomic lock of harts in other processes
+        """
+        if self.bus is not None:
+            return self.SW_io
+        return self.SW if self.atomic_lock is NO_LOCK else self.SW_locked
+
+    def count_instruction(self, inst):
+        """
+        update the program execution metric for one executed instruction
+        """
+        self.total_number_of_instructions += 1
+        if inst in ['LW', 'SW', 'LR', 'SC', 'AMOSWAP', 'AMOADD']:
+            self.number_of_load_store += 1
+        elif inst in ['ADD', 'ADDi', 'MUL', 'SUB']:
+            self.number_of_arithmatic += 1
+        elif inst in ['BLT', 'BNE', 'BEQ', 'BGE', 'JAL', 'JALR']:
+            self.number_of_branches += 1
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Decoded-instruction cache
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def predecode(self, pc):
+        """
+        decode the word at pc and keep the handler + operands in the decode cache,
+        so every address is only decoded once
+        """
+        word = (self.memory.fetch_i32(pc) if self.paged else self.read_i32(pc)) & 0xFFFFFFFF
+        entry = self.decode_word(word)
+        if entry is None:
+            print('ERROR: this instruction is not supported: ' + np.binary_repr(word, 32))
+            if self.debug == True:
+                self.dump()
+            raise machine_stop(STOP_ILLEGAL)
+
+        pc = int(pc)
+        self.decode_cache[pc] = entry
+        self.decode_lo = min(self.decode_lo, pc)
+        self.decode_hi = max(self.decode_hi, pc)
+        return entry
+
+    def decode_word(self, word):
+        """
+        decode a 32-bit instruction word with integer bit operations (no bit-strings / fnmatch)
+        returns (handler, operands, 'instruction') or None if the instruction is not supported
+        """
+        rd     = (word >>  7) & 0x1F
+        rs1    = (word >> 15) & 0x1F
+        rs2    = (word >> 20) & 0x1F
+
+        imm_i  = self.sext(word >> 20, 12)                                                  # I-type
+        imm_s  = self.sext(((word >> 25) << 5) | ((word >> 7) & 0x1F), 12)                  # S-type
+        imm_b  = self.sext(((word >> 31) << 12) | (((word >> 7) & 0x1) << 11) |
+                           (((word >> 25) & 0x3F) << 5) | (((word >> 8) & 0xF) << 1), 13)   # B-type
+        imm_j  = self.sext(((word >> 31) << 20) | (((word >> 12) & 0xFF) << 12) |
+                           (((word >> 20) & 0x1) << 11) | (((word >> 21) & 0x3FF) << 1), 21) # J-type
+
+        for mask, match, typ, inst in self.decoder_masks:
+            if word & mask == match:
+                handler, operands = self.bind(inst, rd, rs1, rs2, imm_i, imm_s, imm_b, imm_j)
+                return (handler, operands, inst)
+        return None
+
+    def predecode_region(self, start, end):
+        """
+        decode every word between labels / addresses start and end at once with numpy (see predecoder.py),
+        put the instructions into the decode cache and return the decode table (e.g. for table.disassemble())
+        """
+        lo, hi = self.getLabel(start), self.getLabel(end)
+        if self.paged:
+            # words are fetched with execute permission: pages without it are not decoded, running them faults
+            words = np.zeros((hi - lo) // 4, dtype='<u4')
+            executable = np.ones(len(words), dtype=bool)
+            a = lo
+            while a < hi:
+                b = min(hi, (a | PAGE_MASK) + 1)
+                try:
+                    words[(a - lo) // 4:(b - lo) // 4] = np.frombuffer(self.memory.read(a, b - a, PROT_EXEC), dtype='<u4')
+                except page_fault:
+                    executable[(a - lo) // 4:(b - lo) // 4] = False
+                a = b
+        else:
+            words = np.frombuffer(self.memory, dtype='<u4', count=(hi - lo) // 4, offset=lo)
+        table = decode_table(words, lo, self.decoder_masks)
+        entries = table.entries(self)
+        if self.paged and not executable.all():
+            entries = {pc: entry for pc, entry in entries.items() if executable[(pc - lo) // 4]}
+        if entries:
+            self.decode_cache.update(entries)
+            self.decode_lo = min(self.decode_lo, min(entries))
+            self.decode_hi = max(self.decode_hi, max(entries))
+        return table
+
+    def invalidate_decode(self, addr):
+        """
+        drop cached decodes overlapping the 4 bytes written at addr, so self-modifying code is decoded again
+        returns True if cached code was overwritten (translated blocks are flushed as well)
+        """
+        hit = False
+        if self.decode_lo - 4 < addr < self.decode_hi + 4:
+            for a in range(addr - 3, addr + 4):
+                if self.decode_cache.pop(a, None) is not None:
+                    hit = True
+            if hit and self.translator is not None:
+                self.translator.flush()
+            if hit and self.memo is not None:
+                self.memo.flush()
+            if hit and self.timing is not None:
+                self.timing.code_changed()
+            if self.fusion is not None:
+                self.fusion.invalidate(addr)
+        return hit
+
+    def memory_written(self, addr, length):
+        """
+        length bytes at addr were written in bulk (DMA): drop the cached decodes and mark the pages dirty
+        """
+        if addr < self.decode_hi + 4 and self.decode_lo - 4 < addr + length:
+            self.flush_decode()
+        if self.dirty is not None:
+            pages = range(addr >> PAGE_SHIFT, ((addr + length - 1) >> PAGE_SHIFT) + 1)
+            self.dirty.update(pages)
+            if self.checkpoints is not None:
+                self.checkpoints.dirty.update(pages)
+        if self.tracer is not None:
+            self.tracer.memory_written(addr, length)
+
+    def flush_decode(self):
+        """
+        empty the decoded-instruction cache
+        """
+        self.decode_cache.clear()
+        self.decode_lo = self.memory_size
+        self.decode_hi = -1
+        if self.translator is not None:
+            self.translator.flush()
+        if self.fusion is not None:
+            self.fusion.flush()
+        if self.memo is not None:
+            self.memo.flush()
+        if self.timing is not None:
+            self.timing.code_changed()
+
+    def step(self):
+        """
+        execute the single instruction at pc
+        """
+        if self.profiler is not None:
+            self.profiler.buffer.append(self.pc)
+        if self.timing is not None:
+            self.record_timing()
+        if self.tracer is not None:
+            entry = self.tracer.step(self)
+        else:
+            entry = self.decode_cache.get(self.pc) or self.predecode(self.pc)
+            entry[0](*entry[1])
+        if self.debug == True:
+            self.count_instruction(entry[2])
 
     #------------------------------------------------------------------------------------------------------------------------------------------------
     # excute from memory functions
     #------------------------------------------------------------------------------------------------------------------------------------------------
 
-    def execute(self, start, end=None, instructionCount=0):
+    def execute(self, start, end=None, instructionCount=0, engine='interpreter', seconds=None):
         """
         Executes code from start label to end label or for instructionCount number of instructions
+        (start = None continues at the current pc; with both end and instructionCount, whichever comes first)
+        seconds: wall-clock budget, execution stops with STOP_TIME once it is used up (see execute_timed)
+        engine = 'interpreter': fetch instructions through the decoded-instruction cache (see predecode)
+        engine = 'block':       run translated basic blocks (see translator.py), hot loops with numpy if the vectorizer is on
+        the interpreter answers pure function calls from the memo cache if memoization is on (execute(start, end) only)
+        the execution metric (debug), the profiler, the tracer and the timing model run in a separate loop, so they
+        cost nothing when off (while tracing or timing, the interpreter is used for every engine)
+        returns why execution stopped: STOP_END, STOP_COUNT, STOP_TIME, STOP_HALT, STOP_WFI, STOP_EXIT, STOP_ILLEGAL
+        or STOP_FAULT (see interrupts.py)
         """
+        if seconds is not None:
+            return self.execute_timed(start, end, instructionCount, engine, seconds)
         if self.debug == True:
             self.excution_time = time.perf_counter()
 
-        self.pc = self.getLabel('start')
-        if end is None:
-            for i in range(instructionCount):
-                inst = self.read_i32(self.pc)  # fetch instruction from memory
-                self.decode(np.binary_repr(np.uint32(inst), 32))
-        else:  # this is for the case where argument 'end' is used
-            while self.pc != self.getLabel(end):
-                inst = self.read_i32(self.pc)  # fetch instruction from memory
-                self.decode(np.binary_repr(np.uint32(inst), 32))
+        cache = self.decode_cache
+        if start is not None:
+            self.pc = self.getLabel(start)
+        end = None if end is None else self.getLabel(end)
+        try:
+            if self.tracer is not None or self.timing is not None or (engine != 'block' and (self.debug or self.profiler is not None)):
+                self.execute_instrumented(end, instructionCount)
+            elif engine == 'block':
+                self.run_blocks(end, instructionCount)
+            elif self.memo is not None and end is not None and not instructionCount:
+                self.memo.run(end)
+            elif self.fusion is not None and end is not None and not instructionCount:
+                self.fusion.run(end)
+            elif end is None:
+                for i in range(instructionCount):
+                    entry = cache.get(self.pc) or self.predecode(self.pc)
+                    entry[0](*entry[1])
+            elif instructionCount:
+                for i in range(instructionCount):
+                    if self.pc == end:
+                        break
+                    entry = cache.get(self.pc) or self.predecode(self.pc)
+                    entry[0](*entry[1])
+            else:  # this is for the case where argument 'end' is used
+                while self.pc != end:
+                    entry = cache.get(self.pc) or self.predecode(self.pc)
+                    entry[0](*entry[1])
+            self.stop_reason = STOP_END if self.pc == end else STOP_COUNT
+        except machine_stop as stop:
+            self.stop_reason = stop.reason
+        except (page_fault, struct_error) as fault:
+            self.stop_reason = STOP_FAULT
+            self.fault = fault
+        if self.syscalls is not None:
+            self.syscalls.flush()
 
         if self.debug == True:
             self.excution_time = time.perf_counter() - self.excution_time
+        return self.stop_reason
+
+    def execute_timed(self, start, end, instructionCount, engine, seconds):
+        """
+        execute in slices until end / instructionCount / a stop, or until seconds have passed (STOP_TIME)
+        the clock is only read between slices: each slice is sized from the speed of the previous one to take
+        at most TIME_SLICE_SECONDS and to end near the deadline (at least one slice runs)
+        """
+        now = time.perf_counter()
+        deadline = now + seconds
+        n = TIME_SLICE_INSTRUCTIONS
+        remaining = instructionCount
+        while True:
+            if instructionCount:
+                n = min(n, remaining)
+            reason = self.execute(start, end, n, engine)
+            start = None
+            if reason != STOP_COUNT:
+                return reason
+            if instructionCount:
+                remaining -= n
+                if not remaining:
+                    return reason
+            last, now = now, time.perf_counter()
+            if now >= deadline:
+                self.stop_reason = STOP_TIME
+                return STOP_TIME
+            n = max(1, int(n / max(now - last, 1e-6) * min(deadline - now, TIME_SLICE_SECONDS)))
+
+    def run_blocks(self, end, instructionCount):
+        """
+        execute with the basic-block translator (created on first use)
+        """
+        if self.translator is None:
+            self.translator = translator(self)
+        self.translator.run(end, instructionCount)
+
+    def execute_instrumented(self, end, instructionCount):
+        """
+        interpreter loop that also updates the execution metric (debug), records pcs for the profiler
+        and / or the timing model and writes the execution trace
+        """
+        cache, debug, prof, tracer, timing = self.decode_cache, self.debug, self.profiler, self.tracer, self.timing
+        if timing is not None:
+            pcs, bases = timing.pcs, timing.bases       # emptied in place by timing.flush
+        budget = instructionCount if end is None or instructionCount else -1   # -1: no instruction limit
+        executed = 0
+        while self.pc != end and executed != budget:
+            pc = self.pc
+            if prof is not None:
+                prof.buffer.append(pc)
+                if len(prof.buffer) >= BUFFER_SIZE: prof.flush()
+            entry = cache.get(pc) or self.predecode(pc)
+            if timing is not None:
+                # pc and base register of a data access, simulated in bulk by timing.flush
+                pcs.append(pc)
+                base = DATA_BASE.get(entry[2])
+                if base is not None:
+                    bases.append(int(self.registers[entry[1][base]]))
+            if tracer is not None:
+                tracer.step(self)
+            else:
+                entry[0](*entry[1])
+            if debug: self.count_instruction(entry[2])
+            executed += 1
+            if timing is not None and len(pcs) >= BUFFER_SIZE: timing.flush()
+
+    async def run(self, start=None, end=None, slice_instructions=SLICE_INSTRUCTIONS, engine='interpreter'):
+        """
+        coroutine version of execute: runs slices of slice_instructions and yields to the event loop between
+        them; while the guest waits in WFI it sleeps until an interrupt arrives, without using the cpu
+        returns why execution stopped, like execute(): STOP_END, STOP_HALT, STOP_ILLEGAL, STOP_EXIT or STOP_FAULT
+        (never STOP_COUNT / STOP_WFI, those slices go on here, and never STOP_TIME, run has no time budget)
+        """
+        if start is not None:
+            self.pc = self.getLabel(start)
+        while True:
+            reason = self.execute(None, end, slice_instructions, engine)
+            if reason == STOP_COUNT:
+                await asyncio.sleep(0)
+            elif reason == STOP_WFI:
+                await self.interrupts.wait()
+            else:
+                return reason
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Profiling (see profiler.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def start_profiler(self):
+        """
+        switch the profiler on (keeps recording into the current profile if it is already on) and return it
+        """
+        if self.profiler is None:
+            self.profiler = profiler(self)
+        return self.profiler
+
+    def stop_profiler(self):
+        """
+        switch the profiler off and return the finished profile
+        """
+        prof = self.profiler
+        if prof is not None:
+            prof.flush()
+        self.profiler = None
+        return prof
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Macro-op fusion (see fusion.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def enable_fusion(self, count=True):
+        """
+        run execute(start, end) on the interpreter with fused instruction pairs / triples, returns the fusion state
+        count: count the executions of every pattern for the report
+        """
+        if self.fusion is None:
+            self.fusion = fusion(self, count)
+        return self.fusion
+
+    def disable_fusion(self):
+        """
+        go back to single-instruction dispatch, returns the fusion state (for its report)
+        """
+        f, self.fusion = self.fusion, None
+        return f
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Hot-loop vectorization (see vectorizer.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def enable_vectorizer(self, threshold=HOT_THRESHOLD, min_iterations=MIN_ITERATIONS):
+        """
+        run hot counted loops of execute(start, end, engine='block') as numpy operations, returns the vectorizer
+        threshold: back edges taken before a loop is analyzed, min_iterations: shortest loop run with numpy
+        """
+        if self.vectorizer is None:
+            self.vectorizer = loop_vectorizer(self, threshold, min_iterations)
+            if self.translator is not None:
+                self.translator.flush()     # translated blocks do not watch their back edges yet
+        return self.vectorizer
+
+    def disable_vectorizer(self):
+        """
+        run every loop through its translated block again, returns the vectorizer (for its report)
+        """
+        v, self.vectorizer = self.vectorizer, None
+        if self.translator is not None:
+            self.translator.flush()
+        return v
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Function-call memoization (see memoizer.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def enable_memo(self, functions=None, max_entries=MEMO_ENTRIES):
+        """
+        answer calls of pure functions in execute(start, end) on the interpreter from a cache, returns the memo
+        functions: labels / addresses of the functions to memoize (None: every JAL target), max_entries: cached calls
+        """
+        if self.memo is None:
+            self.memo = call_memo(self, functions, max_entries)
+        return self.memo
+
+    def disable_memo(self):
+        """
+        run every call again, returns the memo (for its report)
+        """
+        memo, self.memo = self.memo, None
+        return memo
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Execution trace (see execution_trace.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def start_trace(self, path, compress=False, buffer_records=TRACE_BUFFER_RECORDS):
+        """
+        record every executed instruction into a binary trace file at path (zlib-compressed if compress),
+        records are written in chunks of buffer_records
+        """
+        self.stop_trace()
+        self.tracer = trace_writer(self, path, compress, buffer_records)
+        return self.tracer
+
+    def stop_trace(self):
+        """
+        finish and close the trace file
+        """
+        if self.tracer is not None:
+            self.tracer.close()
+        self.tracer = None
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Timing model (see timing.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def enable_timing(self, icache=None, dcache=None, latencies=None, branch_penalty=BRANCH_PENALTY,
+                      miss_penalty=MISS_PENALTY):
+        """
+        estimate cycles of execute() on the interpreter with L1 caches (timing.cache, None: the default geometry)
+        and instruction latencies ({'instruction' or 'class': cycles}), returns the timing model
+        """
+        if self.timing is None:
+            self.timing = timing_model(self, icache, dcache, latencies, branch_penalty, miss_penalty)
+        return self.timing
+
+    def disable_timing(self):
+        """
+        switch the timing model off and return it (for its report)
+        """
+        t, self.timing = self.timing, None
+        if t is not None:
+            t.flush()
+        return t
+
+    def record_timing(self):
+        """
+        record the instruction at pc for the timing model (single steps, execute_instrumented does this inline)
+        """
+        entry = self.decode_cache.get(self.pc) or self.predecode(self.pc)
+        self.timing.pcs.append(self.pc)
+        base = DATA_BASE.get(entry[2])
+        if base is not None:
+            self.timing.bases.append(int(self.registers[entry[1][base]]))
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Memory-mapped devices (see mmio.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def map_device(self, device, base=None):
+        """
+        map device on the I/O bus (created on first use) at base, or at the next free address above the memory
+        returns the base address
+        """
+        if self.bus is None:
+            self.bus = mmio_bus(self)
+        return self.bus.map(device, base)
+
+    def unmap_device(self, device):
+        """
+        remove device from the I/O bus, LW / SW go back to the plain handlers once no device is left
+        """
+        self.bus.unmap(device)
+        if not self.bus.devices:
+            self.bus = None
+            self.flush_decode()
+
     #------------------------------------------------------------------------------------------------------------------------------------------------
     # Reset Instructions
     #------------------------------------------------------------------------------------------------------------------------------------------------
     def reset_machine(self):
-        self.registers  = np.zeros(32, dtype=np.int32)
+        self.registers  = self.backend.registers()
         self.pc         = 0
         self.flag       = False
 
@@ -574,7 +1271,121 @@ class machine:
 
     
     def clear_memory(self):
-        self.memory     = np.zeros(self.memory_size, dtype=np.uint8)
+        self.memory     = self.backend.memory(self.memory_size)
+        self.flush_decode()
+        if self.checkpoints is not None:
+            self.memory_written(0, self.memory_size)    # every page changed (the next restore copies them all)
+        elif self.dirty is not None:
+            self.dirty = None  # the next restore has to copy the whole memory
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Snapshots (see snapshot.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def snapshot(self):
+        """
+        capture registers, pc, labels and memory, and track the memory pages written from now on
+        """
+        self.last_snapshot = snapshot(self)
+        self.dirty = set()
+        return self.last_snapshot
+
+    def restore(self, snap=None):
+        """
+        reset the machine to a snapshot (default: the last one taken)
+        only the pages written since the snapshot are copied back
+        """
+        snap = snap or self.last_snapshot
+        if snap is self.last_snapshot and self.dirty is not None:
+            pages = self.dirty
+            snap.copy_pages(self.memory, pages)
+            lo, hi = self.decode_lo >> PAGE_SHIFT, (self.decode_hi + 3) >> PAGE_SHIFT
+            if any(lo <= page <= hi for page in pages):
+                self.flush_decode()
+        else:
+            snap.copy_all(self.memory)
+            self.flush_decode()
+            pages = range(-(-self.memory_size >> PAGE_SHIFT))
+        if self.checkpoints is not None:
+            self.checkpoints.dirty.update(pages)
+        self.restore_state(snap)
+
+    def fork(self, snap=None):
+        """
+        create a new machine from a snapshot (default: the last one, taken now if there is none)
+        the clone shares the snapshot memory copy-on-write, only the pages it writes are copied
+        """
+        snap = snap or self.last_snapshot or self.snapshot()
+        clone = self.__class__(0, backend=self.backend)
+        clone.memory_size = snap.memory_size
+        clone.memory = snap.memory(self.backend)
+        clone.flush_decode()
+        clone.restore_state(snap)
+        return clone
+
+    def clone(self):
+        """
+        create a new machine from this one used as a template (a loaded program): copies of the memory, registers,
+        pc, flag and labels, no assembling or loading; the shared ISA tables make construction a few slot
+        assignments plus one memory copy (decodes, devices, snapshots and engine state are not copied)
+        """
+        clone = self.__class__(0, backend=self.backend)
+        clone.memory_size = self.memory_size
+        clone.memory = self.memory.copy()
+        clone.decode_lo = self.memory_size
+        clone.registers = self.registers.copy()
+        clone.pc = self.pc
+        clone.flag = self.flag
+        clone.label_dictionary = dict(self.label_dictionary)
+        return clone
+
+    def restore_state(self, snap):
+        """
+        set registers, pc, flag and labels from a snapshot and track writes relative to it
+        """
+        self.registers = self.backend.registers()
+        for i in range(32):
+            self.registers[i] = snap.registers[i]
+        self.pc = snap.pc
+        self.flag = snap.flag
+        self.label_dictionary = dict(snap.label_dictionary)
+
+        self.last_snapshot = snap
+        self.dirty = set()
+
+    def mark_dirty(self, addr):
+        """
+        record the page(s) written by a 32-bit store at addr (an unsigned address inside the memory, the store
+        faulted otherwise)
+        """
+        self.dirty.add(addr >> PAGE_SHIFT)
+        self.dirty.add((addr + 3) >> PAGE_SHIFT)
+        if self.checkpoints is not None:
+            self.checkpoints.dirty.add(addr >> PAGE_SHIFT)
+            self.checkpoints.dirty.add((addr + 3) >> PAGE_SHIFT)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Checkpoints (see checkpoint.py)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    def enable_checkpoints(self, path, interval=CHECKPOINT_INTERVAL, compress=True, sync=False, reader=None):
+        """
+        start a checkpoint log at path (checkpoint 0 holds every used page), returns the log:
+        log.run(start, end) checkpoints every interval instructions, log.checkpoint() checkpoints now
+        """
+        self.disable_checkpoints()
+        if self.dirty is None:
+            # track writes; with a snapshot but no tracking (clear_memory) restore still has to copy every page
+            self.dirty = set() if self.last_snapshot is None else set(range(-(-self.memory_size >> PAGE_SHIFT)))
+        self.checkpoints = checkpoint_log(self, path, interval, compress, sync, reader)
+        return self.checkpoints
+
+    def disable_checkpoints(self):
+        """
+        close the checkpoint log, returns it
+        """
+        log, self.checkpoints = self.checkpoints, None
+        if log is not None:
+            log.close()
+        return log
 
     #------------------------------------------------------------------------------------------------------------------------------------------------
     # Dump Instructions
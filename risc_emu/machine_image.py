@@ -0,0 +1,174 @@
+"""
+This is a binary file format for machine images: memory segments, the label dictionary, the entry
+point and (optionally) the registers of a machine.
+
+Layout (little-endian):
+    header      magic 'RVIMAGE1', flags, mem_size, entry, number of segments / symbols, offsets
+    segments    (address, length, file offset) per segment
+    registers   32 x int32 + pc                                     (if FLAG_REGISTERS is set)
+    symbols     (address, name length, utf-8 name) per label
+    data        the bytes of every segment, each starting on an mmap page boundary
+
+Loading maps the file with mmap (copy-on-write, the file is never modified). An image with a single
+segment covering the whole memory is used directly as the machine memory (numpy backend), so loading
+costs the same for any program size: pages are only read when the guest touches them.
+Images with several segments are copied into memory with one slice copy per segment.
+With the paged backend only the non-zero pages of the segments are written (the memory stays sparse), and
+saving a paged machine stores its used pages unless segments are given.
+"""
+
+import mmap
+import struct
+
+import numpy as np
+
+from machine import machine
+from paged_memory import PAGE_MASK, PAGE_SHIFT, PAGE_SIZE, PROT_ALL
+
+MAGIC           = b'RVIMAGE1'
+FLAG_REGISTERS  = 1
+
+# magic, flags, mem_size, entry, segments, symbols, registers offset, symbols offset, symbols size
+HEADER          = struct.Struct('<8sIQqIIQQQ')
+SEGMENT         = struct.Struct('<qQQ')
+REGISTERS       = struct.Struct('<32iq')
+SYMBOL          = struct.Struct('<qH')
+
+
+def align(offset):
+    """
+    round offset up to the next mmap page boundary
+    """
+    return (offset + mmap.ALLOCATIONGRANULARITY - 1) // mmap.ALLOCATIONGRANULARITY * mmap.ALLOCATIONGRANULARITY
+
+
+def used_segments(m, page_size=4096):
+    """
+    (address, length) of every run of memory pages that are not all zero
+    """
+    if m.paged:
+        # only resident pages can hold data
+        size = m.memory.size
+        pages = -(-size // page_size)
+        used = np.zeros(pages, dtype=bool)
+        step = min(page_size, PAGE_SIZE)
+        for n, page in m.memory.pages.items():
+            for lo in range(0, PAGE_SIZE, step):
+                if page[lo:lo + step].strip(b'\0'):
+                    used[((n << PAGE_SHIFT) + lo) // page_size] = True
+    else:
+        memory = np.frombuffer(m.memory, dtype=np.uint8)
+        size = len(memory)
+        pages = -(-size // page_size)
+        padded = np.zeros(pages * page_size, dtype=np.uint8)
+        padded[:size] = memory
+        used = padded.reshape(pages, page_size).any(axis=1)
+
+    segments = []
+    page = 0
+    while page < pages:
+        if used[page]:
+            first = page
+            while page < pages and used[page]:
+                page += 1
+            start = first * page_size
+            segments.append((start, min(page * page_size, size) - start))
+        page += 1
+    return segments
+
+
+def save_image(m, path, segments=None, registers=True, entry='start'):
+    """
+    write machine m to path
+    segments:   [(address, length)] to store, None = the whole memory (directly mappable on load),
+                for a paged machine the used segments
+    registers:  store the registers and pc
+    entry:      label of the entry point (stored as address, -1 if the label does not exist)
+    """
+    if segments is None:
+        segments = used_segments(m) if m.paged else [(0, m.memory_size)]
+
+    symbols = b''.join(SYMBOL.pack(int(addr), len(name.encode())) + name.encode()
+                       for name, addr in m.label_dictionary.items())
+    table = HEADER.size + SEGMENT.size * len(segments)
+    registers_offset = table if registers else 0
+    symbols_offset = table + (REGISTERS.size if registers else 0)
+
+    offset = align(symbols_offset + len(symbols))
+    placed = []
+    for addr, length in segments:
+        placed.append((addr, length, offset))
+        offset = align(offset + length)
+
+    flags = FLAG_REGISTERS if registers else 0
+    entry_addr = int(m.label_dictionary.get(entry, -1))
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, flags, m.memory_size, entry_addr, len(segments), len(m.label_dictionary),
+                            registers_offset, symbols_offset, len(symbols)))
+        for segment in placed:
+            f.write(SEGMENT.pack(*segment))
+        if registers:
+            f.write(REGISTERS.pack(*[int(r) for r in m.registers], int(m.pc)))
+        f.write(symbols)
+        memory = None if m.paged else memoryview(m.memory)
+        for addr, length, file_offset in placed:
+            f.seek(file_offset)
+            if m.paged:
+                f.write(m.memory.read(addr, length, PROT_ALL))      # any permission (execute-only code too)
+            else:
+                f.write(memory[addr:addr + length])
+        f.truncate(max(offset, f.tell()))
+
+
+def load_image(path, backend='numpy'):
+    """
+    create a machine from the image at path, its memory is mapped from the file
+    """
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    magic, flags, mem_size, entry, n_segments, n_symbols, registers_offset, symbols_offset, symbols_size = \
+        HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC:
+        raise ValueError("not a machine image: " + str(path))
+
+    segments = [SEGMENT.unpack_from(mapping, HEADER.size + i * SEGMENT.size) for i in range(n_segments)]
+
+    m = machine(0, backend=backend)
+    m.memory_size = mem_size
+    if m.backend.name == 'numpy' and len(segments) == 1 and segments[0][:2] == (0, mem_size):
+        # the whole memory is one segment: use the (copy-on-write) mapping as memory
+        m.memory = np.frombuffer(mapping, dtype=np.uint8, count=mem_size, offset=segments[0][2])
+    elif m.paged:
+        # allocate only the pages that hold data
+        m.memory = m.backend.memory(mem_size)
+        for addr, length, file_offset in segments:
+            lo = addr
+            while lo < addr + length:
+                hi = min((lo | PAGE_MASK) + 1, addr + length)
+                data = mapping[file_offset + lo - addr:file_offset + hi - addr]
+                if data.strip(b'\0'):
+                    m.memory.write(lo, data)
+                lo = hi
+    else:
+        m.memory = m.backend.memory(mem_size)
+        memory = memoryview(m.memory)
+        for addr, length, file_offset in segments:
+            memory[addr:addr + length] = mapping[file_offset:file_offset + length]
+    m.flush_decode()
+
+    if flags & FLAG_REGISTERS:
+        values = REGISTERS.unpack_from(mapping, registers_offset)
+        for i in range(32):
+            m.registers[i] = values[i]
+        m.pc = values[32]
+    elif entry >= 0:
+        m.pc = entry
+
+    offset = symbols_offset
+    for i in range(n_symbols):
+        addr, length = SYMBOL.unpack_from(mapping, offset)
+        offset += SYMBOL.size
+        m.label_dictionary[mapping[offset:offset + length].decode()] = addr
+        offset += length
+    return m
@@ -0,0 +1,97 @@
+"""
+This is a test for saving / loading machine images (mmap based loading)
+"""
+
+import os
+import tempfile
+import time
+import numpy as np
+from machine import machine
+from machine_image import save_image, load_image, used_segments
+from programs import fibonacci
+from paged_memory import PROT_READ
+
+sp, a0 = 2, 10
+directory = tempfile.mkdtemp()
+
+#-------------------------------------------------------------------------------
+# Test 1: save an assembled fibonacci, load it and run it without storeAssembly
+#-------------------------------------------------------------------------------
+m = machine(mem_size=8000)
+fibonacci(12).assemble().load(m, 4000)
+m.registers[sp] = 8000
+path = os.path.join(directory, 'fib.img')
+save_image(m, path)
+
+for backend in ['numpy', 'native']:
+    l = load_image(path, backend=backend)
+    assert(l.label_dictionary == m.label_dictionary and l.pc == m.pc)
+    l.execute('start', 'end')
+    assert(l.registers[a0] == 144)
+print("Test 1: Fibonacci of 12 = " + str(l.registers[a0]) + " from " + str(os.path.getsize(path)) + " byte image")
+
+#-------------------------------------------------------------------------------
+# Test 2: the memory is a copy-on-write mapping of the file
+#-------------------------------------------------------------------------------
+l = load_image(path)
+assert(not l.memory.flags.owndata)
+l.write_i32(-1, 100)
+assert(load_image(path).read_i32(100) == 0)
+print("Test 2: writes to a loaded image do not reach the file")
+
+#-------------------------------------------------------------------------------
+# Test 3: compact image with only the used pages, registers are restored
+#-------------------------------------------------------------------------------
+big = machine(mem_size=1 << 20)
+fibonacci(5).assemble().load(big, 4000)
+big.write_i32(1234, 900000)
+big.registers[a0] = -7
+save_image(big, path, segments=used_segments(big))
+print("Test 3: segments " + str(used_segments(big)) + ", " + str(os.path.getsize(path)) + " bytes")
+assert(os.path.getsize(path) < 1 << 18)
+
+l = load_image(path)
+assert(l.read_i32(900000) == 1234 and l.registers[a0] == -7)
+assert(bytes(l.memory) == bytes(big.memory))
+
+#-------------------------------------------------------------------------------
+# Test 4: loading a large image does not depend on the memory size
+#-------------------------------------------------------------------------------
+huge = machine(mem_size=64 << 20)
+fibonacci(5).assemble().load(huge, 4000)
+save_image(huge, path)
+t = time.perf_counter()
+l = load_image(path)
+t = time.perf_counter() - t
+l.execute('start', 'end')
+print("Test 4: 64 MiB image loaded in %.1f ms" % (t * 1000))
+assert(l.registers[a0] == 5)
+os.remove(path)
+
+#-------------------------------------------------------------------------------
+# Test 5: save / load with the paged backend (memory stays sparse)
+#-------------------------------------------------------------------------------
+paged = machine(mem_size=1 << 20, backend='paged')
+fibonacci(5).assemble().load(paged, 4000)
+paged.write_i32(1234, 900000)
+paged.memory.protect(900000, 4, PROT_READ)
+paged.registers[a0] = -7
+assert(used_segments(paged) == used_segments(big))
+
+path = os.path.join(directory, 'paged.img')
+save_image(paged, path)
+l = load_image(path, backend='paged')
+assert(l.paged and l.read_i32(900000) == 1234 and l.registers[a0] == -7 and len(l.memory.pages) == 2)
+l.execute('start', 'end')
+assert(l.registers[a0] == 5)
+assert(bytes(load_image(path).memory) == bytes(big.memory))
+
+save_image(paged, path, segments=[(0, 4096)])
+assert(load_image(path, backend='paged').read_i32(900000) == 0)
+
+save_image(huge, path)                                          # a flat image of 64 MiB into a paged machine
+l = load_image(path, backend='paged')
+l.execute('start', 'end')
+assert(l.registers[a0] == 5 and len(l.memory.pages) == 1)
+print("Test 5: paged machine saved with segments " + str(used_segments(paged)) + ", 64 MiB image loaded into %d resident page(s)" % len(l.memory.pages))
+os.remove(path)
@@ -0,0 +1,346 @@
+"""
+Memoization of pure guest subroutines: calls with the same arguments return the cached a0 / a1 instead of
+running again.
+
+    memo = m.enable_memo(functions=['fibonacci'])     # functions = None: every JAL target with rd != x0
+    m.execute('start', 'end')
+    print(memo.report())
+
+Only execute(start, end) on the interpreter without instructionCount uses it. A call (JAL with rd != x0) to a
+function is recorded while it runs, and the recording checks at runtime that the call is pure:
+
+    - every LW / SW address lies in its own stack frame (between the current sp and sp at the call)
+      and every word it loads was stored by the call itself
+    - it makes no system call and uses no WFI / HALT / atomic instruction
+    - it returns to the call site with sp and the callee-saved registers (gp, tp, s0..s11) restored
+    - it only uses return addresses (ra after a JAL, words it saved them to) as jump targets and stores them
+      to its stack, never as data
+
+The registers the call reads before writing them are its inputs. sp is an input too when the call reads it as
+data (not as a load / store base or in ADDi sp, sp, imm). The cache key is the target and the values of the
+inputs of every recorded call of that target. On a hit ra and the a0 / a1 the call wrote
+are set and execution continues at the return address, as after the call (temporaries and the dead stack below
+sp are not written). A function failing a check once is never memoized again and its entries are dropped.
+Stores into code drop every entry.
+"""
+
+from collections import OrderedDict
+
+# cached calls (least recently used ones are dropped first)
+MAX_ENTRIES = 4096
+
+zero, ra, sp, gp, tp, a0, a1 = 0, 1, 2, 3, 4, 10, 11
+
+# registers a call has to restore before it returns
+CALLEE_SAVED = (sp, gp, tp, 8, 9, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27)
+
+# instructions a pure call may not execute
+SIDE_EFFECTS = ('ECALL', 'WFI', 'HALT', 'LR', 'SC', 'AMOSWAP', 'AMOADD')
+
+
+def reads(inst, operands):
+    """
+    registers read by an instruction (decode cache operands)
+    """
+    if inst in ('ADDi', 'JALR'):
+        return operands[1:2]
+    if inst == 'LW':
+        return operands[2:3]
+    if inst == 'SW':
+        return (operands[0], operands[2])
+    if inst in ('JAL', 'WFI', 'HALT', 'ECALL'):
+        return ()
+    if inst in ('BEQ', 'BNE', 'BLT', 'BGE'):
+        return operands[:2]
+    return operands[1:]
+
+
+def address_use(inst, operands, i):
+    """
+    True if the instruction reads register i as an address: load / store base, jump target, or sp moved by ADDi
+    """
+    if inst in ('LW', 'SW'):
+        return i == operands[2]
+    if inst == 'JALR':
+        return i == operands[1]
+    return inst == 'ADDi' and i == sp == operands[0] == operands[1]
+
+
+class call_record:
+    """
+    a call being recorded: where it returns to, sp / registers at the call, inputs found so far
+    """
+    def __init__(self, target, link, registers, start):
+        self.target     = target
+        self.link       = link
+        self.registers  = registers
+        self.sp         = registers[sp]
+        self.start      = start
+        self.inputs     = set()
+        self.reason     = None
+
+
+class function_stats:
+    """
+    memoization state of one function: input registers of its recorded calls, counters, why it is impure
+    """
+    def __init__(self):
+        self.inputs     = ()
+        self.calls      = 0
+        self.hits       = 0
+        self.recorded   = 0
+        self.reason     = None
+
+
+class call_memo:
+    def __init__(self, m, functions=None, max_entries=MAX_ENTRIES):
+        """
+        memoization of the calls machine m makes
+        functions:      labels / addresses of the functions to memoize (None: every call)
+        max_entries:    cached calls
+        """
+        self.m              = m
+        self.functions      = None if functions is None else {m.getLabel(f) for f in functions}
+        self.max_entries    = max_entries
+
+        # (target, input values) -> (a0, a1), in least recently used order
+        self.cache          = OrderedDict()
+        # target -> function_stats
+        self.stats          = {}
+
+        # calls being recorded (innermost last), instruction number of the last write of every register,
+        # address -> instruction number of the last store (while recording)
+        self.records        = []
+        self.written        = [-1] * 32
+        self.stored         = {}
+        self.step           = 0
+        # registers / stored words holding a return address (while recording)
+        self.links          = set()
+        self.link_words     = set()
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Execution
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def run(self, end):
+        """
+        interpret from m.pc until pc == end, answering calls of pure functions from the cache
+        """
+        m = self.m
+        cache, r = m.decode_cache, m.registers
+        try:
+            while m.pc != end:
+                pc = m.pc
+                entry = cache.get(pc) or m.predecode(pc)
+                inst, operands = entry[2], entry[1]
+                if inst == 'JAL' and operands[0] != zero and self.call(pc, operands):
+                    continue
+                if self.records:
+                    self.check(inst, operands)
+                entry[0](*entry[1])
+                if self.records and inst == 'JALR' and m.pc == self.records[-1].link and \
+                        int(r[sp]) == self.records[-1].sp:
+                    self.ret()
+        finally:
+            if self.records:
+                self.records = []       # stopped inside a call: its recording is incomplete
+                self.stored = {}
+                self.links, self.link_words = set(), set()
+
+    def call(self, pc, operands):
+        """
+        JAL at pc: answer it from the cache (returns True) or start recording it
+        """
+        target = pc + operands[1]
+        if self.functions is not None and target not in self.functions:
+            return False
+        stats = self.stats.get(target)
+        if stats is None:
+            stats = self.stats[target] = function_stats()
+        if stats.reason is not None:
+            return False
+        stats.calls += 1
+
+        r = self.m.registers
+        key = (target,) + tuple(int(r[i]) for i in stats.inputs)
+        result = self.cache.get(key) if stats.recorded else None
+        if result is None:
+            if self.records:
+                self.check('JAL', operands)
+            self.m.JAL(*operands)
+            self.records.append(call_record(target, pc + 4, [int(x) for x in r], self.step + 1))
+            self.links.add(operands[0])
+            return True
+
+        stats.hits += 1
+        self.cache.move_to_end(key)
+        if self.records:
+            self.step += 1
+            for i in stats.inputs:
+                self.read(i)
+        r[operands[0]] = ((pc + 4 + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        for i, value in zip((a0, a1), result):
+            if value is not None:
+                r[i] = value
+        if self.records:
+            for i in (operands[0], a0, a1):
+                self.written[i] = self.step
+            self.links.difference_update((a0, a1))
+            self.links.add(operands[0])
+        self.m.pc = pc + 4
+        return True
+
+    def ret(self):
+        """
+        the innermost recorded call returned: check it and cache its result
+        """
+        rec = self.records.pop()
+        stats = self.stats[rec.target]
+        r = self.m.registers
+        if rec.reason is None:
+            for i in CALLEE_SAVED:
+                if int(r[i]) != rec.registers[i]:
+                    rec.reason = 'does not restore x%d' % i
+                    break
+        if rec.reason is not None:
+            self.impure(rec.target, rec.reason)
+        elif stats.reason is None:
+            inputs = tuple(sorted(set(stats.inputs) | rec.inputs))
+            if inputs != stats.inputs:
+                self.drop(rec.target)       # older keys do not have the new inputs
+                stats.inputs = inputs
+            key = (rec.target,) + tuple(rec.registers[i] for i in inputs)
+            # a0 / a1 the call did not write keep the value of the caller
+            self.cache[key] = tuple(int(r[i]) if self.written[i] >= rec.start else None for i in (a0, a1))
+            if len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+            stats.recorded += 1
+        if not self.records:
+            self.stored = {}
+            self.links, self.link_words = set(), set()
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Runtime checks (while recording)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def check(self, inst, operands):
+        """
+        account for the instruction about to run in every call being recorded
+        """
+        self.step += 1
+        for i in reads(inst, operands):
+            if address_use(inst, operands, i):
+                continue
+            if i in self.links:
+                # saving a return address to the stack is fine, its value depends on the call site otherwise
+                if not (inst == 'SW' and i == operands[0]):
+                    self.fail(0, 'uses a return address as data')
+                continue
+            self.read(i)
+        if inst in SIDE_EFFECTS:
+            self.fail(0, inst + ' in the call')
+        elif inst in ('LW', 'SW'):
+            r = self.m.registers
+            addr = int(r[operands[2]]) + operands[1]
+            low = int(r[sp])
+            for i in range(len(self.records) - 1, -1, -1):
+                rec = self.records[i]
+                if low <= addr < rec.sp:
+                    break
+            else:
+                i = -1
+            # records after i: the address is outside their stack frame
+            self.fail(i + 1, 'touches memory outside its stack frame')
+            if inst == 'SW':
+                self.stored[addr] = self.step
+                if operands[0] in self.links:
+                    self.link_words.add(addr)
+                else:
+                    self.link_words.discard(addr)
+            else:
+                # records started after the word was stored (or it never was) load a value from before the call
+                last = self.stored.get(addr, -1)
+                j = i
+                while j >= 0 and self.records[j].start > last:
+                    j -= 1
+                self.fail(j + 1, 'loads a word it did not store')
+        if inst != 'SW' and inst not in ('BEQ', 'BNE', 'BLT', 'BGE') and operands and operands[0] != zero:
+            self.written[operands[0]] = self.step
+            if inst in ('JAL', 'JALR') or (inst == 'LW' and addr in self.link_words):
+                self.links.add(operands[0])
+            else:
+                self.links.discard(operands[0])
+
+    def read(self, i):
+        """
+        register i is read as data: it is an input of the calls recorded since it was last written
+        (sp of every call being recorded: its value inside a call follows from sp at the call)
+        """
+        if i == zero:
+            return
+        if i == sp:
+            for rec in self.records:
+                rec.inputs.add(sp)
+            return
+        last = self.written[i]
+        for rec in reversed(self.records):
+            if rec.start <= last:
+                break
+            rec.inputs.add(i)
+
+    def fail(self, first, reason):
+        """
+        records[first:] are not pure
+        """
+        for rec in self.records[first:]:
+            if rec.reason is None:
+                rec.reason = reason
+
+    def impure(self, target, reason):
+        """
+        never memoize target again
+        """
+        self.stats[target].reason = reason
+        self.drop(target)
+
+    def drop(self, target):
+        """
+        remove the cached calls of target
+        """
+        for key in [key for key in self.cache if key[0] == target]:
+            del self.cache[key]
+
+    def flush(self):
+        """
+        forget every cached call (the code changed)
+        """
+        self.cache.clear()
+        for stats in self.stats.values():
+            stats.recorded = 0
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Report
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def hit_rate(self, target=None):
+        """
+        cache hits / calls of target (of every function if None)
+        """
+        stats = list(self.stats.values()) if target is None else [self.stats[self.m.getLabel(target)]]
+        calls = sum(s.calls for s in stats)
+        return sum(s.hits for s in stats) / calls if calls else 0.0
+
+    def report(self):
+        """
+        calls, hits, hit rate and input registers of every function called, or why it is not memoized
+        """
+        labels = {pc: label for label, pc in self.m.label_dictionary.items()}
+        lines = ['%-16s %10s %10s %8s  %s' % ('function', 'calls', 'hits', 'rate', 'inputs / status')]
+        for target, s in sorted(self.stats.items()):
+            status = s.reason or ' '.join('x%d' % i for i in s.inputs)
+            lines.append('%-16s %10d %10d %7.1f%%  %s' % (labels.get(target, str(target)), s.calls, s.hits,
+                                                        100.0 * s.hits / s.calls if s.calls else 0.0, status))
+        lines.append('%-16s %10d %10d %7.1f%%  %d cached calls' % ('total', sum(s.calls for s in self.stats.values()),
+                                                                sum(s.hits for s in self.stats.values()),
+                                                                100.0 * self.hit_rate(), len(self.cache)))
+        return '\n'.join(lines)
@@ -0,0 +1,166 @@
+"""
+This is a test for function-call memoization: memoized recursive calls give the same results with fewer
+instructions, impure functions are detected and run normally, the LRU bound and the end label inside a call
+"""
+
+import time
+from machine import machine
+from assembler import assembler
+from programs import fibonacci, factorial
+from benchmark import MEM_SIZE, write_words
+
+zero, ra, sp, t0, s0, s1, a0, a1 = 0, 1, 2, 5, 8, 9, 10, 11
+
+def run(program, n, memo, functions=None, end='end'):
+    m = machine(MEM_SIZE)
+    program.assemble().load(m, 0)
+    m.registers[sp] = MEM_SIZE - 16
+    m.registers[a0] = n
+    memo = m.enable_memo(functions) if memo else None
+    t = time.perf_counter()
+    reason = m.execute('start', end)
+    t = time.perf_counter() - t
+    return m, memo, t, reason
+
+#-------------------------------------------------------------------------------
+# Test 1: recursive fibonacci / factorial with and without memoization
+#-------------------------------------------------------------------------------
+m, _, t_plain, _ = run(fibonacci(), 18, False)
+memo_m, memo, t_memo, _ = run(fibonacci(), 18, True, ['fibonacci'])
+assert(memo_m.registers[a0] == m.registers[a0] == 2584 and memo_m.pc == m.pc)
+# each fib(k), k = 18 .. 0, runs once: 19 misses, the other 16 calls are hits
+stats = memo.stats[memo_m.getLabel('fibonacci')]
+assert(stats.calls == 2 * 18 - 1 and stats.hits == 18 - 2 and stats.inputs == (s0, a0))
+print(memo.report())
+print("Test 1: fibonacci(18) %.1f ms -> %.1f ms" % (t_plain * 1000, t_memo * 1000))
+
+for n in range(12):
+    plain, _, _, _ = run(factorial(), n, False)
+    memo_m, memo, _, _ = run(factorial(), n, True)
+    assert(memo_m.registers[a0] == plain.registers[a0] and memo_m.registers[a1] == plain.registers[a1])
+print("Test 1: factorial(0..11) " + memo.report().split('\n')[1])
+
+# the cache is kept between runs: the second run is one hit
+memo_m.registers[a0] = 11
+memo_m.execute('start', 'end')
+assert(memo_m.registers[a0] == 39916800 and memo.stats[memo_m.getLabel('factorial')].hits == 1)
+
+#-------------------------------------------------------------------------------
+# Test 2: impure functions (global memory, callee-saved registers) run normally
+#-------------------------------------------------------------------------------
+def calls(body, n=20):
+    """
+    call 'function' n times with a0 = 5, sum the results in s0
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', s0, zero, 0)
+    a.storeAssembly('ADDi', a1, zero, 0)
+    a.addLabel('loop')
+    a.storeAssembly('ADDi', a0, zero, 5)
+    a.storeAssembly('JAL', ra, 'function')
+    a.storeAssembly('ADD', s0, s0, a0)
+    a.storeAssembly('ADDi', a1, a1, 1)
+    a.storeAssembly('ADDi', t0, zero, n)
+    a.storeAssembly('BNE', a1, t0, 'loop')
+    a.addLabel('end')
+    a.storeAssembly('ADDi', zero, zero, 0)
+    a.addLabel('function')
+    for inst in body:
+        a.storeAssembly(*inst)
+    a.storeAssembly('JALR', zero, ra, 0)
+    return a
+
+cases = [
+    ('pure',       [('ADDi', a0, a0, 5)],                                           None),
+    ('counter',    [('LW', t0, 0x1000, zero), ('ADDi', t0, t0, 1), ('SW', t0, 0x1000, zero),
+                    ('ADD', a0, a0, t0)],                                           'outside its stack frame'),
+    ('stack read', [('ADDi', sp, sp, -8), ('LW', t0, 0, sp), ('ADD', a0, a0, t0),
+                    ('ADDi', sp, sp, 8)],                                           'did not store'),
+    ('clobber s0', [('ADDi', s0, s0, 1)],                                           'does not restore'),
+    ('ecall',      [('ADDi', a0, zero, 0), ('ECALL',), ('ADDi', a0, zero, 5)],      'ECALL'),
+]
+for name, body, reason in cases:
+    results = []
+    for memoize in [False, True]:
+        m = machine(mem_size=1 << 16)
+        calls(body, 20).assemble().load(m, 0)
+        m.registers[sp] = 0x8000
+        write_words(m, 0x8000 - 8, [7])
+        m.registers[17] = 214                                           # ecall: brk(0)
+        memo = m.enable_memo() if memoize else None
+        m.execute('start', 'end')
+        results.append([int(m.registers[s0]), m.read_i32(0x1000), m.pc])
+    stats = memo.stats[m.getLabel('function')]
+    assert(results[0] == results[1])
+    assert((stats.hits == 0 and reason in stats.reason) if reason else stats.hits == 19 and stats.recorded == 1)
+    print("Test 2: %-10s %s" % (name, stats.reason or 'pure, inputs x%d' % stats.inputs))
+
+# results depending on the call site (ra) or on the stack pointer (sp read as data)
+def two_calls(body):
+    """
+    call 'function' from two call sites, the second one with sp 16 bytes lower, results in s0 and s1
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('JAL', ra, 'function')
+    a.storeAssembly('ADD', s0, zero, a0)
+    a.storeAssembly('ADDi', sp, sp, -16)
+    a.storeAssembly('JAL', ra, 'function')
+    a.storeAssembly('ADDi', sp, sp, 16)
+    a.storeAssembly('ADD', s1, zero, a0)
+    a.addLabel('end')
+    a.storeAssembly('ADDi', zero, zero, 0)
+    a.addLabel('function')
+    for inst in body:
+        a.storeAssembly(*inst)
+    a.storeAssembly('JALR', zero, ra, 0)
+    return a
+
+for name, body in [('ra', [('ADD', a0, ra, zero)]), ('sp', [('ADDi', a0, sp, 0)])]:
+    results = []
+    for memoize in [False, True]:
+        m = machine(mem_size=1 << 16)
+        two_calls(body).assemble().load(m, 0)
+        m.registers[sp] = 4000
+        memo = m.enable_memo() if memoize else None
+        m.execute('start', 'end')
+        results.append([int(m.registers[s0]), int(m.registers[s1])])
+    stats = memo.stats[m.getLabel('function')]
+    assert(results[0] == results[1] and stats.hits == 0)
+    assert('return address' in stats.reason if name == 'ra' else stats.inputs == (sp,))
+    print("Test 2: a0 = %-6s %s: %s" % (name, results[1], stats.reason or 'pure, inputs x%d' % stats.inputs))
+
+#-------------------------------------------------------------------------------
+# Test 3: LRU bound, end label inside a call, stores into code
+#-------------------------------------------------------------------------------
+m = machine(MEM_SIZE)
+fibonacci().assemble().load(m, 0)
+m.registers[sp], m.registers[a0] = MEM_SIZE - 16, 18
+memo = m.enable_memo(max_entries=4)
+m.execute('start', 'end')
+assert(m.registers[a0] == 2584 and len(memo.cache) == 4)
+
+results = []
+for memoize in [False, True]:
+    m, memo, _, reason = run(fibonacci(), 15, memoize, end='BaseCase')
+    out = [reason, m.pc, int(m.registers[a0])]
+    out += [m.execute(None, 'end'), int(m.registers[a0])]
+    m.registers[a0] = 15
+    out += [m.execute('start', 'end'), int(m.registers[a0])]
+    results.append(out)
+assert(results[0] == results[1] and results[1][-1] == 610 and memo.hit_rate() > 0.4)
+print("Test 3: " + str(results[1]))
+
+patch = machine(mem_size=100)
+patch.storeAssembly('ADDi', a0, a0, 6)
+m = machine(mem_size=1 << 16)
+calls([('ADDi', a0, a0, 5)], 20).assemble().load(m, 0)
+m.registers[sp] = 0x8000
+memo = m.enable_memo()
+m.execute('start', 'end')
+m.write_i32(patch.read_i32(0), m.getLabel('function'))      # the cached calls ran the old code
+assert(len(memo.cache) == 0)
+m.execute('start', 'end')
+assert(m.registers[s0] == 20 * 11)
+print("Test 3: stores into code drop the cache")
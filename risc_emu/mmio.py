@@ -0,0 +1,293 @@
+"""
+Memory-mapped I/O for the risc machine: a bus that routes LW / SW on device address ranges to devices,
+a block device backed by an mmap'd host file and a DMA engine.
+
+    disk = block_device('disk.img', blocks=2048)
+    dma  = dma_engine(irq=3)
+    disk_base = m.map_device(disk)          # base address of the device registers
+    dma_base  = m.map_device(dma)
+
+Devices are mapped above the memory (from MMIO_BASE, page aligned) unless a base is given. Until the first
+device is mapped m.bus is None and LW / SW have no I/O check at all; after that they check the address
+against the bus window [lo, hi), one comparison for ordinary memory accesses.
+
+A device has a size in bytes and read(offset) / write(offset, value) for 32-bit words. A device with
+buffer(offset, length) can also be the source or destination of a DMA transfer.
+
+Block device registers (offsets from its base):
+    BLOCK_COUNT     number of blocks (read only)
+    BLOCK_LENGTH    bytes per block (read only)
+    BLOCK_FLUSH     write anything: flush the mapping to the host file
+    BLOCK_DATA      the file contents, block n at BLOCK_DATA + n * block size
+
+DMA engine registers:
+    DMA_SRC, DMA_DST, DMA_LENGTH    source / destination address and length in bytes of the next transfer
+    DMA_CONTROL     write anything: copy the bytes (one slice copy on the host), raise irq when done
+                    read: 0 if the last transfer succeeded, -1 if a range was outside memory / device buffers
+    DMA_COUNT       bytes transferred so far
+
+Transfers complete before the SW to DMA_CONTROL finishes. Writes into guest memory drop the cached
+decodes they overlap and mark their pages dirty for snapshots. Devices are not part of snapshots.
+"""
+
+import bisect
+import mmap
+import os
+from struct import pack_into, unpack_from
+
+from paged_memory import PAGE_SIZE, page_fault
+
+# lowest default device base
+MMIO_BASE       = 0x40000000
+
+# block device registers
+BLOCK_COUNT     = 0
+BLOCK_LENGTH    = 4
+BLOCK_FLUSH     = 8
+BLOCK_DATA      = PAGE_SIZE
+
+# default bytes per block
+SECTOR_SIZE     = 512
+
+# DMA engine registers
+DMA_SRC         = 0
+DMA_DST         = 4
+DMA_LENGTH      = 8
+DMA_CONTROL     = 12
+DMA_COUNT       = 16
+
+
+class mmio_bus:
+    def __init__(self, m):
+        """
+        empty bus of machine m
+        """
+        self.m          = m
+
+        # mapped devices, sorted by base address
+        self.devices    = []
+        self.bases      = []
+
+        # address window covering every device (empty while nothing is mapped)
+        self.lo         = 0
+        self.hi         = 0
+
+    def map(self, device, base=None):
+        """
+        map device at base (default: the next free page above the memory and MMIO_BASE), returns the base
+        """
+        m = self.m
+        if base is None:
+            base = max(self.hi, MMIO_BASE, 0 if m.paged else m.memory_size)
+            base = -(-base // PAGE_SIZE) * PAGE_SIZE
+        end = base + device.size
+        if base % 4 or base < 0 or end > 1 << 32:
+            raise ValueError("device base 0x%x is not a word address in the 32-bit address space" % base)
+        if not m.paged and base < m.memory_size:
+            raise ValueError("device at 0x%x overlaps the memory" % base)
+        if any(base < d.base + d.size and d.base < end for d in self.devices):
+            raise ValueError("device at 0x%x overlaps another device" % base)
+
+        device.base = base
+        device.bus = self
+        i = bisect.bisect(self.bases, base)
+        self.devices.insert(i, device)
+        self.bases.insert(i, base)
+        self.update_window()
+        return base
+
+    def unmap(self, device):
+        """
+        remove device from the bus
+        """
+        i = self.devices.index(device)
+        del self.devices[i]
+        del self.bases[i]
+        device.bus = None
+        self.update_window()
+
+    def update_window(self):
+        self.lo = self.bases[0] if self.devices else 0
+        self.hi = max(d.base + d.size for d in self.devices) if self.devices else 0
+        self.m.flush_decode()  # translated blocks have the window compiled in
+
+    def find(self, addr):
+        """
+        device mapped at addr, or None
+        """
+        i = bisect.bisect(self.bases, addr) - 1
+        if i >= 0:
+            device = self.devices[i]
+            if addr < device.base + device.size:
+                return device
+        return None
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Word access (LW / SW in the bus window)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def load(self, addr):
+        """
+        32-bit word at addr from its device (from memory between devices)
+        """
+        device = self.find(addr)
+        if device is None:
+            return self.m.read_i32(addr)
+        return ((int(device.read(addr - device.base)) + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+    def store(self, x, addr):
+        """
+        write the 32-bit word x at addr to its device (to memory between devices)
+        """
+        device = self.find(addr)
+        if device is None:
+            self.m.write_i32(x, addr)
+        else:
+            device.write(addr - device.base, int(x))
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Bulk transfers (DMA)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def region(self, addr, length):
+        """
+        bytes [addr, addr + length) of a device buffer or of the memory (a view where possible)
+        raises ValueError if the range is not inside one device buffer / the memory
+        """
+        device = self.find(addr)
+        if device is not None:
+            if not hasattr(device, 'buffer'):
+                raise ValueError("device at 0x%x has no buffer" % device.base)
+            return device.buffer(addr - device.base, length)
+        m = self.m
+        if m.paged:
+            return m.memory.read(addr, length)
+        if addr < 0 or addr + length > m.memory_size:
+            raise ValueError("range 0x%x + %d is outside the memory" % (addr, length))
+        return memoryview(m.memory)[addr:addr + length]
+
+    def copy(self, dst, src, length):
+        """
+        copy length bytes from src to dst (memory or device buffers) with one slice copy
+        """
+        if length <= 0:
+            return
+        source = self.region(src, length)
+        m = self.m
+        if self.find(dst) is not None:
+            self.region(dst, length)[:] = source
+            return
+        if m.paged:
+            m.memory.write(dst, bytes(source))
+        else:
+            self.region(dst, length)[:] = source
+        m.memory_written(dst, length)
+
+
+class block_device:
+    def __init__(self, path, blocks=None, block_size=SECTOR_SIZE):
+        """
+        path:       host file holding the blocks, created / extended to blocks * block_size bytes if needed
+        blocks:     number of blocks (None: as many as the existing file holds)
+        """
+        self.path       = path
+        self.file       = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        self.block_size = block_size
+
+        length = os.fstat(self.file.fileno()).st_size
+        if blocks is not None:
+            if length < blocks * block_size:
+                self.file.truncate(blocks * block_size)
+            length = blocks * block_size
+        self.blocks = length // block_size
+        length = self.blocks * block_size
+        if not length:
+            raise ValueError("block device %s has no blocks" % path)
+
+        # the file is mapped shared: guest writes reach the file, flush() makes them durable
+        self.mapping    = mmap.mmap(self.file.fileno(), length)
+        self.length     = length
+        self.size       = BLOCK_DATA + length
+
+        self.base       = None
+        self.bus        = None
+
+    def read(self, offset):
+        if offset >= BLOCK_DATA:
+            return unpack_from('<i', self.mapping, offset - BLOCK_DATA)[0]
+        if offset == BLOCK_COUNT:
+            return self.blocks
+        if offset == BLOCK_LENGTH:
+            return self.block_size
+        return 0
+
+    def write(self, offset, value):
+        if offset >= BLOCK_DATA:
+            pack_into('<i', self.mapping, offset - BLOCK_DATA, ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000)
+        elif offset == BLOCK_FLUSH:
+            self.flush()
+
+    def buffer(self, offset, length):
+        """
+        view of length bytes of the file at device offset (for DMA)
+        """
+        offset -= BLOCK_DATA
+        if offset < 0 or offset + length > self.length:
+            raise ValueError("range %d + %d is outside the blocks of %s" % (offset, length, self.path))
+        return memoryview(self.mapping)[offset:offset + length]
+
+    def flush(self):
+        self.mapping.flush()
+
+    def close(self):
+        """
+        flush and unmap the file (unmap the device first)
+        """
+        self.mapping.flush()
+        self.mapping.close()
+        self.file.close()
+
+
+class dma_engine:
+    size = 32
+
+    def __init__(self, irq=None):
+        """
+        irq: interrupt raised when a transfer finishes (None: no interrupt)
+        """
+        self.irq            = irq
+        self.src            = 0
+        self.dst            = 0
+        self.length         = 0
+        self.status         = 0
+        self.transferred    = 0
+
+        self.base           = None
+        self.bus            = None
+
+    def read(self, offset):
+        if offset == DMA_SRC:       return self.src
+        if offset == DMA_DST:       return self.dst
+        if offset == DMA_LENGTH:    return self.length
+        if offset == DMA_CONTROL:   return self.status
+        if offset == DMA_COUNT:     return self.transferred
+        return 0
+
+    def write(self, offset, value):
+        if offset == DMA_SRC:       self.src = value & 0xFFFFFFFF
+        elif offset == DMA_DST:     self.dst = value & 0xFFFFFFFF
+        elif offset == DMA_LENGTH:  self.length = value & 0xFFFFFFFF
+        elif offset == DMA_CONTROL: self.start()
+
+    def start(self):
+        """
+        run the transfer set up in the registers
+        """
+        try:
+            self.bus.copy(self.dst, self.src, self.length)
+            self.status = 0
+            self.transferred += self.length
+        except (ValueError, page_fault):
+            self.status = -1
+        if self.irq is not None:
+            self.bus.m.interrupts.raise_interrupt(self.irq)
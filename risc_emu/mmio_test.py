@@ -0,0 +1,167 @@
+"""
+This is a test for memory-mapped I/O: the bus, the mmap'd block device and the DMA engine
+"""
+
+import os
+import tempfile
+import time
+from machine import machine
+from assembler import assembler
+from programs import memcpy
+from mmio import block_device, dma_engine, BLOCK_COUNT, BLOCK_LENGTH, BLOCK_FLUSH, BLOCK_DATA
+from mmio import DMA_SRC, DMA_DST, DMA_LENGTH, DMA_CONTROL, DMA_COUNT
+
+zero, t0, t1, a0, a1, a2, a3, a4 = 0, 5, 6, 10, 11, 12, 13, 14
+IRQ = 3
+
+directory = tempfile.mkdtemp()
+
+def dma_program():
+    """
+    read block a3 of the disk (data at a0) into memory at a2 by DMA (engine at a1), wait for the
+    interrupt, add 1 to every word, write the block back to block a3 + 1 and flush the disk (registers at a4)
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', t1, zero, 512)
+    a.storeAssembly('MUL', t0, a3, t1)
+    a.storeAssembly('ADD', t0, a0, t0)                      # t0 = address of block a3
+    a.storeAssembly('SW', t0, DMA_SRC, a1)
+    a.storeAssembly('SW', a2, DMA_DST, a1)
+    a.storeAssembly('SW', t1, DMA_LENGTH, a1)
+    a.storeAssembly('SW', zero, DMA_CONTROL, a1)
+    a.storeAssembly('WFI')
+    a.storeAssembly('ADDi', t0, a2, 0)
+    a.storeAssembly('ADDi', t1, a2, 512)
+    a.addLabel('loop')
+    a.storeAssembly('LW', a3, 0, t0)
+    a.storeAssembly('ADDi', a3, a3, 1)
+    a.storeAssembly('SW', a3, 0, t0)
+    a.storeAssembly('ADDi', t0, t0, 4)
+    a.storeAssembly('BNE', t0, t1, 'loop')
+    a.storeAssembly('LW', t0, DMA_SRC, a1)
+    a.storeAssembly('ADDi', t0, t0, 512)                    # next block
+    a.storeAssembly('SW', a2, DMA_SRC, a1)
+    a.storeAssembly('SW', t0, DMA_DST, a1)
+    a.storeAssembly('SW', zero, DMA_CONTROL, a1)
+    a.storeAssembly('WFI')
+    a.storeAssembly('SW', zero, BLOCK_FLUSH, a4)
+    a.storeAssembly('LW', a0, DMA_COUNT, a1)
+    a.storeAssembly('LW', a3, DMA_CONTROL, a1)
+    a.addLabel('end')
+    a.storeAssembly('HALT')
+    return a
+
+#-------------------------------------------------------------------------------
+# Test 1: guest LW / SW on device registers and on the mmap'd file
+#-------------------------------------------------------------------------------
+path = os.path.join(directory, 'disk.img')
+for engine in ['interpreter', 'block']:
+    disk = block_device(path, blocks=64)
+    m = machine(mem_size=8192)
+    base = m.map_device(disk)
+    assert(base == 0x40000000 and disk.blocks == 64)
+
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('LW', t0, BLOCK_COUNT, a0)
+    a.storeAssembly('LW', t1, BLOCK_LENGTH, a0)
+    a.storeAssembly('SW', t1, 0, a1)                        # into block 0
+    a.storeAssembly('LW', a2, 0, a1)
+    a.storeAssembly('SW', zero, BLOCK_FLUSH, a0)
+    a.storeAssembly('SW', t0, 100, zero)                    # ordinary memory next to it
+    a.addLabel('end')
+    a.assemble().load(m, 0)
+    m.registers[a0], m.registers[a1] = base, base + BLOCK_DATA
+    assert(m.execute('start', 'end', engine=engine) == 'end')
+    assert(m.registers[t0] == 64 and m.registers[t1] == 512 and m.registers[a2] == 512 and m.read_i32(100) == 64)
+    m.unmap_device(disk)
+    disk.close()
+    with open(path, 'rb') as f:
+        assert(f.read(4) == (512).to_bytes(4, 'little'))
+print("Test 1: LW / SW reach the block device registers and file")
+
+#-------------------------------------------------------------------------------
+# Test 2: DMA between the disk and memory, completion interrupt
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    with open(path, 'wb') as f:
+        f.write(b''.join(i.to_bytes(4, 'little') for i in range(64 * 128)))
+    disk = block_device(path)
+    dma = dma_engine(irq=IRQ)
+    m = machine(mem_size=8192)
+    disk_base, dma_base = m.map_device(disk), m.map_device(dma)
+    assert(dma_base == disk_base + disk.size)
+    dma_program().assemble().load(m, 0)
+    m.registers[a0], m.registers[a1], m.registers[a2], m.registers[a3], m.registers[a4] = \
+        disk_base + BLOCK_DATA, dma_base, 4096, 5, disk_base
+
+    assert(m.execute('start', 'end', engine=engine) == 'end' and m.interrupts.cause == IRQ)
+    assert(m.registers[a0] == 1024 and m.registers[a3] == 0)
+    assert([m.read_i32(4096 + 4 * i) for i in range(128)] == [5 * 128 + i + 1 for i in range(128)])
+    m.unmap_device(dma)
+    m.unmap_device(disk)
+    disk.close()
+    with open(path, 'rb') as f:
+        data = f.read()
+    assert([int.from_bytes(data[6 * 512 + 4 * i:6 * 512 + 4 * i + 4], 'little') for i in range(128)] == [5 * 128 + i + 1 for i in range(128)])
+print("Test 2: DMA block read / write with completion interrupt")
+
+#-------------------------------------------------------------------------------
+# Test 3: DMA errors, dirty pages and cached code
+#-------------------------------------------------------------------------------
+disk = block_device(path)
+dma = dma_engine()
+m = machine(mem_size=8192)
+m.map_device(disk)
+dma_base = m.map_device(dma)
+bus = m.bus
+dma.src, dma.dst, dma.length = disk.base + BLOCK_DATA, 8000, 512          # past the end of memory
+dma.write(DMA_CONTROL, 1)
+assert(dma.read(DMA_CONTROL) == -1 and dma.transferred == 0)
+
+m.addLabel('start')
+m.storeAssembly('ADDi', a0, zero, 1)
+m.addLabel('end')
+m.execute('start', 'end')
+m.snapshot()
+bus.copy(0, disk.base + BLOCK_DATA, 4096)                                   # overwrite the code
+assert(m.decode_cache == {} and m.dirty == {0})
+m.restore()
+assert(m.execute('start', 'end') == 'end' and m.registers[a0] == 1)
+try:
+    m.map_device(dma_engine(), base=dma_base)
+    assert(False)
+except ValueError as error:
+    print("Test 3: " + str(error))
+m.unmap_device(dma)
+m.unmap_device(disk)
+assert(m.bus is None)
+disk.close()
+print("Test 3: DMA errors, snapshots and cached code")
+
+#-------------------------------------------------------------------------------
+# Test 4: moving 1 MiB: guest LW / SW loop vs one DMA transfer
+#-------------------------------------------------------------------------------
+size = 1 << 20
+disk = block_device(os.path.join(directory, 'big.img'), blocks=size // 512)
+m = machine(mem_size=size + 4096)
+disk_base = m.map_device(disk)
+dma_base = m.map_device(dma_engine())
+memcpy().assemble().load(m, 0)
+m.registers[a0], m.registers[a1], m.registers[a2] = disk_base + BLOCK_DATA, 4096, size // 4
+t = time.perf_counter()
+m.execute('start', 'end', engine='block')
+loop = time.perf_counter() - t
+
+t = time.perf_counter()
+m.bus.store(disk_base + BLOCK_DATA, dma_base + DMA_SRC)
+m.bus.store(4096, dma_base + DMA_DST)
+m.bus.store(size, dma_base + DMA_LENGTH)
+m.bus.store(0, dma_base + DMA_CONTROL)
+copy = time.perf_counter() - t
+print("Test 4: 1 MiB from the disk: LW / SW loop %.1f ms, DMA %.3f ms" % (loop * 1000, copy * 1000))
+assert(copy < loop)
+m.unmap_device(m.bus.devices[1])
+m.unmap_device(disk)
+disk.close()
@@ -0,0 +1,233 @@
+"""
+Sparse paged memory for the risc machine (backend 'paged', see backends.py).
+
+The address space is split into 4 KiB pages that are only allocated when they are first written,
+so a full 32-bit address space with code at the bottom and the stack at the top costs a few pages:
+
+    m = machine(1 << 32, backend='paged')
+    m.memory.stats()        # {'resident_pages': 3, 'resident_bytes': 12288, ...}
+
+Reading a page that was never written returns zeros without allocating it.
+Every page has permissions (PROT_READ / PROT_WRITE / PROT_EXEC, all set by default), an access
+without permission raises page_fault. Resident pages are kept in one dict per access type
+(readable / writable) that only holds the pages the access is allowed on, so the fast path of
+read_i32 / write_i32 is a single dict lookup and the permission check costs nothing extra.
+Addresses are taken modulo 2^32, so negative (int32 register) addresses reach the top of the address space.
+"""
+
+from struct import pack, pack_into, unpack_from
+
+PAGE_SHIFT  = 12
+PAGE_SIZE   = 1 << PAGE_SHIFT
+PAGE_MASK   = PAGE_SIZE - 1
+
+# page permissions (same values as mmap.PROT_*)
+PROT_READ   = 1
+PROT_WRITE  = 2
+PROT_EXEC   = 4
+PROT_ALL    = PROT_READ | PROT_WRITE | PROT_EXEC
+
+ACCESS_NAMES = {PROT_READ: 'read', PROT_WRITE: 'write', PROT_EXEC: 'execute'}
+
+
+class page_fault(Exception):
+    def __init__(self, addr, access):
+        """
+        access to addr outside of the memory or without permission
+        access: PROT_READ, PROT_WRITE or PROT_EXEC
+        """
+        super().__init__('%s fault at address 0x%08x' % (ACCESS_NAMES[access], addr))
+        self.addr   = addr
+        self.access = access
+
+
+class paged_memory:
+    def __init__(self, size):
+        """
+        Create an empty address space of size bytes (no page is allocated yet)
+        """
+        self.size       = size
+        self.page_count = -(-size >> PAGE_SHIFT)
+
+        # page number -> bytearray of every resident page
+        self.pages      = {}
+        # resident pages that may be read / written (subsets of self.pages, used by the fast path)
+        self.readable   = {}
+        self.writable   = {}
+        # page number -> permissions, pages not listed have PROT_ALL
+        self.protection = {}
+
+        self.page_allocations = 0
+
+    def __len__(self):
+        return self.size
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Word access (fast path)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def read_i32(self, addr):
+        """
+        read the 32-bit int at addr
+        """
+        addr &= 0xFFFFFFFF
+        page = self.readable.get(addr >> PAGE_SHIFT)
+        offset = addr & PAGE_MASK
+        if page is not None and offset <= PAGE_SIZE - 4:
+            return unpack_from('<i', page, offset)[0]
+        return unpack_from('<i', self.read(addr, 4))[0]
+
+    def write_i32(self, x, addr):
+        """
+        write the 32-bit int x (already wrapped to int32) at addr, allocating the page on first touch
+        """
+        addr &= 0xFFFFFFFF
+        page = self.writable.get(addr >> PAGE_SHIFT)
+        offset = addr & PAGE_MASK
+        if page is not None and offset <= PAGE_SIZE - 4:
+            pack_into('<i', page, offset, x)
+        else:
+            self.write(addr, pack('<i', x))
+
+    def fetch_i32(self, addr):
+        """
+        read the instruction word at addr (needs PROT_EXEC instead of PROT_READ)
+        """
+        return unpack_from('<i', self.read(addr & 0xFFFFFFFF, 4, PROT_EXEC))[0]
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Byte ranges (slow path: page crossings, untouched pages, permission checks)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def read(self, addr, length, access=PROT_READ):
+        """
+        read length bytes at addr, untouched pages read as zeros
+        """
+        data = bytearray(length)
+        for n, lo, hi, start in self.chunks(addr, length, access):
+            page = self.pages.get(n)
+            if page is not None:
+                data[start:start + hi - lo] = page[lo:hi]
+        return bytes(data)
+
+    def write(self, addr, data):
+        """
+        write the bytes data at addr, allocating every page that is touched for the first time
+        """
+        for n, lo, hi, start in self.chunks(addr, len(data), PROT_WRITE):
+            page = self.pages.get(n)
+            if page is None:
+                page = self.allocate(n)
+            page[lo:hi] = data[start:start + hi - lo]
+
+    def chunks(self, addr, length, access):
+        """
+        split [addr, addr + length) into (page number, start in page, end in page, start in data) per page
+        raises page_fault if the range leaves the memory or a page does not allow access
+        """
+        if addr < 0 or addr + length > self.size:
+            raise page_fault(addr, access)
+        chunks = []
+        start = 0
+        while start < length:
+            a = addr + start
+            n, lo = a >> PAGE_SHIFT, a & PAGE_MASK
+            if not self.protection.get(n, PROT_ALL) & access:
+                raise page_fault(a, access)
+            hi = min(PAGE_SIZE, lo + length - start)
+            chunks.append((n, lo, hi, start))
+            start += hi - lo
+        return chunks
+
+    def allocate(self, n):
+        """
+        allocate page n (zero-filled) and add it to the access dicts its permissions allow
+        """
+        page = self.pages[n] = bytearray(PAGE_SIZE)
+        self.page_allocations += 1
+        self.update_access(n)
+        return page
+
+    def update_access(self, n):
+        """
+        add / remove resident page n to / from the readable and writable dicts
+        """
+        page = self.pages.get(n)
+        perms = self.protection.get(n, PROT_ALL)
+        for access, pages in ((PROT_READ, self.readable), (PROT_WRITE, self.writable)):
+            if page is not None and perms & access:
+                pages[n] = page
+            else:
+                pages.pop(n, None)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Permissions
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def protect(self, addr, length, perms):
+        """
+        set the permissions of every page overlapping [addr, addr + length)
+        """
+        for n in range(addr >> PAGE_SHIFT, ((addr + length - 1) >> PAGE_SHIFT) + 1):
+            if perms == PROT_ALL:
+                self.protection.pop(n, None)
+            else:
+                self.protection[n] = perms
+            self.update_access(n)
+
+    def permissions(self, addr):
+        """
+        permissions of the page holding addr
+        """
+        return self.protection.get((addr & 0xFFFFFFFF) >> PAGE_SHIFT, PROT_ALL)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Copies (used by snapshots)
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def copy(self):
+        """
+        independent copy of the memory (resident pages and permissions)
+        """
+        clone = paged_memory(self.size)
+        clone.protection = dict(self.protection)
+        for n, page in self.pages.items():
+            clone.pages[n] = bytearray(page)
+            clone.update_access(n)
+        return clone
+
+    def copy_pages(self, source, pages):
+        """
+        make the given pages equal to those of source (another paged_memory),
+        pages that are not resident in source are released
+        """
+        for n in pages:
+            page = source.pages.get(n)
+            if page is None:
+                self.pages.pop(n, None)
+            elif n in self.pages:
+                self.pages[n][:] = page
+            else:
+                self.pages[n] = bytearray(page)
+            self.update_access(n)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Statistics
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def resident_bytes(self):
+        """
+        host memory used by page contents
+        """
+        return len(self.pages) * PAGE_SIZE
+
+    def stats(self):
+        """
+        resident-memory statistics
+        """
+        return {'address_space':    self.size,
+                'page_size':        PAGE_SIZE,
+                'resident_pages':   len(self.pages),
+                'resident_bytes':   self.resident_bytes(),
+                'page_allocations': self.page_allocations,
+                'protected_pages':  len(self.protection)}
@@ -0,0 +1,99 @@
+"""
+This is a test for the sparse paged memory (backend 'paged'): a full 32-bit address space,
+allocation on first touch, page permissions and resident-memory statistics
+"""
+
+from machine import machine, wrap32
+from paged_memory import page_fault, PROT_READ, PROT_EXEC, PAGE_SIZE
+from programs import fibonacci, factorial
+
+a0, sp = 10, 2
+
+#-------------------------------------------------------------------------------
+# Test 1: words anywhere in 4 GiB, only touched pages are allocated
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1 << 32, backend='paged')
+assert(m.memory.stats()['resident_pages'] == 0)
+
+m.write_i32(-5, 0xFFFFFFF0)
+m.write_i32(0x12345678, 0x80000000)
+m.write_i32(7, PAGE_SIZE - 2)                               # crosses a page boundary
+assert(m.read_i32(0xFFFFFFF0) == -5 and m.read_i32(0x80000000) == 0x12345678 and m.read_i32(PAGE_SIZE - 2) == 7)
+assert(m.read_i32(0x40000000) == 0)                         # untouched memory reads as zero ...
+stats = m.memory.stats()
+print("Test 1: " + str(stats))
+assert(stats['resident_pages'] == 4)                        # ... and is not allocated
+
+m.registers[5] = wrap32(0xFFFFFFF0)                         # negative register = top of the address space
+m.LW(6, 0, 5)
+m.SW(6, 4, 5)
+assert(m.registers[6] == -5 and m.read_i32(0xFFFFFFF4) == -5)
+
+#-------------------------------------------------------------------------------
+# Test 2: code at the bottom, stack at the top of the address space
+#-------------------------------------------------------------------------------
+results = []
+for engine in ['interpreter', 'block']:
+    for program, n, expected in [(fibonacci, 15, 610), (factorial, 10, 3628800)]:
+        m = machine(mem_size=1 << 32, backend='paged')
+        program(n).assemble().load(m, 0x1000)
+        m.registers[sp] = wrap32(0xFFFFF000)
+        m.execute('start', 'end', engine=engine)
+        results.append(m.registers[a0])
+        assert(m.registers[a0] == expected)
+        assert(m.memory.stats()['resident_pages'] <= 3)
+print("Test 2: fib(15), 10! with a 4 GiB address space = " + str(results))
+
+#-------------------------------------------------------------------------------
+# Test 3: code placed above 2 GiB (return addresses are negative int32 values)
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    m = machine(mem_size=1 << 32, backend='paged')
+    fibonacci(10).assemble().load(m, 0xC0000000)
+    m.registers[sp] = wrap32(0x00100000)
+    m.execute('start', 'end', engine=engine)
+    assert(m.registers[a0] == 55 and m.pc == m.getLabel('end'))
+print("Test 3: fib(10) at 0xC0000000 = 55")
+
+#-------------------------------------------------------------------------------
+# Test 4: page permissions
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1 << 32, backend='paged')
+fibonacci(10).assemble().load(m, 0)
+m.memory.protect(0, PAGE_SIZE, PROT_READ | PROT_EXEC)      # code: read + execute
+m.memory.protect(0x10000, PAGE_SIZE, PROT_READ)            # data: read only
+
+faults = []
+for access in [lambda: m.write_i32(1, 0), lambda: m.write_i32(1, 0x10000)]:
+    try:
+        access()
+    except page_fault as fault:
+        faults.append(fault.addr)
+assert(faults == [0, 0x10000])
+
+m.registers[sp] = 0x20000
+m.execute('start', 'end')                                   # executing read + execute code is fine
+assert(m.registers[a0] == 55)
+
+m.memory.protect(0, PAGE_SIZE, PROT_READ)                   # no longer executable
+m.flush_decode()
+assert(m.execute('start', 'end') == 'fault' and m.pc == m.getLabel('start'))
+print("Test 4: " + str(m.fault))
+assert(isinstance(m.fault, page_fault) and m.fault.access == PROT_EXEC)
+
+#-------------------------------------------------------------------------------
+# Test 5: snapshots of a paged memory
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1 << 32, backend='paged')
+fibonacci().assemble().load(m, 0x1000)
+m.registers[sp] = wrap32(0xFFFFF000)
+m.registers[a0] = 12
+m.snapshot()
+m.execute('start', 'end')
+assert(m.registers[a0] == 144 and m.memory.stats()['resident_pages'] == 2)
+m.restore()
+assert(m.memory.stats()['resident_pages'] == 1 and m.registers[a0] == 12)   # the stack page is released
+clone = m.fork()
+clone.execute('start', 'end')
+assert(clone.registers[a0] == 144 and m.memory.stats()['resident_pages'] == 1)
+print("Test 5: restore and fork of a paged machine")
@@ -0,0 +1,164 @@
+"""
+Whole-region predecoder and bulk disassembler of the risc machine.
+
+    table = m.predecode_region('start', 'end')      # decode every word of the region, fill the decode cache
+    print('\n'.join(table.disassemble(m.label_dictionary)))
+
+The code region is read as one uint32 array and every field is extracted for all words at once with numpy
+bit operations. The decode table is a struct of arrays: one array per field (opcode, funct3, funct7, rd, rs1,
+rs2 and the I / S / B / J immediates), plus the instruction of every word as an index into table.names
+(ILLEGAL for words that are not instructions, e.g. data between the code).
+Instructions are matched with the (mask, match) pairs of machine.decode_word, and the operands are taken in the
+order of machine.bind (= storeAssembly order), so the decode cache entries made from a table are the ones
+predecode() makes.
+"""
+
+import numpy as np
+
+# instruction index of words that do not decode
+ILLEGAL = -1
+
+# decode table fields of the operands (machine.bind order), by instruction or else by format
+OPERANDS = {
+    'JAL':  ('rd',  'imm_j'),
+    'JALR': ('rd',  'rs1',   'imm_i'),
+    'ADDi': ('rd',  'rs1',   'imm_i'),
+    'LW':   ('rd',  'imm_i', 'rs1'),
+    'S':    ('rs2', 'imm_s', 'rs1'),
+    'B':    ('rs1', 'rs2',   'imm_b'),
+    'R':    ('rd',  'rs1',   'rs2'),
+    'N':    (),
+}
+
+# ABI register names (disassembly)
+REGISTER_NAMES = ['zero', 'ra', 'sp', 'gp', 'tp', 't0', 't1', 't2', 's0', 's1', 'a0', 'a1', 'a2', 'a3', 'a4', 'a5',
+                  'a6', 'a7', 's2', 's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 's11', 't3', 't4', 't5', 't6']
+
+
+def sext(value, bits):
+    """
+    sign-extend the lowest 'bits' bits of an int64 array
+    """
+    return value - ((value >> (bits - 1)) & 1) * (1 << bits)
+
+
+class decode_table:
+    def __init__(self, words, base, masks):
+        """
+        decode the uint32 array words, stored at address base
+        masks: [mask, match, format-type, 'instruction'] in decoder dictionary order (machine.decoder_masks)
+        """
+        self.base   = base
+        # instruction names and formats, indexed like the masks
+        self.names  = [name for mask, match, typ, name in masks]
+        self.types  = [typ for mask, match, typ, name in masks]
+        self.words  = np.array(words, dtype=np.uint32)
+        w           = self.words.astype(np.int64)
+
+        self.opcode = (w & 0x7F).astype(np.int32)
+        self.funct3 = ((w >> 12) & 0x7).astype(np.int32)
+        self.funct7 = ((w >> 25) & 0x7F).astype(np.int32)
+        self.rd     = ((w >>  7) & 0x1F).astype(np.int32)
+        self.rs1    = ((w >> 15) & 0x1F).astype(np.int32)
+        self.rs2    = ((w >> 20) & 0x1F).astype(np.int32)
+
+        self.imm_i  = sext(w >> 20, 12).astype(np.int32)
+        self.imm_s  = sext(((w >> 25) << 5) | ((w >> 7) & 0x1F), 12).astype(np.int32)
+        self.imm_b  = sext(((w >> 31) << 12) | (((w >> 7) & 0x1) << 11) |
+                           (((w >> 25) & 0x3F) << 5) | (((w >> 8) & 0xF) << 1), 13).astype(np.int32)
+        self.imm_j  = sext(((w >> 31) << 20) | (((w >> 12) & 0xFF) << 12) |
+                           (((w >> 20) & 0x1) << 11) | (((w >> 21) & 0x3FF) << 1), 21).astype(np.int32)
+
+        # index of the first matching pattern, like decode_word
+        self.inst   = np.full(len(w), ILLEGAL, dtype=np.int16)
+        for i, (mask, match, typ, name) in reversed(list(enumerate(masks))):
+            self.inst[(w & mask) == match] = i
+
+    def __len__(self):
+        return len(self.words)
+
+    def addresses(self, index=None):
+        """
+        addresses of the words (of the words selected by index)
+        """
+        pcs = self.base + 4 * np.arange(len(self.words), dtype=np.int64)
+        return pcs if index is None else pcs[index]
+
+    def operands(self, i):
+        """
+        decode table fields of the operands of instruction i (machine.bind order)
+        """
+        return OPERANDS[self.names[i]] if self.names[i] in OPERANDS else OPERANDS[self.types[i]]
+
+    def histogram(self):
+        """
+        {'instruction': number of words} of the region ('ILLEGAL' for words that do not decode)
+        """
+        counts = np.bincount(self.inst.astype(np.int64) + 1, minlength=len(self.names) + 1)
+        names = ['ILLEGAL'] + self.names
+        return {names[i]: int(n) for i, n in enumerate(counts) if n}
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Decode cache
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def entries(self, m):
+        """
+        {pc: (handler, operands, 'instruction')} of machine m for every legal word, built one instruction at a time
+        """
+        entries = {}
+        for i, name in enumerate(self.names):
+            index = np.flatnonzero(self.inst == i)
+            if not len(index):
+                continue
+            handler = m.bind(name, 0, 0, 0, 0, 0, 0, 0)[0]
+            fields = self.operands(i)
+            columns = [getattr(self, f)[index].tolist() for f in fields]
+            pcs = self.addresses(index).tolist()
+            if columns:
+                entries.update(zip(pcs, [(handler, operands, name) for operands in zip(*columns)]))
+            else:
+                entries.update(dict.fromkeys(pcs, (handler, (), name)))
+        return entries
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Disassembler
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def disassemble(self, labels=None):
+        """
+        one line per word: 'address: word  INSTRUCTION operands' with operands in storeAssembly order,
+        registers by ABI name and branch / jump targets by label (labels: {'label': address})
+        words that do not decode are shown as '.word'
+        """
+        names, at = {}, {}
+        for label, pc in (labels or {}).items():
+            names.setdefault(pc, label)
+            at.setdefault(pc, []).append(label + ':')
+        pcs = self.addresses()
+        text = ['.word'] * len(self.words)
+        registers = np.array(REGISTER_NAMES, dtype=object)
+        for i, name in enumerate(self.names):
+            index = np.flatnonzero(self.inst == i)
+            if not len(index):
+                continue
+            columns = []
+            for f in self.operands(i):
+                values = getattr(self, f)[index]
+                if f in ('rd', 'rs1', 'rs2'):
+                    columns.append(registers[values].tolist())
+                elif f in ('imm_b', 'imm_j'):
+                    columns.append([names.get(t, t) for t in (pcs[index] + values).tolist()])
+                else:
+                    columns.append(values.tolist())
+            fmt = name + ' ' + ', '.join(['%s'] * len(columns)) if columns else name
+            lines = [fmt % operands for operands in zip(*columns)] if columns else [fmt] * len(index)
+            for j, line in zip(index.tolist(), lines):
+                text[j] = line
+
+        lines = ['%8x: %08x  %s' % line for line in zip(pcs.tolist(), self.words.tolist(), text)]
+        for pc in sorted(at, reverse=True):
+            if self.base <= pc < self.base + 4 * len(self.words) and (pc - self.base) % 4 == 0:
+                i = (pc - self.base) // 4
+                lines[i:i] = at[pc]
+        return lines
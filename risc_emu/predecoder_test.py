@@ -0,0 +1,114 @@
+"""
+This is a test for the whole-region predecoder: the decode table against decode_word, decode cache entries
+from the table, disassembling and re-assembling programs, and decoding a 100k-instruction image
+"""
+
+import time
+import numpy as np
+from machine import machine
+from assembler import assembler
+from programs import fibonacci, factorial, memcpy, bubble_sort, matmul
+from predecoder import decode_table, ILLEGAL, REGISTER_NAMES
+from paged_memory import PAGE_SIZE, PROT_READ
+from interrupts import STOP_FAULT
+
+PROGRAMS = [fibonacci(), factorial(), memcpy(), bubble_sort(), matmul()]
+
+#-------------------------------------------------------------------------------
+# Test 1: the decode table matches decode_word (program words and random words)
+#-------------------------------------------------------------------------------
+m = machine(mem_size=1000)
+rng = np.random.default_rng(1)
+words = np.concatenate([p.assemble().words.astype(np.uint32) for p in PROGRAMS] +
+                       [rng.integers(0, 1 << 32, 20000, dtype=np.uint64).astype(np.uint32)])
+words[-10:] = [0x10500073, 0x00100073, 0x00000073, 0x1005a52f, 0x18b6252f, 0x08b6252f, 0x00b6252f, 0, 0, 0]
+table = decode_table(words, 0, m.decoder_masks)
+for i, word in enumerate(words.tolist()):
+    entry = m.decode_word(word)
+    if entry is None:
+        assert(table.inst[i] == ILLEGAL)
+    else:
+        name = table.names[table.inst[i]]
+        assert(name == entry[2] and tuple(int(getattr(table, f)[i]) for f in table.operands(table.inst[i])) == entry[1])
+print("Test 1: %d words, %s" % (len(words), table.histogram()))
+
+#-------------------------------------------------------------------------------
+# Test 2: decode cache entries from the table, programs still run (both engines, paged memory)
+#-------------------------------------------------------------------------------
+for backend in ['numpy', 'paged']:
+    for engine in ['interpreter', 'block']:
+        m = machine(mem_size=4096 if backend == 'numpy' else 1 << 32, backend=backend)
+        end = fibonacci(12).assemble().load(m, 0)
+        m.registers[2] = 4000
+        table = m.predecode_region(0, end)
+        reference = machine(mem_size=4096)
+        fibonacci(12).assemble().load(reference, 0)
+        for pc in range(0, end, 4):
+            handler, operands, inst = reference.predecode(pc)
+            assert(m.decode_cache[pc][1:] == (operands, inst) and m.decode_cache[pc][0].__name__ == handler.__name__)
+        assert(m.execute('start', 'end', engine=engine) == 'end' and m.registers[10] == 144)
+
+        if backend == 'paged':
+            # code on a page without execute permission is not decoded, running it faults
+            m = machine(mem_size=1 << 32, backend=backend)
+            end = fibonacci(12).assemble().load(m, 0)
+            m.memory.protect(0, PAGE_SIZE, PROT_READ)
+            m.predecode_region(0, end)
+            assert(len(m.decode_cache) == 0 and m.execute('start', 'end', engine=engine) == STOP_FAULT)
+print("Test 2: decode cache filled from the table, fib(12) = 144")
+
+#-------------------------------------------------------------------------------
+# Test 3: disassemble, parse the text and assemble it again
+#-------------------------------------------------------------------------------
+def reassemble(lines):
+    a = assembler()
+    for line in lines:
+        if line.endswith(':'):
+            a.addLabel(line[:-1])
+            continue
+        text = line.split(': ', 1)[1].split('  ', 1)[1].replace(',', '').split()
+        args = []
+        for arg in text[1:]:
+            if arg in REGISTER_NAMES:
+                args.append(REGISTER_NAMES.index(arg))
+            elif arg.lstrip('-').isdigit():
+                args.append(int(arg))
+            else:
+                args.append(arg)
+        a.storeAssembly(text[0], *args)
+    return a.assemble().words.astype(np.uint32)
+
+for program in PROGRAMS:
+    m = machine(mem_size=4096)
+    end = program.assemble().load(m, 0)
+    lines = m.predecode_region(0, end).disassemble(m.label_dictionary)
+    assert(np.array_equal(reassemble(lines), program.assemble().words.astype(np.uint32)))
+print("Test 3: disassembled and re-assembled %d programs, e.g.\n  %s" % (len(PROGRAMS), '\n  '.join(lines[:8])))
+
+#-------------------------------------------------------------------------------
+# Test 4: a 100k-instruction image
+#-------------------------------------------------------------------------------
+n = 100000
+code = matmul().assemble().words.astype('<u4')
+m = machine(mem_size=4 * n)
+m.memory[:] = np.frombuffer(np.resize(code, n).tobytes(), dtype=np.uint8)
+t = time.perf_counter()
+table = decode_table(np.frombuffer(m.memory, dtype='<u4'), 0, m.decoder_masks)
+t_table = time.perf_counter() - t
+t = time.perf_counter()
+m.predecode_region(0, 4 * n)
+t_region = time.perf_counter() - t
+t = time.perf_counter()
+lines = table.disassemble()
+t_disassemble = time.perf_counter() - t
+
+reference = machine(mem_size=4 * n)
+reference.memory[:] = m.memory
+t = time.perf_counter()
+for pc in range(0, 4 * n, 4):
+    reference.predecode(pc)
+t_words = time.perf_counter() - t
+print("Test 4: %d words: table %.1f ms, decode cache %.1f ms (word by word %.1f ms), disassembly %.1f ms"
+      % (n, t_table * 1000, t_region * 1000, t_words * 1000, t_disassemble * 1000))
+assert(len(m.decode_cache) == n and len(lines) == n)
+assert(all(m.decode_cache[pc][1:] == entry[1:] for pc, entry in reference.decode_cache.items()))
@@ -0,0 +1,188 @@
+"""
+Execution profiler for the risc machine: per-pc execution counts, opcode / instruction-class histograms
+and a hot-spot report mapped back to the labels of the program.
+
+    p = m.start_profiler()
+    m.execute('start', 'end')
+    print(p.report())
+    m.stop_profiler()
+
+While the profiler is on, the interpreter appends every executed pc to a plain list (the block engine
+appends the start of every executed block). The list is only counted in bulk, with numpy.bincount,
+when it is full or when results are requested, so no counter is updated per instruction.
+With the profiler off, execute() runs its normal loops, which have no profiling code at all.
+
+Block counts are spread over the instructions of the block, a block left early by a store into
+cached code still counts all of its instructions.
+"""
+
+import bisect
+
+import numpy as np
+
+# number of buffered pcs / block starts counted at once
+BUFFER_SIZE = 1 << 16
+
+# instruction class of every instruction, used by class_histogram
+INSTRUCTION_CLASSES = {
+    'ADD': 'arithmetic', 'ADDi': 'arithmetic', 'SUB': 'arithmetic', 'MUL': 'arithmetic',
+    'XOR': 'logical',    'OR': 'logical',      'AND': 'logical',
+    'LW': 'load/store',  'SW': 'load/store',
+    'BEQ': 'branch',     'BNE': 'branch',      'BLT': 'branch',     'BGE': 'branch',
+    'JAL': 'jump',       'JALR': 'jump',
+    'LR': 'atomic',      'SC': 'atomic',       'AMOSWAP': 'atomic', 'AMOADD': 'atomic',
+    'WFI': 'system',     'HALT': 'system',     'ECALL': 'system'
+}
+
+
+def bulk_count(values):
+    """
+    (distinct values, counts) of a list of addresses, with one bincount over the span they cover
+    """
+    values = np.asarray(values, dtype=np.int64)
+    lo = int(values.min())
+    span = (int(values.max()) - lo) >> 2
+    if span > 4 * len(values):
+        return np.unique(values, return_counts=True)   # widely spread addresses: sort instead
+    counts = np.bincount((values - lo) >> 2, minlength=span + 1)
+    index = np.flatnonzero(counts)
+    return lo + 4 * index, counts[index]
+
+
+class profiler:
+    def __init__(self, m):
+        """
+        Create an empty profile for machine m
+        """
+        self.m              = m
+
+        # pcs executed by the interpreter / block starts executed by the block engine, not counted yet
+        self.buffer         = []
+        self.block_buffer   = []
+
+        # pc -> number of executions
+        self.counts         = {}
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Recording
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def flush(self):
+        """
+        count the buffered pcs and block starts into self.counts
+        """
+        counts = self.counts
+        if self.buffer:
+            for pc, n in zip(*bulk_count(self.buffer)):
+                pc = int(pc)
+                counts[pc] = counts.get(pc, 0) + int(n)
+            self.buffer = []
+        if self.block_buffer:
+            blocks = self.m.translator.blocks
+            for start, n in zip(*bulk_count(self.block_buffer)):
+                blk = blocks.get(int(start))
+                if blk is None:
+                    continue  # not a translated block, its instruction was recorded by m.step
+                for i in range(blk.length):
+                    pc = blk.start + 4 * i
+                    counts[pc] = counts.get(pc, 0) + int(n)
+            self.block_buffer = []
+
+    def clear(self):
+        """
+        drop everything recorded so far
+        """
+        self.buffer = []
+        self.block_buffer = []
+        self.counts = {}
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Results
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def pc_counts(self):
+        """
+        {pc: number of executions}
+        """
+        self.flush()
+        return dict(self.counts)
+
+    def total(self):
+        """
+        number of executed instructions
+        """
+        return sum(self.pc_counts().values())
+
+    def instruction_at(self, pc):
+        """
+        name of the instruction at pc ('?' if it can not be decoded)
+        """
+        entry = self.m.decode_cache.get(pc) or self.m.decode_word(self.m.read_i32(pc) & 0xFFFFFFFF)
+        return entry[2] if entry is not None else '?'
+
+    def opcode_histogram(self):
+        """
+        {'instruction': number of executions}
+        """
+        histogram = {}
+        for pc, n in self.pc_counts().items():
+            inst = self.instruction_at(pc)
+            histogram[inst] = histogram.get(inst, 0) + n
+        return histogram
+
+    def class_histogram(self):
+        """
+        {instruction class: number of executions} (see INSTRUCTION_CLASSES)
+        """
+        histogram = {}
+        for inst, n in self.opcode_histogram().items():
+            cls = INSTRUCTION_CLASSES.get(inst, 'other')
+            histogram[cls] = histogram.get(cls, 0) + n
+        return histogram
+
+    def label_of(self, pc):
+        """
+        pc as 'label+offset' relative to the closest label at or before it
+        """
+        labels = sorted((addr, name) for name, addr in self.m.label_dictionary.items())
+        i = bisect.bisect_right([addr for addr, name in labels], pc) - 1
+        if i < 0:
+            return hex(pc)
+        addr, name = labels[i]
+        return name if addr == pc else '%s+%d' % (name, pc - addr)
+
+    def label_counts(self):
+        """
+        {label: instructions executed between this label and the next one}
+        """
+        labels = sorted((addr, name) for name, addr in self.m.label_dictionary.items())
+        starts = [addr for addr, name in labels]
+        histogram = {}
+        for pc, n in self.pc_counts().items():
+            i = bisect.bisect_right(starts, pc) - 1
+            name = labels[i][1] if i >= 0 else '?'
+            histogram[name] = histogram.get(name, 0) + n
+        return histogram
+
+    def hot_spots(self, n=10):
+        """
+        the n most executed pcs as [(pc, 'label+offset', 'instruction', count)]
+        """
+        ranked = sorted(self.pc_counts().items(), key=lambda item: (-item[1], item[0]))[:n]
+        return [(pc, self.label_of(pc), self.instruction_at(pc), count) for pc, count in ranked]
+
+    def report(self, n=10):
+        """
+        ranked hot-spot report with the label and class histograms
+        """
+        total = self.total() or 1
+        lines = ['%d instructions executed' % self.total(), '',
+                 '%10s  %-24s %-6s %10s %7s' % ('pc', 'location', 'inst', 'count', '%')]
+        for pc, location, inst, count in self.hot_spots(n):
+            lines.append('%10d  %-24s %-6s %10d %6.1f%%' % (pc, location, inst, count, 100.0 * count / total))
+
+        for title, histogram in [('label', self.label_counts()), ('class', self.class_histogram())]:
+            lines += ['', '%-24s %10s %7s' % (title, 'count', '%')]
+            for name, count in sorted(histogram.items(), key=lambda item: -item[1]):
+                lines.append('%-24s %10d %6.1f%%' % (name, count, 100.0 * count / total))
+        return '\n'.join(lines)
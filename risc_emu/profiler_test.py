@@ -0,0 +1,62 @@
+"""
+This is a test for the execution profiler (per-pc counts, histograms, hot-spot report)
+"""
+
+from machine import machine
+from programs import fibonacci
+
+a0 = 10
+
+#-------------------------------------------------------------------------------
+# Test 1: both engines give the same per-pc counts, matching the execution metric
+#-------------------------------------------------------------------------------
+profiles = {}
+for engine in ['interpreter', 'block']:
+    m = machine(mem_size=8000)
+    fibonacci(12).assemble().load(m, 0)
+    m.registers[2] = 7000
+    m.debug = True
+    p = m.start_profiler()
+    m.execute('start', 'end', engine=engine)
+    assert(m.stop_profiler() is p and m.profiler is None)
+    assert(m.registers[a0] == 144 and p.total() == m.total_number_of_instructions)
+    profiles[engine] = p
+
+counts = profiles['interpreter'].pc_counts()
+assert(counts == profiles['block'].pc_counts())
+print("Test 1: " + str(profiles['interpreter'].total()) + " instructions profiled on both engines")
+
+#-------------------------------------------------------------------------------
+# Test 2: histograms and labels
+#-------------------------------------------------------------------------------
+p = profiles['interpreter']
+opcodes = p.opcode_histogram()
+classes = p.class_histogram()
+assert(sum(opcodes.values()) == sum(classes.values()) == p.total())
+assert(opcodes['JALR'] == counts[p.m.getLabel('BaseCase')] + counts[p.m.getLabel('BaseCase') - 4])
+assert(classes['load/store'] == opcodes['LW'] + opcodes['SW'])
+
+labels = p.label_counts()
+assert(labels['start'] == 3 and 'end' not in labels)  # execution stops at 'end'
+assert(p.label_of(p.m.getLabel('fibonacci') + 8) == 'fibonacci+8')
+
+pc, location, inst, count = p.hot_spots(1)[0]
+assert(count == max(counts.values()) and location.startswith('fibonacci'))
+print("Test 2: hottest instruction: %s (%s) executed %d times" % (location, inst, count))
+print(p.report(5))
+
+#-------------------------------------------------------------------------------
+# Test 3: instructionCount runs, profiling off records nothing
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    m = machine(mem_size=8000)
+    fibonacci(12).assemble().load(m, 0)
+    m.registers[2] = 7000
+    p = m.start_profiler()
+    m.execute('start', instructionCount=1001, engine=engine)
+    assert(p.total() == 1001)
+    m.stop_profiler()
+
+    m.execute('start', 'end', engine=engine)
+    assert(p.total() == 1001)
+print("Test 3: instructionCount runs are profiled exactly")
@@ -0,0 +1,189 @@
+"""
+Guest programs for the risc machine, written with the assembler (assembler.py)
+Every program starts at label 'start' and stops at label 'end'. Scalar results are left in a0,
+the memory kernels (memcpy, bubble_sort, matmul) take addresses in a0.. and leave their results in memory.
+"""
+
+from assembler import assembler
+
+zero, ra, sp, t0, t1, t2, s0, s1, a0, a1, a2, a3 = 0, 1, 2, 5, 6, 7, 8, 9, 10, 11, 12, 13
+s2, s3, s4, s5, s6, t3, t4, t5 = 18, 19, 20, 21, 22, 28, 29, 30
+
+
+def fibonacci(n=None):
+    """
+    recursive fibonacci of n (n = None: the argument is taken from a0)
+    """
+    a = assembler()
+    a.addLabel('start')
+    if n is not None:
+        a.storeAssembly('ADDi', a0, 0, n)
+    a.storeAssembly('ADDi', s0, 0, 1)
+    a.storeAssembly('JAL', ra, 'fibonacci')
+    a.addLabel('end')
+    a.storeAssembly('ADD', t2, 0, a0)
+
+    a.addLabel('fibonacci')
+    a.storeAssembly('BEQ', s0, a0, 'BaseCase')
+    a.storeAssembly('BLT', a0, s0, 'BaseCase')
+    a.storeAssembly('ADDi', sp, sp, -12)
+    a.storeAssembly('SW', ra, 8, sp)
+    a.storeAssembly('SW', a0, 4, sp)
+    a.storeAssembly('ADDi', a0, a0, -1)
+    a.storeAssembly('JAL', ra, 'fibonacci')
+    a.storeAssembly('SW', a0, 0, sp)
+    a.storeAssembly('LW', a0, 4, sp)
+    a.storeAssembly('ADDi', a0, a0, -2)
+    a.storeAssembly('JAL', ra, 'fibonacci')
+    a.storeAssembly('LW', t0, 0, sp)
+    a.storeAssembly('ADD', a0, a0, t0)
+    a.storeAssembly('LW', ra, 8, sp)
+    a.storeAssembly('ADDi', sp, sp, 12)
+    a.storeAssembly('JALR', ra, ra, 0)
+
+    a.addLabel('BaseCase')
+    a.storeAssembly('JALR', ra, ra, 0)
+    return a
+
+
+def factorial(n=None):
+    """
+    recursive factorial of n (n = None: the argument is taken from a0)
+    """
+    a = assembler()
+    a.addLabel('start')
+    if n is not None:
+        a.storeAssembly('ADDi', a0, 0, n)
+    a.storeAssembly('JAL', ra, 'factorial')
+    a.addLabel('end')
+    a.storeAssembly('ADDi', t2, 0, 1)
+
+    a.addLabel('factorial')
+    a.storeAssembly('BEQ', a0, 0, 'return')
+    a.storeAssembly('ADDi', sp, sp, -8)
+    a.storeAssembly('SW', ra, 4, sp)
+    a.storeAssembly('SW', a0, 0, sp)
+    a.storeAssembly('ADDi', a0, a0, -1)
+    a.storeAssembly('JAL', ra, 'factorial')
+    a.storeAssembly('LW', a1, 0, sp)
+    a.storeAssembly('ADDi', sp, sp, 4)
+    a.storeAssembly('MUL', a0, a1, a0)
+    a.storeAssembly('LW', ra, 0, sp)
+    a.storeAssembly('ADDi', sp, sp, 4)
+    a.storeAssembly('JALR', ra, ra, 0)
+
+    a.addLabel('return')
+    a.storeAssembly('ADDi', a0, 0, 1)
+    a.storeAssembly('JALR', ra, ra, 0)
+    return a
+
+
+def memcpy():
+    """
+    copy a2 words from address a0 to address a1
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('BEQ', a2, 0, 'end')
+    a.addLabel('loop')
+    a.storeAssembly('LW', t0, 0, a0)
+    a.storeAssembly('SW', t0, 0, a1)
+    a.storeAssembly('ADDi', a0, a0, 4)
+    a.storeAssembly('ADDi', a1, a1, 4)
+    a.storeAssembly('ADDi', a2, a2, -1)
+    a.storeAssembly('BNE', a2, 0, 'loop')
+    a.addLabel('end')
+    a.storeAssembly('ADD', t2, 0, a0)
+    return a
+
+
+def bubble_sort():
+    """
+    sort the a1 words at address a0 in ascending order (signed)
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', s1, a1, -1)         # s1 = comparisons in this pass
+    a.addLabel('pass')
+    a.storeAssembly('BGE', 0, s1, 'end')
+    a.storeAssembly('ADDi', t0, a0, 0)
+    a.storeAssembly('ADDi', t1, s1, 0)
+    a.addLabel('compare')
+    a.storeAssembly('LW', t2, 0, t0)
+    a.storeAssembly('LW', t3, 4, t0)
+    a.storeAssembly('BGE', t3, t2, 'ordered')
+    a.storeAssembly('SW', t3, 0, t0)
+    a.storeAssembly('SW', t2, 4, t0)
+    a.addLabel('ordered')
+    a.storeAssembly('ADDi', t0, t0, 4)
+    a.storeAssembly('ADDi', t1, t1, -1)
+    a.storeAssembly('BNE', t1, 0, 'compare')
+    a.storeAssembly('ADDi', s1, s1, -1)
+    a.storeAssembly('JAL', 0, 'pass')
+    a.addLabel('end')
+    a.storeAssembly('ADD', t2, 0, a0)
+    return a
+
+
+def matmul():
+    """
+    C = A x B for n x n word matrices stored row by row: A at a0, B at a1, C at a2, n in a3
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADD', s1, a3, a3)
+    a.storeAssembly('ADD', s1, s1, s1)          # s1 = row size in bytes (4n)
+    a.storeAssembly('ADDi', s2, a0, 0)          # s2 = row i of A
+    a.storeAssembly('ADDi', s3, a2, 0)          # s3 = C[i][j]
+    a.storeAssembly('ADDi', s4, a3, 0)          # s4 = rows left
+    a.addLabel('row')
+    a.storeAssembly('BEQ', s4, 0, 'end')
+    a.storeAssembly('ADDi', s5, a1, 0)          # s5 = column j of B
+    a.storeAssembly('ADDi', s6, a3, 0)          # s6 = columns left
+    a.addLabel('column')
+    a.storeAssembly('BEQ', s6, 0, 'next_row')
+    a.storeAssembly('ADDi', t0, s2, 0)          # t0 = A[i][k]
+    a.storeAssembly('ADDi', t1, s5, 0)          # t1 = B[k][j]
+    a.storeAssembly('ADDi', t2, a3, 0)          # t2 = k left
+    a.storeAssembly('ADDi', t3, 0, 0)           # t3 = sum
+    a.addLabel('dot')
+    a.storeAssembly('LW', t4, 0, t0)
+    a.storeAssembly('LW', t5, 0, t1)
+    a.storeAssembly('MUL', t4, t4, t5)
+    a.storeAssembly('ADD', t3, t3, t4)
+    a.storeAssembly('ADDi', t0, t0, 4)
+    a.storeAssembly('ADD', t1, t1, s1)
+    a.storeAssembly('ADDi', t2, t2, -1)
+    a.storeAssembly('BNE', t2, 0, 'dot')
+    a.storeAssembly('SW', t3, 0, s3)
+    a.storeAssembly('ADDi', s3, s3, 4)
+    a.storeAssembly('ADDi', s5, s5, 4)
+    a.storeAssembly('ADDi', s6, s6, -1)
+    a.storeAssembly('JAL', 0, 'column')
+    a.addLabel('next_row')
+    a.storeAssembly('ADD', s2, s2, s1)
+    a.storeAssembly('ADDi', s4, s4, -1)
+    a.storeAssembly('JAL', 0, 'row')
+    a.addLabel('end')
+    a.storeAssembly('ADD', t2, 0, a0)
+    return a
+
+
+def count_loop(n=None):
+    """
+    tight loop counting a0 up from 0 to n (n = None: n is taken from a0)
+    """
+    a = assembler()
+    a.addLabel('start')
+    if n is not None:
+        a.storeAssembly('ADDi', a0, 0, n)
+    a.storeAssembly('ADDi', t0, a0, 0)
+    a.storeAssembly('ADDi', a0, 0, 0)
+    a.storeAssembly('BEQ', t0, 0, 'end')
+    a.addLabel('loop')
+    a.storeAssembly('ADDi', a0, a0, 1)
+    a.storeAssembly('ADDi', t0, t0, -1)
+    a.storeAssembly('BNE', t0, 0, 'loop')
+    a.addLabel('end')
+    a.storeAssembly('ADD', t2, 0, a0)
+    return a
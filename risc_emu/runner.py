@@ -0,0 +1,163 @@
+"""
+This is a job runner that spreads many runs of assembled programs over all cores.
+
+A job is one run of a program: the machine holding the assembled program (the template),
+an initial register / memory setup, an entry and an end label, and the memory ranges to return.
+
+    jobs = [job(m, registers={a0: n}, ranges=[(0, 16)]) for n in range(1000)]
+    results = run_jobs(jobs)
+    results[10].registers[a0]
+
+The memory of every template is published once through multiprocessing.shared_memory.
+Every worker process builds one machine per template (machine.__init__ + copy of the image) when it
+starts and snapshots it; every job restores that snapshot, which only copies back the pages the
+previous job wrote. No job pays for machine construction, storeAssembly or pickling the program.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from machine import machine
+from snapshot import PAGE_SHIFT
+
+
+class job:
+    def __init__(self, program, registers=None, memory=None, start='start', end='end', instructionCount=0,
+                 ranges=(), engine='interpreter'):
+        """
+        program:            machine with the assembled program stored in memory (used as template)
+        registers:          {register: value} set before the run
+        memory:             {address: bytes or int} written before the run (an int is written as a 32-bit word)
+        start, end:         entry and end label (end=None runs instructionCount instructions)
+        ranges:             [(address, length)] memory ranges returned with the result
+        engine:             execution engine passed to machine.execute
+        """
+        self.program            = program
+        self.registers          = registers or {}
+        self.memory             = memory or {}
+        self.start              = start
+        self.end                = end
+        self.instructionCount   = instructionCount
+        self.ranges             = list(ranges)
+        self.engine             = engine
+
+
+class job_result:
+    def __init__(self, registers, pc, memory):
+        """
+        registers:  final register file (np.int32 array of 32)
+        pc:         final program counter
+        memory:     {address: bytes} for every requested range
+        """
+        self.registers  = registers
+        self.pc         = pc
+        self.memory     = memory
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Worker side
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+# per worker process: [(machine, image)] in the order the programs were published
+worker_programs = []
+
+def worker_init(programs):
+    """
+    attach the shared program images and build one template machine per program
+    programs: [(shared memory name, mem_size, label dictionary, backend name)]
+    """
+    for name, mem_size, labels, backend in programs:
+        shm = shared_memory.SharedMemory(name=name)
+        image = shm.buf[:mem_size]
+
+        m = machine(mem_size, backend=backend)
+        memoryview(m.memory)[:] = image
+        m.label_dictionary = dict(labels)
+        m.snapshot()
+        worker_programs.append((m, image, shm))
+
+def run_job(task):
+    """
+    run one job on the worker's template machine for its program
+    """
+    index, registers, memory, start, end, instructionCount, ranges, engine = task
+    m, image, shm = worker_programs[index]
+
+    # back to the freshly loaded program: copies the pages the previous job wrote
+    m.restore()
+    for reg, value in registers.items():
+        m.registers[reg] = value
+    write_memory(m, memory)
+
+    m.execute(start, end, instructionCount, engine=engine)
+    return job_result(np.array(m.registers, dtype=np.int32), int(m.pc),
+                      {addr: bytes(m.memory[addr:addr + length]) for addr, length in ranges})
+
+def write_memory(m, memory):
+    """
+    write {address: bytes or int} into the memory of the snapshotted machine m (an int is a 32-bit word),
+    so the next restore() copies the written pages back
+    """
+    for addr, data in memory.items():
+        if isinstance(data, (int, np.integer)):
+            m.write_i32(int(data), addr)
+        else:
+            data = bytes(data)
+            if not data:
+                continue
+            memoryview(m.memory)[addr:addr + len(data)] = data
+            m.dirty.update(range(addr >> PAGE_SHIFT, ((addr + len(data) - 1) >> PAGE_SHIFT) + 1))
+            if addr < m.decode_hi + 4 and addr + len(data) > m.decode_lo:
+                m.flush_decode()
+
+def run_chunk(tasks):
+    """
+    run a list of jobs, so one round trip to the worker covers many jobs
+    """
+    return [run_job(task) for task in tasks]
+
+
+#------------------------------------------------------------------------------------------------------------------------------------------------
+# Parent side
+#------------------------------------------------------------------------------------------------------------------------------------------------
+
+def run_jobs(jobs, max_workers=None, chunksize=None):
+    """
+    run all jobs on a process pool and return their job_results in the same order
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = chunksize or max(1, len(jobs) // (4 * max_workers))
+
+    # publish every distinct program image once
+    index = {}
+    blocks = []
+    programs = []
+    tasks = []
+    try:
+        for j in jobs:
+            key = id(j.program)
+            if key not in index:
+                m = j.program
+                shm = shared_memory.SharedMemory(create=True, size=max(1, m.memory_size))
+                shm.buf[:m.memory_size] = bytes(m.memory)
+                blocks.append(shm)
+                index[key] = len(programs)
+                programs.append((shm.name, m.memory_size, dict(m.label_dictionary), m.backend.name))
+            tasks.append((index[key], j.registers, j.memory, j.start, j.end, j.instructionCount, j.ranges, j.engine))
+
+        chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                                 initializer=worker_init, initargs=(programs,)) as pool:
+            results = []
+            for chunk in pool.map(run_chunk, chunks):
+                results.extend(chunk)
+        return results
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,87 @@
+"""
+This is a test for the process-pool job runner: many fibonacci runs spread over worker processes
+"""
+
+import time
+import numpy as np
+from machine import machine
+from runner import job, run_jobs
+
+ra, sp, t0, t1, s0, a0, a1 = 1, 2, 5, 6, 8, 10, 11
+
+#-------------------------------------------------------------------------------
+# fibonacci program, the argument n is taken from a0
+#-------------------------------------------------------------------------------
+fib_program = m = machine(mem_size=8000)
+m.pc = 4000
+m.addLabel('BaseCase')
+m.storeAssembly('JALR', ra, ra, 0)
+m.addLabel('fibonacci')
+m.storeAssembly('BEQ', s0, a0, 'BaseCase')
+m.storeAssembly('BLT', a0, s0, 'BaseCase')
+m.storeAssembly('ADDi', sp, sp, -12)
+m.storeAssembly('SW', ra, 8, sp)
+m.storeAssembly('SW', a0, 4, sp)
+m.storeAssembly('ADDi', a0, a0, -1)
+m.storeAssembly('JAL', ra, 'fibonacci')
+m.storeAssembly('SW', a0, 0, sp)
+m.storeAssembly('LW', a0, 4, sp)
+m.storeAssembly('ADDi', a0, a0, -2)
+m.storeAssembly('JAL', ra, 'fibonacci')
+m.storeAssembly('LW', t0, 0, sp)
+m.storeAssembly('ADD', a0, a0, t0)
+m.storeAssembly('LW', ra, 8, sp)
+m.storeAssembly('ADDi', sp, sp, 12)
+m.storeAssembly('JALR', ra, ra, 0)
+m.addLabel('start')
+m.storeAssembly('ADDi', s0, 0, 1)
+m.storeAssembly('JAL', ra, 'fibonacci')
+m.addLabel('end')
+
+#-------------------------------------------------------------------------------
+# a second program: running sums of the words in memory[0 .. 4*n) into memory[400 ..), n in a1
+#-------------------------------------------------------------------------------
+s = machine(mem_size=2000, backend='native')
+s.pc = 1000
+s.addLabel('start')
+s.storeAssembly('ADDi', a0, 0, 0)
+s.storeAssembly('ADDi', t0, 0, 0)
+s.addLabel('loop')
+s.storeAssembly('LW', t1, 0, t0)
+s.storeAssembly('ADD', a0, a0, t1)
+s.storeAssembly('SW', a0, 400, t0)
+s.storeAssembly('ADDi', t0, t0, 4)
+s.storeAssembly('ADDi', a1, a1, -1)
+s.storeAssembly('BNE', a1, 0, 'loop')
+s.addLabel('end')
+
+#-------------------------------------------------------------------------------
+# Test 1: fib(n) for n = 0..19 plus sums, on 2 workers
+#-------------------------------------------------------------------------------
+jobs = [job(fib_program, registers={a0: n, sp: 8000}, engine='block') for n in range(20)]
+jobs += [job(s, registers={a1: 3}, memory={0: np.array([1, 2, 3], dtype='<i4').tobytes(), 8: 10}, ranges=[(400, 12)])]
+
+t = time.perf_counter()
+results = run_jobs(jobs, max_workers=2)
+print("Test 1: %d jobs in %.2fs" % (len(jobs), time.perf_counter() - t))
+
+fib = [0, 1]
+for i in range(18): fib.append(fib[-1] + fib[-2])
+assert([r.registers[a0] for r in results[:20]] == fib)
+assert(all(r.pc == fib_program.getLabel('end') for r in results[:20]))
+
+r = results[-1]
+print("Test 1: running sums = " + str(np.frombuffer(r.memory[400], dtype='<i4')))
+assert(r.registers[a0] == 1 + 2 + 10)
+assert((np.frombuffer(r.memory[400], dtype='<i4') == [1, 3, 13]).all())
+
+#-------------------------------------------------------------------------------
+# Test 2: workers reuse their template machine, results match a local run
+#-------------------------------------------------------------------------------
+jobs = [job(s, registers={a1: n}, memory={4 * i: i for i in range(n)}, ranges=[(400, 4 * n)]) for n in range(1, 40)]
+results = run_jobs(jobs, max_workers=2, chunksize=5)
+for n, r in zip(range(1, 40), results):
+    sums = np.cumsum(np.arange(n))
+    assert(r.registers[a0] == sums[-1])
+    assert((np.frombuffer(r.memory[400], dtype='<i4') == sums).all())
+print("Test 2: %d jobs match the expected running sums" % len(jobs))
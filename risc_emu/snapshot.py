@@ -0,0 +1,88 @@
+"""
+Copy-on-write snapshots of the machine state (see machine.snapshot / restore / fork).
+
+A snapshot keeps the registers, pc and labels, and writes the memory once into an in-memory file.
+- restore:  the machine tracks which pages were written since the snapshot (machine.dirty), only those
+            pages are copied back, so resetting costs time proportional to the dirty pages
+- fork:     the clone maps the snapshot file privately (mmap.ACCESS_COPY), the operating system only
+            copies the pages the clone writes to
+Paged memories (see paged_memory.py) are copied page by page instead of going through a file.
+"""
+
+import mmap
+import os
+import tempfile
+
+import numpy as np
+
+from paged_memory import PAGE_SHIFT, PAGE_SIZE, paged_memory
+
+
+def memory_file(data):
+    """
+    anonymous file holding data (memfd where available)
+    """
+    if hasattr(os, 'memfd_create'):
+        f = os.fdopen(os.memfd_create('riscv-snapshot'), 'w+b')
+    else:
+        f = tempfile.TemporaryFile()
+    f.write(data)
+    f.flush()
+    return f
+
+
+class snapshot:
+    def __init__(self, m):
+        """
+        capture the state of machine m
+        """
+        self.memory_size        = m.memory_size
+        self.registers          = [int(r) for r in m.registers]
+        self.pc                 = int(m.pc)
+        self.flag               = m.flag
+        self.label_dictionary   = dict(m.label_dictionary)
+
+        if isinstance(m.memory, paged_memory):
+            self.file   = None
+            self.image  = m.memory.copy()
+            return
+        self.file   = memory_file(memoryview(m.memory))
+        self.image  = mmap.mmap(self.file.fileno(), self.memory_size, access=mmap.ACCESS_READ) if self.memory_size else b''
+
+    def memory(self, backend):
+        """
+        memory for a forked machine: a private copy-on-write mapping of the snapshot (numpy backend),
+        or a full copy for backends that need their own buffer type
+        """
+        if self.file is None:
+            return self.image.copy()
+        if backend.name == 'numpy' and self.memory_size:
+            mapping = mmap.mmap(self.file.fileno(), self.memory_size, access=mmap.ACCESS_COPY)
+            return np.frombuffer(mapping, dtype=np.uint8)
+        memory = backend.memory(self.memory_size)
+        memoryview(memory)[:] = self.image
+        return memory
+
+    def copy_pages(self, memory, pages):
+        """
+        copy the given pages of the snapshot back into memory
+        """
+        if self.file is None:
+            memory.copy_pages(self.image, pages)
+            return
+        view = memoryview(memory)
+        for page in pages:
+            lo = page << PAGE_SHIFT
+            hi = min(lo + PAGE_SIZE, self.memory_size)
+            view[lo:hi] = self.image[lo:hi]
+
+    def copy_all(self, memory):
+        """
+        copy the whole snapshot back into memory
+        """
+        if self.file is None:
+            changed = set(memory.pages) | set(memory.protection) | set(self.image.protection)
+            memory.protection = dict(self.image.protection)
+            memory.copy_pages(self.image, changed | set(self.image.pages))
+            return
+        memoryview(memory)[:] = self.image
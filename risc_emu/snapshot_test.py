@@ -0,0 +1,68 @@
+"""
+This is a test for snapshot() / restore() / fork() (copy-on-write machine state)
+"""
+
+import time
+import numpy as np
+from machine import machine
+from programs import fibonacci
+
+sp, a0 = 2, 10
+
+#-------------------------------------------------------------------------------
+# Test 1: restore to a post-load checkpoint only copies the dirty pages
+#-------------------------------------------------------------------------------
+for backend in ['numpy', 'native']:
+    for engine in ['interpreter', 'block']:
+        m = machine(mem_size=16 << 20, backend=backend)
+        fibonacci().assemble().load(m, 4000)
+        m.registers[a0], m.registers[sp] = 10, 16 << 20
+        clean = bytes(m.memory)
+        snap = m.snapshot()
+
+        m.execute('start', 'end', engine=engine)
+        assert(m.registers[a0] == 55 and bytes(m.memory) != clean)
+        dirty = len(m.dirty)
+
+        t = time.perf_counter()
+        m.restore()
+        t = time.perf_counter() - t
+        assert(bytes(m.memory) == clean and m.registers[a0] == 10 and m.pc == snap.pc and len(m.dirty) == 0)
+
+        m.execute('start', 'end', engine=engine)
+        assert(m.registers[a0] == 55)
+        print("Test 1: %s / %s: restored %d dirty pages of 16 MiB in %.2f ms" % (backend, engine, dirty, t * 1000))
+
+#-------------------------------------------------------------------------------
+# Test 2: forked clones share the snapshot, each only copies what it writes
+#-------------------------------------------------------------------------------
+m = machine(mem_size=16 << 20)
+fibonacci().assemble().load(m, 4000)
+m.registers[sp] = 16 << 20
+snap = m.snapshot()
+
+t = time.perf_counter()
+clones = [m.fork() for i in range(200)]
+t = time.perf_counter() - t
+print("Test 2: 200 forks of a 16 MiB machine in %.1f ms" % (t * 1000))
+
+for n, clone in enumerate(clones[:15]):
+    assert(not clone.memory.flags.owndata)
+    clone.registers[a0] = n
+    clone.execute('start', 'end')
+fib = [0, 1]
+for i in range(13): fib.append(fib[-1] + fib[-2])
+assert([clone.registers[a0] for clone in clones[:15]] == fib)
+assert(bytes(clones[20].memory) == bytes(m.memory))        # untouched clone and template still equal
+
+#-------------------------------------------------------------------------------
+# Test 3: restoring after code was overwritten re-decodes the original code
+#-------------------------------------------------------------------------------
+m.registers[a0] = 7
+m.snapshot()
+m.execute('start', 'end')
+m.write_i32(0, m.getLabel('fibonacci'))                    # destroy the cached code
+m.restore()
+m.execute('start', 'end')
+print("Test 3: Fibonacci of 7 after restore = " + str(m.registers[a0]))
+assert(m.registers[a0] == 13)
@@ -0,0 +1,276 @@
+"""
+System calls of the risc machine (ECALL), following the Linux RV32 ABI: the call number is in a7,
+the arguments in a0..a5 and the result (or -errno) is returned in a0.
+
+    SYS_OPENAT (56)     openat(dirfd, path, flags, mode), paths are relative to the root directory given to
+                        the table (no root: every open fails with -EACCES)
+    SYS_CLOSE  (57)     close(fd)
+    SYS_READ   (63)     read(fd, buf, count)
+    SYS_WRITE  (64)     write(fd, buf, count)
+    SYS_EXIT   (93)     exit(status), also SYS_EXIT_GROUP (94): execute() returns STOP_EXIT, m.exit_code = status
+    SYS_BRK    (214)    brk(addr): move the program break between heap_start and heap_limit, returns the break
+
+    m.syscalls = syscall_table(m, stdout=open('out.txt', 'wb'))
+    m.syscalls.register(500, lambda a0, a1, a2, a3, a4, a5: a0 * 2)     # add / replace a call
+
+Writes are collected per file descriptor and passed to the host file in chunks of buffer_size bytes,
+when the guest reads (so prompts appear before input), closes the descriptor or exits, and when
+execute() returns. The first ECALL creates a default table on stdin / stdout / stderr.
+"""
+
+import os
+import sys
+
+from paged_memory import PAGE_SIZE, page_fault
+from interrupts import machine_stop, STOP_EXIT
+
+SYS_OPENAT      = 56
+SYS_CLOSE       = 57
+SYS_READ        = 63
+SYS_WRITE       = 64
+SYS_EXIT        = 93
+SYS_EXIT_GROUP  = 94
+SYS_BRK         = 214
+
+# errno values returned as -errno
+ENOENT          = 2
+EBADF           = 9
+EACCES          = 13
+EFAULT          = 14
+EINVAL          = 22
+ENOSYS          = 38
+
+# openat flags (asm-generic)
+O_ACCMODE       = 3
+O_RDONLY        = 0
+O_WRONLY        = 1
+O_RDWR          = 2
+O_CREAT         = 0o100
+O_TRUNC         = 0o1000
+O_APPEND        = 0o2000
+
+# bytes collected per file descriptor before they are written to the host file
+BUFFER_SIZE     = 1 << 16
+
+# longest path accepted by openat
+PATH_MAX        = 4096
+
+a0, a7 = 10, 17
+
+
+class guest_fault(Exception):
+    """
+    a system call argument points outside the memory (returned to the guest as -EFAULT)
+    """
+
+
+class syscall_table:
+    def __init__(self, m, stdin=None, stdout=None, stderr=None, root=None, heap_start=None, heap_limit=None,
+                 buffer_size=BUFFER_SIZE):
+        """
+        m:                      machine making the calls
+        stdin/stdout/stderr:    binary host files for descriptors 0, 1, 2 (default: the streams of this process)
+        root:                   host directory openat works in (None: openat is refused)
+        heap_start/heap_limit:  range of the program break (default: the page after the highest label, end of memory)
+        """
+        self.m              = m
+        self.root           = root
+        self.buffer_size    = buffer_size
+        self.heap_start     = heap_start
+        self.heap_limit     = m.memory_size if heap_limit is None else heap_limit
+        self.brk            = None
+
+        # fd -> host file, fd -> bytes written but not passed to the host file yet
+        self.files          = {0: stdin or getattr(sys.stdin, 'buffer', sys.stdin),
+                               1: stdout or getattr(sys.stdout, 'buffer', sys.stdout),
+                               2: stderr or getattr(sys.stderr, 'buffer', sys.stderr)}
+        self.buffers        = {}
+        # descriptors opened by openat (closed by close / close_all)
+        self.opened         = set()
+
+        # call number -> handler(a0, a1, a2, a3, a4, a5) returning the result
+        self.handlers       = {SYS_OPENAT: self.openat, SYS_CLOSE: self.close, SYS_READ: self.read,
+                               SYS_WRITE: self.write, SYS_EXIT: self.exit, SYS_EXIT_GROUP: self.exit,
+                               SYS_BRK: self.set_brk}
+        self.calls          = 0
+
+    def register(self, number, handler):
+        """
+        add or replace system call number, handler(a0, a1, a2, a3, a4, a5) returns the value for a0
+        """
+        self.handlers[number] = handler
+
+    def call(self):
+        """
+        run the system call in a7 with the arguments in a0..a5 and put the result in a0
+        """
+        registers = self.m.registers
+        handler = self.handlers.get(int(registers[a7]))
+        self.calls += 1
+        if handler is None:
+            result = -ENOSYS
+        else:
+            try:
+                result = handler(*[int(registers[i]) for i in range(a0, a0 + 6)])
+            except guest_fault:
+                result = -EFAULT
+        registers[a0] = ((int(result) + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Guest memory
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def load(self, addr, length):
+        """
+        length bytes of guest memory at addr
+        """
+        m = self.m
+        addr &= 0xFFFFFFFF
+        try:
+            if m.paged:
+                return m.memory.read(addr, length)
+        except page_fault:
+            raise guest_fault()
+        if addr + length > m.memory_size:
+            raise guest_fault()
+        return bytes(memoryview(m.memory)[addr:addr + length])
+
+    def store(self, addr, data):
+        """
+        copy data into guest memory at addr
+        """
+        m = self.m
+        addr &= 0xFFFFFFFF
+        if not data:
+            return
+        try:
+            if m.paged:
+                m.memory.write(addr, data)
+            elif addr + len(data) > m.memory_size:
+                raise guest_fault()
+            else:
+                memoryview(m.memory)[addr:addr + len(data)] = data
+        except page_fault:
+            raise guest_fault()
+        m.memory_written(addr, len(data))
+
+    def load_string(self, addr):
+        """
+        NUL-terminated string at addr
+        """
+        data = b''
+        while len(data) < PATH_MAX:
+            n = min(64, self.m.memory_size - ((addr + len(data)) & 0xFFFFFFFF))
+            if n <= 0:
+                raise guest_fault()
+            chunk = self.load(addr + len(data), n)
+            end = chunk.find(b'\0')
+            if end >= 0:
+                return (data + chunk[:end]).decode('utf-8', 'replace')
+            data += chunk
+        raise guest_fault()
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Output buffering
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def flush(self, fd=None):
+        """
+        write the collected bytes of fd (of every descriptor if None) to the host files
+        """
+        for n in ([fd] if fd is not None else list(self.buffers)):
+            data = self.buffers.pop(n, None)
+            if data:
+                self.files[n].write(data)
+                self.files[n].flush()
+
+    def close_all(self):
+        """
+        flush everything and close the files opened by the guest
+        """
+        self.flush()
+        for fd in list(self.opened):
+            self.close(fd)
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # System calls
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def write(self, fd, buf, count, *unused):
+        if fd not in self.files:
+            return -EBADF
+        if count < 0:
+            return -EINVAL
+        data = self.load(buf, count)
+        buffer = self.buffers.get(fd)
+        if buffer is None:
+            buffer = self.buffers[fd] = bytearray()
+        buffer += data
+        if len(buffer) >= self.buffer_size:
+            self.flush(fd)
+        return count
+
+    def read(self, fd, buf, count, *unused):
+        if fd not in self.files:
+            return -EBADF
+        if count < 0:
+            return -EINVAL
+        self.flush()
+        data = self.files[fd].read(count) or b''
+        self.store(buf, data)
+        return len(data)
+
+    def openat(self, dirfd, path, flags, mode, *unused):
+        if self.root is None:
+            return -EACCES
+        name = self.load_string(path)
+        full = os.path.realpath(os.path.join(self.root, name))
+        if os.path.commonpath([full, os.path.realpath(self.root)]) != os.path.realpath(self.root):
+            return -EACCES  # outside of the root directory
+        access = flags & O_ACCMODE
+        if flags & O_APPEND:
+            host_mode = 'a+b' if access == O_RDWR else 'ab'
+        elif access == O_RDONLY:
+            host_mode = 'rb'
+        elif flags & O_TRUNC or (flags & O_CREAT and not os.path.exists(full)):
+            host_mode = 'w+b' if access == O_RDWR else 'wb'
+        else:
+            host_mode = 'r+b'
+        try:
+            f = open(full, host_mode)
+        except FileNotFoundError:
+            return -ENOENT
+        except OSError:
+            return -EACCES
+        fd = 3
+        while fd in self.files:
+            fd += 1
+        self.files[fd] = f
+        self.opened.add(fd)
+        return fd
+
+    def close(self, fd, *unused):
+        if fd not in self.files:
+            return -EBADF
+        self.flush(fd)
+        if fd in self.opened:
+            self.files[fd].close()
+            self.opened.discard(fd)
+        del self.files[fd]
+        return 0
+
+    def exit(self, status, *unused):
+        self.flush()
+        self.m.exit_code = status
+        raise machine_stop(STOP_EXIT)
+
+    def set_brk(self, addr, *unused):
+        if self.brk is None:
+            start = self.heap_start
+            if start is None:
+                start = max(self.m.label_dictionary.values(), default=0) + 4
+                start = -(-start // PAGE_SIZE) * PAGE_SIZE
+            self.heap_start = self.brk = start
+        if self.heap_start <= addr <= self.heap_limit:
+            self.brk = addr
+        return self.brk
@@ -0,0 +1,128 @@
+"""
+This is a test for ECALL system calls: buffered write / read, exit, brk, openat / close and custom calls
+"""
+
+import io
+import os
+import tempfile
+from machine import machine
+from assembler import assembler
+from syscalls import syscall_table, SYS_WRITE, SYS_READ, SYS_EXIT, SYS_BRK, SYS_OPENAT, SYS_CLOSE
+from syscalls import O_WRONLY, O_CREAT, ENOSYS, EFAULT, EACCES, EBADF
+from interrupts import STOP_EXIT
+
+zero, t0, t1, s1, a0, a1, a2, a3, a7, s2, s3 = 0, 5, 6, 9, 10, 11, 12, 13, 17, 18, 19
+TEXT, BUFFER, PATH = 1024, 1536, 1984
+
+class counting_file(io.BytesIO):
+    """
+    host file counting how often it is written to
+    """
+    writes = 0
+    def write(self, data):
+        self.writes += 1
+        return super().write(data)
+
+def syscall(a, number, *args):
+    """
+    append a7 = number, a0.. = args (registers or ('imm', value)), ECALL
+    """
+    a.storeAssembly('ADDi', a7, zero, number)
+    for reg, arg in zip([a0, a1, a2, a3], args):
+        if isinstance(arg, tuple):
+            a.storeAssembly('ADDi', reg, zero, arg[1])
+        else:
+            a.storeAssembly('ADD', reg, zero, arg)
+    a.storeAssembly('ECALL')
+
+def echo():
+    """
+    print the 12-byte text at TEXT s1 times, copy stdin to stdout, exit(7)
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.addLabel('loop')
+    syscall(a, SYS_WRITE, ('imm', 1), ('imm', TEXT), ('imm', 12))
+    a.storeAssembly('ADDi', s1, s1, -1)
+    a.storeAssembly('BNE', s1, zero, 'loop')
+    a.addLabel('copy')
+    syscall(a, SYS_READ, ('imm', 0), ('imm', BUFFER), ('imm', 100))
+    a.storeAssembly('BEQ', a0, zero, 'done')
+    a.storeAssembly('ADD', t1, zero, a0)
+    syscall(a, SYS_WRITE, ('imm', 1), ('imm', BUFFER), t1)
+    a.storeAssembly('JAL', zero, 'copy')
+    a.addLabel('done')
+    syscall(a, SYS_EXIT, ('imm', 7))
+    a.storeAssembly('ADDi', t0, zero, 1)                    # never executed
+    a.addLabel('end')
+    return a
+
+#-------------------------------------------------------------------------------
+# Test 1: buffered console output, input, exit status (both engines)
+#-------------------------------------------------------------------------------
+for engine in ['interpreter', 'block']:
+    m = machine(mem_size=4096)
+    echo().assemble().load(m, 0)
+    m.registers[s1] = 10000
+    m.memory[TEXT:TEXT + 12] = list(b'hello world\n')
+    stdout, stdin = counting_file(), io.BytesIO(b'x' * 250)
+    m.syscalls = syscall_table(m, stdin=stdin, stdout=stdout)
+
+    assert(m.execute('start', 'end', engine=engine) == STOP_EXIT and m.exit_code == 7 and m.registers[t0] == 0)
+    assert(stdout.getvalue() == b'hello world\n' * 10000 + b'x' * 250)
+    print("Test 1: %d writes of 12 bytes, %d writes to the host file (%s)" % (10000, stdout.writes, engine))
+    assert(stdout.writes < 10)
+    assert(m.syscalls.calls == 10000 + 4 + 3 + 1)
+
+#-------------------------------------------------------------------------------
+# Test 2: output is streamed while a long guest runs (flushed when execute returns)
+#-------------------------------------------------------------------------------
+m = machine(mem_size=4096)
+echo().assemble().load(m, 0)
+m.registers[s1] = 100
+m.memory[TEXT:TEXT + 12] = list(b'hello world\n')
+stdout = counting_file()
+m.syscalls = syscall_table(m, stdin=io.BytesIO(), stdout=stdout)
+m.execute('start', 'end', 7 * 8)                           # 7 instructions per line
+assert(stdout.getvalue() == b'hello world\n' * 8)
+print("Test 2: output of an unfinished guest: %d lines" % stdout.getvalue().count(b'\n'))
+
+#-------------------------------------------------------------------------------
+# Test 3: brk, unknown calls, bad pointers, openat / close, custom calls
+#-------------------------------------------------------------------------------
+root = tempfile.mkdtemp()
+m = machine(mem_size=1 << 16)
+m.addLabel('start')
+syscall(m, SYS_BRK, ('imm', 0))
+m.storeAssembly('ADD', s1, zero, a0)                        # initial break
+m.storeAssembly('ADDi', t0, s1, 100)
+syscall(m, SYS_BRK, t0)
+m.storeAssembly('ADD', t1, zero, a0)                        # break + 100
+syscall(m, 300)
+m.storeAssembly('ADD', t0, zero, a0)                        # -ENOSYS
+syscall(m, SYS_WRITE, ('imm', 1), ('imm', -4), ('imm', 8))
+m.storeAssembly('ADD', s2, zero, a0)                        # -EFAULT
+syscall(m, SYS_OPENAT, ('imm', -100), ('imm', PATH), ('imm', O_WRONLY | O_CREAT), ('imm', 0o644))
+m.storeAssembly('ADD', s3, zero, a0)                        # fd
+syscall(m, SYS_WRITE, s3, ('imm', TEXT), ('imm', 12))
+syscall(m, SYS_CLOSE, s3)
+syscall(m, SYS_CLOSE, s3)
+m.storeAssembly('ADD', a1, zero, a0)                        # -EBADF
+syscall(m, 500, ('imm', 21))
+m.addLabel('end')
+m.memory[TEXT:TEXT + 12] = list(b'to the file\n')
+m.memory[PATH:PATH + 8] = list(b'out.txt\0')
+m.syscalls = syscall_table(m, stdout=io.BytesIO(), root=root)
+m.syscalls.register(500, lambda a0, *unused: a0 * 2)
+
+assert(m.execute('start', 'end') == 'end' and m.registers[a0] == 42)
+assert(m.registers[s1] % 4096 == 0 and m.registers[t1] == m.registers[s1] + 100)
+assert(m.registers[s3] == 3 and m.registers[t0] == -ENOSYS and m.registers[s2] == -EFAULT and m.registers[a1] == -EBADF)
+with open(os.path.join(root, 'out.txt'), 'rb') as f:
+    assert(f.read() == b'to the file\n')
+
+m.memory[PATH:PATH + 12] = list(b'../escape\0\0\0')
+m.syscalls.root = os.path.join(root, 'sub')
+m.execute('start', 'end')
+assert(m.registers[s3] == -EACCES)
+print("Test 3: brk / ENOSYS / EFAULT / openat / close / custom call")
@@ -0,0 +1,300 @@
+"""
+Timing model of the risc machine: L1 instruction / data caches and instruction latencies, an estimate of how
+guest code would perform on hardware (cycles, CPI and miss rates per label region).
+
+    t = m.enable_timing(icache=cache(8192, 2, 32), latencies={'MUL': 4}, branch_penalty=2)
+    m.execute('start', 'end')           # the timing model runs on the interpreter, whatever engine is asked for
+    print(t.report())
+    m.disable_timing()
+
+While the model is on, the interpreter appends every executed pc (and the base register of every load, store
+and atomic instruction) to plain lists. The lists are simulated in bulk with numpy when BUFFER_SIZE pcs are
+buffered (see profiler.py) or when results are requested, so there is no Python call per instruction or memory access.
+
+Cycles of an instruction:
+    latency of the instruction (LATENCIES: an instruction name, or else its class, see INSTRUCTION_CLASSES)
+    + branch_penalty for a taken branch and for a jump (static not-taken prediction)
+    + miss_penalty for a fetch that misses the icache and for a data access that misses the dcache
+
+The caches are set-associative with LRU replacement, stores allocate lines like loads. An LRU set holds the
+ways lines of the set used most recently, so an access hits iff fewer than ways distinct lines of its set were
+used since the previous access to its line: cache.access answers that for a whole batch with a few sorts
+instead of simulating the accesses one by one.
+"""
+
+import numpy as np
+
+from profiler import INSTRUCTION_CLASSES
+
+# default L1 geometry: size in bytes, ways, line size in bytes
+CACHE_SIZE          = 16384
+CACHE_WAYS          = 4
+CACHE_LINE          = 64
+
+# cycles of every instruction class, entries named after an instruction override its class
+LATENCIES           = {'arithmetic': 1, 'logical': 1, 'load/store': 1, 'branch': 1, 'jump': 1, 'atomic': 4,
+                       'system': 1, 'other': 1, 'MUL': 3}
+BRANCH_PENALTY      = 2
+MISS_PENALTY        = 20
+
+# operand with the base register of every instruction that accesses data memory (LW / SW add operands[1])
+DATA_BASE           = {'LW': 2, 'SW': 2, 'LR': 1, 'SC': 1, 'AMOSWAP': 1, 'AMOADD': 1}
+
+# control kind of an instruction
+SEQUENTIAL, BRANCH, JUMP = 0, 1, 2
+
+# columns of the statistics of a label region
+INSTRUCTIONS, CYCLES, FETCH_MISSES, DATA_ACCESSES, DATA_MISSES = range(5)
+
+# window positions checked at once when counting the distinct lines between two uses of a line
+WINDOW_BLOCK        = 64
+
+
+class cache:
+    def __init__(self, size=CACHE_SIZE, ways=CACHE_WAYS, line=CACHE_LINE):
+        """
+        empty set-associative LRU cache of size bytes, ways lines per set, lines of line bytes (a power of 2)
+        """
+        if line <= 0 or line & (line - 1) or ways <= 0 or size <= 0 or size % (ways * line):
+            raise ValueError("cache of %d bytes can not have %d ways of %d byte lines" % (size, ways, line))
+        self.size       = size
+        self.ways       = ways
+        self.line       = line
+        self.sets       = size // (ways * line)
+        self.line_shift = line.bit_length() - 1
+
+        # lines in the cache, set by set, least recently used first within a set
+        self.lines      = np.zeros(0, dtype=np.int64)
+        self.accesses   = 0
+        self.misses     = 0
+
+    def access(self, addresses):
+        """
+        access addresses in order, returns a bool array that is True for every access that missed
+        """
+        addresses = np.asarray(addresses, dtype=np.int64)
+        missed = np.zeros(len(addresses), dtype=bool)
+        if not len(addresses):
+            return missed
+        lines = addresses >> self.line_shift
+        # repeated accesses to the line used last hit and do not change the LRU order
+        first = np.ones(len(lines), dtype=bool)
+        first[1:] = lines[1:] != lines[:-1]
+
+        # the lines in the cache come first, as if they had just been used in LRU order
+        uses = np.concatenate((self.lines, lines[first]))
+        total = len(uses)
+        order = np.argsort(uses % self.sets, kind='stable')        # set by set, in time order within a set
+        ordered = uses[order]
+        by_line = np.argsort(ordered, kind='stable')                # uses of a line are next to each other
+        same = ordered[by_line[1:]] == ordered[by_line[:-1]]
+        previous = np.full(total, -1, dtype=np.int64)
+        following = np.full(total, total, dtype=np.int64)
+        previous[by_line[1:][same]] = by_line[:-1][same]
+        following[by_line[:-1][same]] = by_line[1:][same]
+
+        # fewer uses than ways in between: a hit; more: count the distinct lines among them
+        position = np.arange(total)
+        hit = previous >= 0
+        unsure = np.flatnonzero(hit & (position - previous - 1 >= self.ways))
+        if len(unsure):
+            hit[unsure] = self.few_lines_between(previous[unsure], unsure, following)
+
+        hits = np.empty(total, dtype=bool)
+        hits[order] = hit
+        missed[first] = ~hits[len(self.lines):]
+        self.accesses += len(addresses)
+        self.misses += int(np.count_nonzero(missed))
+
+        # the ways lines of every set used last stay in the cache
+        last = np.flatnonzero(following == total)
+        sets = ordered[last] % self.sets
+        later = np.searchsorted(sets, sets, side='right') - 1 - np.arange(len(last))
+        self.lines = ordered[last[later < self.ways]]
+        return missed
+
+    def few_lines_between(self, start, stop, following):
+        """
+        for every start < stop (positions of two uses of a line in set order): True if fewer than ways distinct
+        lines are used in between, i.e. fewer than ways uses in between are the last ones of their line before stop
+        """
+        result = np.zeros(len(start), dtype=bool)
+        count = np.zeros(len(start), dtype=np.int64)
+        pending = np.arange(len(start))
+        offset = start + 1
+        columns = np.arange(WINDOW_BLOCK)
+        while len(pending):
+            end = stop[pending, None]
+            window = offset[pending, None] + columns
+            inside = window < end
+            last = following[np.minimum(window, end)] > end
+            count[pending] += np.count_nonzero(last & inside, axis=1)
+            offset[pending] += WINDOW_BLOCK
+            few = count[pending] < self.ways
+            done = offset[pending] >= stop[pending]
+            result[pending[few & done]] = True
+            pending = pending[few & ~done]
+        return result
+
+    def miss_rate(self):
+        return self.misses / self.accesses if self.accesses else 0.0
+
+    def clear(self):
+        """
+        empty the cache and reset its counters
+        """
+        self.lines = np.zeros(0, dtype=np.int64)
+        self.accesses = self.misses = 0
+
+
+class timing_model:
+    def __init__(self, m, icache=None, dcache=None, latencies=None, branch_penalty=BRANCH_PENALTY,
+                 miss_penalty=MISS_PENALTY):
+        """
+        timing model of machine m
+        icache, dcache: cache objects (None: the default geometry)
+        latencies:      {'instruction' or 'class': cycles} that override LATENCIES
+        branch_penalty: extra cycles of a taken branch or a jump, miss_penalty: extra cycles of a cache miss
+        """
+        self.m              = m
+        self.icache         = icache if icache is not None else cache()
+        self.dcache         = dcache if dcache is not None else cache()
+        self.latencies      = dict(LATENCIES)
+        self.latencies.update(latencies or {})
+        self.branch_penalty = branch_penalty
+        self.miss_penalty   = miss_penalty
+
+        # executed pcs and base register values of the data accesses, not simulated yet
+        self.pcs            = []
+        self.bases          = []
+
+        # pc -> (latency, control kind, accesses data, address offset) of the instruction at pc
+        self.kinds          = {}
+
+        # label -> [instructions, cycles, fetch misses, data accesses, data misses]
+        self.regions        = {}
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Simulation
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def kind(self, pc):
+        """
+        (latency, control kind, accesses data, address offset) of the instruction at pc
+        """
+        m = self.m
+        entry = m.decode_cache.get(pc) or m.decode_word(m.read_i32(pc) & 0xFFFFFFFF)
+        inst = entry[2] if entry is not None else '?'
+        cls = INSTRUCTION_CLASSES.get(inst, 'other')
+        latency = self.latencies.get(inst, self.latencies.get(cls, 1))
+        control = BRANCH if cls == 'branch' else JUMP if cls == 'jump' else SEQUENTIAL
+        base = DATA_BASE.get(inst)
+        offset = entry[1][1] if base == 2 else 0
+        return latency, control, int(base is not None), offset
+
+    def flush(self):
+        """
+        simulate the buffered pcs and data accesses, the instruction after the last one is the one at m.pc
+        """
+        if not self.pcs:
+            return
+        pcs = np.array(self.pcs, dtype=np.int64)
+        bases = np.array(self.bases, dtype=np.int64)
+        self.pcs.clear()
+        self.bases.clear()
+
+        unique, inverse = np.unique(pcs, return_inverse=True)
+        kinds = self.kinds
+        for pc in unique.tolist():
+            if pc not in kinds:
+                kinds[pc] = self.kind(pc)
+        latency, control, data, offset = np.array([kinds[pc] for pc in unique.tolist()], dtype=np.int64)[inverse].T
+
+        following = np.empty_like(pcs)
+        following[:-1] = pcs[1:]
+        following[-1] = self.m.pc
+        taken = (control == JUMP) | ((control == BRANCH) & (following != pcs + 4))
+        cycles = latency + self.branch_penalty * taken
+        fetch_missed = self.icache.access(pcs)
+        cycles += self.miss_penalty * fetch_missed
+
+        accesses = np.flatnonzero(data)[:len(bases)]
+        data_missed = self.dcache.access((bases[:len(accesses)] + offset[accesses]) & 0xFFFFFFFF)
+        cycles[accesses] += self.miss_penalty * data_missed
+
+        labels = sorted((addr, name) for name, addr in self.m.label_dictionary.items())
+        names = ['?'] + [name for addr, name in labels]
+        region = np.searchsorted(np.array([addr for addr, name in labels], dtype=np.int64), pcs, side='right')
+        n = len(names)
+        columns = [np.bincount(region, minlength=n),
+                   np.bincount(region, weights=cycles, minlength=n),
+                   np.bincount(region, weights=fetch_missed, minlength=n),
+                   np.bincount(region[accesses], minlength=n),
+                   np.bincount(region[accesses], weights=data_missed, minlength=n)]
+        for i in np.flatnonzero(columns[INSTRUCTIONS]).tolist():
+            stats = self.regions.setdefault(names[i], [0] * len(columns))
+            for column, values in enumerate(columns):
+                stats[column] += int(values[i])
+
+    def code_changed(self):
+        """
+        simulate the buffered pcs with the old instructions and forget them (code was written, see invalidate_decode)
+        """
+        self.flush()
+        self.kinds = {}
+
+    def clear(self):
+        """
+        drop everything simulated so far and empty the caches
+        """
+        self.pcs.clear()
+        self.bases.clear()
+        self.regions = {}
+        self.icache.clear()
+        self.dcache.clear()
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Results
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def region_stats(self):
+        """
+        {label: {'instructions', 'cycles', 'cpi', 'icache_miss_rate', 'dcache_miss_rate'}} for the instructions
+        between every label and the next one ('?' before the first label)
+        """
+        self.flush()
+        return {name: stats_dict(*stats) for name, stats in self.regions.items()}
+
+    def totals(self):
+        """
+        {'instructions', 'cycles', 'cpi', 'icache_miss_rate', 'dcache_miss_rate'} of everything simulated
+        """
+        self.flush()
+        return stats_dict(*[sum(column) for column in zip(*self.regions.values())] or [0] * 5)
+
+    def cycles(self):
+        return self.totals()['cycles']
+
+    def cpi(self):
+        return self.totals()['cpi']
+
+    def report(self):
+        """
+        cycles, CPI and miss rates of every label region and in total
+        """
+        lines = ['icache %d bytes, %d ways, %d byte lines; dcache %d bytes, %d ways, %d byte lines'
+                 % (self.icache.size, self.icache.ways, self.icache.line,
+                    self.dcache.size, self.dcache.ways, self.dcache.line), '',
+                 '%-24s %12s %12s %6s %8s %8s' % ('label', 'instructions', 'cycles', 'CPI', 'I-miss', 'D-miss')]
+        regions = sorted(self.region_stats().items(), key=lambda item: -item[1]['cycles'])
+        for name, stats in regions + [('total', self.totals())]:
+            lines.append('%-24s %12d %12d %6.2f %7.2f%% %7.2f%%'
+                         % (name, stats['instructions'], stats['cycles'], stats['cpi'],
+                            100.0 * stats['icache_miss_rate'], 100.0 * stats['dcache_miss_rate']))
+        return '\n'.join(lines)
+
+
+def stats_dict(instructions, cycles, fetch_misses, data_accesses, data_misses):
+    return {'instructions': instructions, 'cycles': cycles, 'cpi': cycles / instructions if instructions else 0.0,
+            'icache_miss_rate': fetch_misses / instructions if instructions else 0.0,
+            'dcache_miss_rate': data_misses / data_accesses if data_accesses else 0.0}
@@ -0,0 +1,115 @@
+"""
+This is a test for the timing model: the batched LRU caches miss exactly like a one-access-at-a-time LRU
+simulation, and cycles, CPI and miss rates add up per label region for the benchmark kernels
+"""
+
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from timing import cache
+from benchmark import load_kernel
+
+def reference_misses(addresses, size, ways, line):
+    """
+    misses of an LRU cache simulated one access at a time
+    """
+    sets = [OrderedDict() for i in range(size // (ways * line))]
+    missed = []
+    for addr in addresses:
+        number = addr // line
+        lines = sets[number % len(sets)]
+        missed.append(number not in lines)
+        if number in lines:
+            lines.move_to_end(number)
+        else:
+            if len(lines) == ways:
+                lines.popitem(last=False)
+            lines[number] = True
+    return missed
+
+#-------------------------------------------------------------------------------
+# Test 1: batched LRU simulation against one access at a time
+#-------------------------------------------------------------------------------
+rng = np.random.default_rng(1)
+for size, ways, line in [(1024, 1, 16), (2048, 2, 32), (4096, 4, 64), (4096, 8, 16), (512, 8, 64)]:
+    # a mix of loops over a small working set, sequential runs and random accesses
+    streams = [np.tile(rng.integers(0, 40, 30) * 16, 50),
+               np.arange(0, 20000, 4),
+               rng.integers(0, 1 << 14, 3000),
+               np.concatenate([rng.integers(0, 64 * ways, 200) * line // 2 for i in range(10)])]
+    for stream in streams:
+        expected = reference_misses(stream.tolist(), size, ways, line)
+        for batch in [len(stream), 1000, 7]:
+            c = cache(size, ways, line)
+            missed = np.concatenate([c.access(stream[i:i + batch]) for i in range(0, len(stream), batch)])
+            assert(missed.tolist() == expected and c.misses == sum(expected) and c.accesses == len(stream))
+print("Test 1: batched LRU caches agree with the reference simulation")
+
+try:
+    cache(1000, 3, 48)
+    assert(False)
+except ValueError:
+    pass
+
+#-------------------------------------------------------------------------------
+# Test 2: memcpy misses one dcache line in 16 words, per label region totals
+#-------------------------------------------------------------------------------
+size = 4096
+m, check = load_kernel('memcpy', size)
+t = m.enable_timing(icache=cache(1024, 2, 32), dcache=cache(16384, 4, 64))
+m.execute('start', 'end', engine='block')                  # runs on the interpreter while timing
+assert(check(m) and m.disable_timing() is t and m.timing is None)
+totals, regions = t.totals(), t.region_stats()          # the 7 instructions of memcpy fit in one icache line
+assert(t.dcache.accesses == 2 * size and t.dcache.misses == 2 * size // 16)
+assert(t.icache.misses == 1 and totals['instructions'] == sum(r['instructions'] for r in regions.values()))
+assert(totals['cycles'] == sum(r['cycles'] for r in regions.values()) and totals['cpi'] > 1)
+assert(abs(regions['loop']['dcache_miss_rate'] - 1 / 16) < 1e-9)
+print(t.report())
+
+#-------------------------------------------------------------------------------
+# Test 3: MUL latency and branch penalty
+#-------------------------------------------------------------------------------
+m, check = load_kernel('matmul', 8)
+prof = m.start_profiler()
+m.execute('start', 'end')
+muls, instructions = prof.opcode_histogram()['MUL'], prof.total()
+cycles = []
+for latency in [3, 10]:
+    m, check = load_kernel('matmul', 8)
+    m.enable_timing(latencies={'MUL': latency})
+    m.execute('start', 'end')
+    assert(check(m))
+    stats = m.disable_timing().totals()
+    assert(stats['instructions'] == instructions)
+    cycles.append(stats['cycles'])
+assert(cycles[1] - cycles[0] == 7 * muls)
+
+n = 1000
+cycles = []
+for penalty in [0, 5]:
+    m, check = load_kernel('count_loop', n)
+    m.enable_timing(branch_penalty=penalty, miss_penalty=0)
+    m.execute('start', 'end')
+    cycles.append(m.disable_timing().cycles())
+assert(cycles[1] - cycles[0] == 5 * (n - 1))                  # the last BNE falls through
+print("Test 3: %d MUL, matmul cycles +%d for 7 more cycles per MUL; count_loop cycles %s"
+      % (muls, 7 * muls, cycles))
+
+#-------------------------------------------------------------------------------
+# Test 4: cost of the timing model
+#-------------------------------------------------------------------------------
+times = []
+for timing in [False, True]:
+    m, check = load_kernel('bubble_sort', 150)
+    if timing:
+        m.enable_timing()
+    t = time.perf_counter()
+    m.execute('start', 'end')
+    if timing:
+        stats = m.disable_timing().totals()
+    times.append(time.perf_counter() - t)
+    assert(check(m))
+print("Test 4: bubble_sort %d instructions, CPI %.2f: %.1f ms, %.1f ms with the timing model"
+      % (stats['instructions'], stats['cpi'], times[0] * 1000, times[1] * 1000))
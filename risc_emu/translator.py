@@ -0,0 +1,336 @@
+"""
+Basic-block translator for the risc machine.
+
+A basic block is a straight-line run of instructions that ends with a control transfer
+(BEQ, BNE, BLT, BGE, JAL, JALR). Every block is translated once into a generated python
+function that works on plain python ints (wrapped to 32 bits) and returns the next pc:
+
+    def block_40(m, r, mem):
+        x2 = int(r[2]); x10 = int(r[10])
+        x2 = ((x2 + -12 + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        ...
+        r[2] = x2; r[10] = x10
+        return 44 if x10 == x8 else 48
+
+Blocks are cached by start address and chained: each block remembers the blocks that
+followed it, so the dispatcher does not go back to the block table for hot edges.
+On a paged memory (see paged_memory.py) LW / SW are emitted as mem.read_i32 / mem.write_i32 calls.
+While devices are mapped (see mmio.py) LW / SW first compare the address with the I/O bus window.
+While harts in other processes share the memory (see harts.py) SW is left to the interpreter.
+A LW / SW that faults writes back the registers and leaves m.pc on itself before the fault is raised,
+so execution resumes at the faulting instruction as on the interpreter.
+With the vectorizer on (see vectorizer.py) hot loops made of one block run as numpy operations.
+"""
+
+from contextlib import nullcontext
+from struct import pack_into, unpack_from, error as struct_error
+
+from profiler import BUFFER_SIZE
+from paged_memory import page_fault
+
+# instructions that end a basic block
+BRANCHES = ('BEQ', 'BNE', 'BLT', 'BGE', 'JAL', 'JALR')
+
+# instructions left to the interpreter (they may stop execution, call the host or take the atomic lock)
+INTERPRETED = ('WFI', 'HALT', 'ECALL', 'LR', 'SC', 'AMOSWAP', 'AMOADD')
+
+# condition used by each branch instruction
+CONDITIONS = {'BEQ': '==', 'BNE': '!=', 'BLT': '<', 'BGE': '>='}
+
+# longest block that is translated at once
+MAX_BLOCK_LENGTH = 64
+
+
+def wrap(expr):
+    """
+    python expression wrapping expr to a signed 32-bit int
+    """
+    return '((' + expr + ' + 0x80000000) & 0xFFFFFFFF) - 0x80000000'
+
+
+def link(pc):
+    """
+    return address pc + 4 as a signed 32-bit register value
+    """
+    return ((pc + 4 + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+class block:
+    """
+    translated basic block: the generated function, the number of guest instructions it
+    executes, the instruction names (for the execution metric) and links to successor blocks
+    """
+    def __init__(self, start, fn, insts, source):
+        self.start  = start
+        self.fn     = fn
+        self.length = len(insts)
+        self.insts  = insts
+        self.source = source
+        self.links  = {}
+
+
+class translator:
+    def __init__(self, m):
+        """
+        Create a translator for machine m, with an empty block cache
+        """
+        self.m      = m
+        self.blocks = {}
+
+        # addresses blocks may not run past (end labels handed to run)
+        self.stops  = set()
+
+        self.blocks_translated = 0
+
+        # hot loops may run as numpy operations (set by run: vectorizer on, an end label and no instruction limit)
+        self.vectorize = False
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Block cache
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def flush(self):
+        """
+        drop every translated block (called when cached code is overwritten)
+        """
+        if self.m.profiler is not None:
+            self.m.profiler.flush()  # count the buffered block starts while their blocks still exist
+        for blk in self.blocks.values():
+            blk.links.clear()
+        self.blocks = {}
+
+    def lookup(self, pc):
+        """
+        return the block starting at pc, translating it on a miss
+        """
+        blk = self.blocks.get(pc)
+        if blk is None:
+            try:
+                blk = self.translate(pc)
+            except (page_fault, struct_error):
+                self.m.pc = pc  # the code at pc cannot be read, nothing of the block ran
+                raise
+        return blk
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Translation
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def find_block(self, pc):
+        """
+        collect the decoded instructions of the basic block starting at pc
+        returns a list of (pc, operands, 'instruction')
+        """
+        m = self.m
+        body = []
+        while len(body) < MAX_BLOCK_LENGTH:
+            if body and pc in self.stops:
+                break
+            entry = m.decode_cache.get(pc)
+            if entry is None:
+                if m.decode_word(m.read_i32(pc) & 0xFFFFFFFF) is None:
+                    break  # leave unsupported instructions to the interpreter
+                entry = m.predecode(pc)
+            if entry[2] in INTERPRETED or (entry[2] == 'SW' and not isinstance(m.atomic_lock, nullcontext)):
+                break  # stores of harts sharing memory between processes take the atomic lock
+            body.append((pc, entry[1], entry[2]))
+            if entry[2] in BRANCHES:
+                break
+            pc += 4
+        return body
+
+    def translate(self, pc):
+        """
+        translate the basic block starting at pc into a python function and cache it
+        """
+        body = self.find_block(pc)
+        if not body:
+            return block(pc, lambda m, r, mem: self.interpret(pc), [None], '')
+
+        fn, source = self.compile_body(body)
+        blk = block(pc, fn, [b[2] for b in body], source)
+        if self.m.vectorizer is not None:
+            blk.fn = self.m.vectorizer.watch(blk, body)
+        self.blocks[pc] = blk
+        self.blocks_translated += 1
+        return blk
+
+    def compile_body(self, body):
+        """
+        python function fn(m, r, mem) running the decoded instructions in body [(pc, operands, 'instruction')]
+        and returning the next pc, and its source
+        """
+        pc = body[0][0]
+        used = set()
+        for _, operands, inst in body:
+            used.update(self.registers_of(inst, operands))
+        used.discard(0)
+        used = sorted(used)
+
+        load      = '; '.join('x%d = int(r[%d])' % (i, i) for i in used) or 'pass'
+        writeback = '; '.join('r[%d] = x%d' % (i, i) for i in used) or 'pass'
+
+        lines = ['def block_%d(m, r, mem):' % pc, '    ' + load]
+        terminated = False
+        for ipc, operands, inst in body:
+            code = self.emit(ipc, operands, inst, writeback)
+            if inst in ('LW', 'SW') and code:
+                # a fault stops on this instruction with the instructions before it done
+                code = (['try:'] + ['    ' + l for l in code] +
+                        ['except (page_fault, struct_error):', '    ' + writeback, '    m.pc = %d' % ipc, '    raise'])
+            lines += ['    ' + l for l in code]
+            terminated = inst in BRANCHES
+        if not terminated:
+            lines += ['    ' + writeback, '    return %d' % (body[-1][0] + 4)]
+
+        source = '\n'.join(lines) + '\n'
+        scope = {'pack_into': pack_into, 'unpack_from': unpack_from, 'page_fault': page_fault, 'struct_error': struct_error}
+        exec(compile(source, '<block %d>' % pc, 'exec'), scope)
+        return scope['block_%d' % pc], source
+
+    def interpret(self, pc):
+        """
+        block function for a pc the translator cannot handle (unsupported instruction):
+        let the interpreter execute / report it
+        """
+        m = self.m
+        m.pc = pc
+        m.step()
+        return int(m.pc)
+
+    def registers_of(self, inst, operands):
+        """
+        registers read or written by an instruction
+        """
+        if inst == 'JAL':
+            return [operands[0]]
+        if inst in ('SW', 'LW'):
+            return [operands[0], operands[2]]
+        if inst in ('JALR', 'ADDi'):
+            return [operands[0], operands[1]]
+        return list(operands) if inst not in CONDITIONS else [operands[0], operands[1]]
+
+    def emit(self, pc, operands, inst, writeback):
+        """
+        python source lines for one instruction at pc
+        """
+        x = lambda i: 'x%d' % i if i != 0 else '0'
+
+        if inst in CONDITIONS:
+            rs1, rs2, imm = operands
+            return [writeback,
+                    'return %d if %s %s %s else %d' % (pc + imm, x(rs1), CONDITIONS[inst], x(rs2), pc + 4)]
+        if inst == 'JAL':
+            rd, imm = operands
+            return (['x%d = %d' % (rd, link(pc))] if rd else []) + [writeback, 'return %d' % (pc + imm)]
+        if inst == 'JALR':
+            rd, rs1, imm = operands
+            lines = ['target = (%s + %d) & 0xFFFFFFFE' % (x(rs1), imm)]
+            if rd:
+                lines.append('x%d = %d' % (rd, link(pc)))
+            return lines + [writeback, 'return target']
+        if inst == 'SW':
+            rs2, imm, rs1 = operands
+            if self.m.paged:
+                store = ['a = (%s + %d) & 0xFFFFFFFF' % (x(rs1), imm), 'mem.write_i32(%s, a)' % x(rs2)]
+            else:
+                store = ['a = (%s + %d) & 0xFFFFFFFF' % (x(rs1), imm), "pack_into('<i', mem, a, %s)" % x(rs2)]
+            # leave the block if the store overwrote cached code, the rest of the block may be stale
+            store += ['if m.dirty is not None: m.mark_dirty(a)',
+                      'if m.decode_lo - 4 < a < m.decode_hi + 4 and m.invalidate_decode(a):',
+                      '    ' + writeback,
+                      '    return %d' % (pc + 4)]
+            bus = self.m.bus
+            if bus is None:
+                return store
+            return ['if %d <= (%s + %d) & 0xFFFFFFFF < %d: m.bus.store(%s, (%s + %d) & 0xFFFFFFFF)'
+                    % (bus.lo, x(rs1), imm, bus.hi, x(rs2), x(rs1), imm),
+                    'else:'] + ['    ' + l for l in store]
+
+        rd = operands[0]
+        if rd == 0:
+            return []  # writes to x0 are discarded
+        if inst == 'LW':
+            rd, imm, rs1 = operands
+            if self.m.paged:
+                load = 'x%d = mem.read_i32(%s + %d)' % (rd, x(rs1), imm)
+            else:
+                load = "x%d = unpack_from('<i', mem, (%s + %d) & 0xFFFFFFFF)[0]" % (rd, x(rs1), imm)
+            bus = self.m.bus
+            if bus is None:
+                return [load]
+            return ['if %d <= (%s + %d) & 0xFFFFFFFF < %d: x%d = m.bus.load((%s + %d) & 0xFFFFFFFF)'
+                    % (bus.lo, x(rs1), imm, bus.hi, rd, x(rs1), imm),
+                    'else: ' + load]
+        if inst == 'ADDi':
+            rd, rs1, imm = operands
+            return ['x%d = %s' % (rd, wrap('%s + %d' % (x(rs1), imm)))]
+
+        rd, rs1, rs2 = operands
+        if inst == 'ADD': return ['x%d = %s' % (rd, wrap('%s + %s' % (x(rs1), x(rs2))))]
+        if inst == 'SUB': return ['x%d = %s' % (rd, wrap('%s - %s' % (x(rs1), x(rs2))))]
+        if inst == 'MUL': return ['x%d = %s' % (rd, wrap('%s * %s' % (x(rs1), x(rs2))))]
+        if inst == 'XOR': return ['x%d = %s ^ %s' % (rd, x(rs1), x(rs2))]
+        if inst == 'OR' : return ['x%d = %s | %s' % (rd, x(rs1), x(rs2))]
+        if inst == 'AND': return ['x%d = %s & %s' % (rd, x(rs1), x(rs2))]
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Dispatch
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def run(self, end=None, instructionCount=0):
+        """
+        run translated blocks from m.pc until pc == end, or for instructionCount instructions
+        (with both, whichever comes first)
+        """
+        m = self.m
+        if end is not None and end not in self.stops:
+            # blocks translated so far may run past the new end address
+            self.stops.add(end)
+            self.flush()
+
+        r, mem = m.registers, m.memory
+        instrumented = m.debug or m.profiler is not None
+        self.vectorize = m.vectorizer is not None and not instrumented and end is not None and not instructionCount
+        pc = int(m.pc)
+        blk = self.lookup(pc)
+
+        if end is None or instructionCount:
+            remaining = instructionCount
+            while pc != end and blk.length <= remaining:
+                if instrumented: self.record(blk)
+                pc = blk.fn(m, r, mem)
+                remaining -= blk.length
+                nxt = blk.links.get(pc)
+                if nxt is None:
+                    nxt = blk.links[pc] = self.lookup(pc)
+                blk = nxt
+            m.pc = pc
+            while remaining and m.pc != end:
+                m.step()
+                pc = m.pc
+                remaining -= 1
+        else:
+            while pc != end:
+                if instrumented: self.record(blk)
+                pc = blk.fn(m, r, mem)
+                nxt = blk.links.get(pc)
+                if nxt is None:
+                    nxt = blk.links[pc] = self.lookup(pc)
+                blk = nxt
+            m.pc = pc
+
+    def record(self, blk):
+        """
+        update the program execution metric for every instruction of a block and / or
+        record the block start for the profiler
+        """
+        m = self.m
+        if m.debug:
+            for inst in blk.insts:
+                if inst is not None:
+                    m.count_instruction(inst)
+        prof = m.profiler
+        if prof is not None:
+            prof.block_buffer.append(blk.start)
+            if len(prof.block_buffer) >= BUFFER_SIZE: prof.flush()
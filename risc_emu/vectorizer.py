@@ -0,0 +1,417 @@
+"""
+Hot-loop vectorization for the block engine: counted loops over memory run as numpy operations.
+
+    v = m.enable_vectorizer()
+    m.execute('start', 'end', engine='block')
+    print(v.report())
+
+The block engine (translator.py) watches every block that ends with a conditional branch back to its own
+start. Once the branch was taken threshold times the loop is analyzed; it is vectorized if
+
+    - the body only uses LW, SW, ADD, ADDi, SUB, MUL, XOR, OR, AND
+    - every register written in the body is an induction register (written once by ADDi r, r, c or
+      ADD r, r, s with s not written in the loop), a reduction (written once by ADD / XOR / OR / AND r, r, v
+      and not read anywhere else) or a temporary written before it is read in every iteration
+    - the branch compares an induction register with a register not written in the loop, so the number of
+      iterations is known when the loop is entered
+    - LW / SW addresses are affine in the iteration number (they do not depend on loaded data)
+
+Every time the loop is entered, the remaining iterations run in chunks of CHUNK_ITERATIONS: registers become
+int64 arrays indexed by the iteration, loads are strided views on the memory and stores are written back at the
+end of the chunk. Before anything is written the chunk is checked: addresses inside the memory, no store into
+cached code, and no location stored in one iteration and loaded or stored in another one unless every load of it
+comes first. When a check fails (or the loop runs fewer than min_iterations times) the loop runs through its
+translated block as before. Only execute(start, end) without instructionCount, profiler or debug vectorizes.
+"""
+
+import numpy as np
+
+from translator import CONDITIONS
+
+# loops are analyzed once their back edge was taken this often
+HOT_THRESHOLD = 16
+
+# fewer remaining iterations run through the translated block (numpy setup costs more than they do)
+MIN_ITERATIONS = 32
+
+# iterations run by one set of numpy operations (bounds the size of the arrays)
+CHUNK_ITERATIONS = 1 << 16
+
+# loops failing the runtime checks this often are not tried again
+FAILURE_LIMIT = 8
+
+# instructions a vectorized loop body may contain (besides the branch)
+VECTOR_OPS = ('LW', 'SW', 'ADD', 'ADDi', 'SUB', 'MUL', 'XOR', 'OR', 'AND')
+
+# reduction operators: instruction -> numpy reduction
+REDUCTIONS = {'ADD': np.add, 'XOR': np.bitwise_xor, 'OR': np.bitwise_or, 'AND': np.bitwise_and}
+
+
+def wrap(value):
+    """
+    wrap an int / int64 array to signed 32 bits
+    """
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def trip_count(inst, first, v0, step, bound):
+    """
+    iterations of a loop whose branch inst compares the induction value v0 + k * step after iteration k with bound
+    (first: the induction register is the first branch operand); None if the loop does not end before the value wraps
+    """
+    taken = lambda v: {'BEQ': v == bound, 'BNE': v != bound,
+                       'BLT': v < bound if first else bound < v,
+                       'BGE': v >= bound if first else bound >= v}[inst]
+    if step == 0:
+        return None if taken(v0) else 1
+    if not taken(v0 + step):
+        return 1
+    d = bound - v0
+    if inst == 'BNE':
+        n = d // step if d % step == 0 else None
+    elif inst == 'BEQ':
+        n = 2
+    elif inst == 'BLT':                             # first k with v >= bound (v > bound: v <= bound)
+        n = -(-d // step)
+    else:                                           # first k with v < bound (v <= bound: v > bound)
+        n = d // step + 1
+    if n is None or n < 1 or not -0x80000000 <= v0 + n * step <= 0x7FFFFFFF:
+        return None
+    if taken(v0 + n * step) or (n > 1 and not taken(v0 + (n - 1) * step)):
+        return None
+    return n
+
+
+class loop_plan:
+    """
+    analysis of a single-block loop: how every register behaves from one iteration to the next
+    """
+    def __init__(self, start, body):
+        self.start      = start
+        self.exit       = body[-1][0] + 4
+        self.length     = len(body)
+        # (operands, 'instruction') without the branch and without writes to x0
+        self.ops        = [(operands, inst) for _, operands, inst in body[:-1] if inst == 'SW' or operands[0] != 0]
+        # register -> (step register or None, step immediate)
+        self.induction  = {}
+        # register -> (index into ops, numpy reduction, value register)
+        self.reductions = {}
+        self.written    = set()
+        self.branch     = body[-1]
+        self.counter    = None          # (induction register, first operand?, bound register)
+        self.runs       = 0
+        self.iterations = 0
+        self.failures   = 0
+        self.reason     = self.analyze()
+
+    def analyze(self):
+        """
+        classify the registers, returns why the loop can not be vectorized (None if it can)
+        """
+        for operands, inst in self.ops:
+            if inst not in VECTOR_OPS:
+                return 'unsupported instruction ' + inst
+        writes = {}
+        for i, (operands, inst) in enumerate(self.ops):
+            if inst != 'SW':
+                writes.setdefault(operands[0], []).append(i)
+        self.written = set(writes)
+
+        for reg, at in writes.items():
+            if len(at) != 1:
+                continue
+            (rd, rs1, rs2), inst = self.ops[at[0]]
+            if inst == 'ADDi' and rs1 == reg:
+                self.induction[reg] = (None, rs2)
+            elif inst == 'ADD' and reg in (rs1, rs2) and (rs2 if rs1 == reg else rs1) not in self.written:
+                self.induction[reg] = (rs2 if rs1 == reg else rs1, 0)
+            elif inst in REDUCTIONS and reg in (rs1, rs2) and rs1 != rs2:
+                if all(reg not in self.reads(i) for i in range(len(self.ops)) if i != at[0]) and \
+                        reg not in self.branch[1][:2]:
+                    self.reductions[reg] = (at[0], REDUCTIONS[inst], rs2 if rs1 == reg else rs1)
+
+        # temporaries have to be written before they are read, in every iteration
+        carried = self.written - set(self.induction) - set(self.reductions)
+        defined = set()
+        for i, (operands, inst) in enumerate(self.ops):
+            for reg in self.reads(i):
+                if reg in carried and reg not in defined:
+                    return 'x%d carries a value from one iteration to the next' % reg
+            if inst != 'SW':
+                defined.add(operands[0])
+        if any(reg in carried for reg in self.branch[1][:2]):
+            return 'the branch depends on a value computed in the loop'
+
+        rs1, rs2 = self.branch[1][:2]
+        if rs1 in self.induction and rs2 not in self.written:
+            self.counter = (rs1, True, rs2)
+        elif rs2 in self.induction and rs1 not in self.written:
+            self.counter = (rs2, False, rs1)
+        else:
+            return 'the branch does not compare an induction register with a loop invariant'
+
+        # addresses have to be affine in the iteration number
+        affine = set(self.induction)
+        for operands, inst in self.ops:
+            if inst in ('LW', 'SW'):
+                base = operands[2]
+                if base in self.written and base not in affine:
+                    return 'the address of a %s depends on loaded data' % inst
+            if inst == 'SW':
+                continue
+            rd, a, b = operands
+            linear = lambda reg: reg not in self.written or reg in affine
+            if inst == 'ADDi':
+                ok = linear(a)
+            elif inst in ('ADD', 'SUB'):
+                ok = linear(a) and linear(b)
+            elif inst == 'MUL':
+                ok = (a not in self.written and linear(b)) or (b not in self.written and linear(a))
+            else:
+                ok = False
+            if rd not in self.induction:
+                (affine.add if ok else affine.discard)(rd)
+        return None
+
+    def reads(self, i):
+        """
+        registers read by ops[i]
+        """
+        operands, inst = self.ops[i]
+        if inst == 'SW':
+            return (operands[0], operands[2])
+        if inst == 'LW':
+            return (operands[2],)
+        if inst == 'ADDi':
+            return (operands[1],)
+        return operands[1:]
+
+    def iterations_left(self, r):
+        """
+        iterations the loop runs when it is entered with registers r (None: unknown)
+        """
+        reg, first, bound = self.counter
+        step_reg, step = self.induction[reg]
+        if step_reg is not None:
+            step = int(r[step_reg])
+        return trip_count(self.branch[2], first, int(r[reg]), step, int(r[bound]))
+
+
+class stream:
+    """
+    word accesses of one LW / SW over the iterations of a chunk: first address, stride, position in the body
+    """
+    def __init__(self, first, stride, n, index):
+        self.first  = first
+        self.stride = stride
+        self.index  = index
+        last        = first + (n - 1) * stride
+        self.lo     = min(first, last)
+        self.hi     = max(first, last) + 4
+
+    def overlaps(self, other):
+        """
+        True if the two streams may access a common byte
+        """
+        if self.hi <= other.lo or other.hi <= self.lo:
+            return False
+        if self.stride == other.stride and self.stride:
+            rest = (self.first - other.first) % abs(self.stride)
+            return not 4 <= rest <= abs(self.stride) - 4
+        return True
+
+    def distance(self, other):
+        """
+        d such that this stream accesses in iteration k the words other accesses in iteration k + d
+        (None if there is no such constant)
+        """
+        if self.stride != other.stride or self.stride == 0:
+            return None
+        d, rest = divmod(self.first - other.first, self.stride)
+        return d if rest == 0 else None
+
+
+class loop_vectorizer:
+    def __init__(self, m, threshold=HOT_THRESHOLD, min_iterations=MIN_ITERATIONS):
+        """
+        vectorizer of machine m
+        threshold:      back edges taken before a loop is analyzed
+        min_iterations: fewest remaining iterations that are run with numpy
+        """
+        self.m              = m
+        self.threshold      = threshold
+        self.min_iterations = min_iterations
+
+        # loop start -> analysis of the last block found there
+        self.loops          = {}
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Hot-loop detection
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def watch(self, blk, body):
+        """
+        function for the translated block blk: loops back to their own start are counted until they are hot,
+        other blocks keep their function
+        """
+        fn, start = blk.fn, blk.start
+        pc, operands, inst = body[-1]
+        if inst not in CONDITIONS or pc + operands[2] != start or start in self.m.translator.stops:
+            return fn
+        taken = 0
+        def probe(m, r, mem):
+            nonlocal taken
+            pc = fn(m, r, mem)
+            if pc == start:
+                taken += 1
+                if taken >= self.threshold:
+                    blk.fn = self.vectorize(blk, body, fn)
+            return pc
+        return probe
+
+    def vectorize(self, blk, body, fn):
+        """
+        analyze the hot loop blk, returns the function running it with numpy (fn if it can not be vectorized)
+        """
+        plan = self.loops[blk.start] = loop_plan(blk.start, body)
+        if plan.reason is not None:
+            return fn
+        start, translator = blk.start, self.m.translator
+        def looped(m, r, mem):
+            if not translator.vectorize or m.paged:
+                return fn(m, r, mem)
+            n = plan.iterations_left(r)
+            if n is not None and n >= self.min_iterations:
+                done = 0
+                while done < n:
+                    chunk = min(n - done, CHUNK_ITERATIONS)
+                    if not self.run_chunk(plan, chunk):
+                        break
+                    done += chunk
+                plan.iterations += done
+                if done == n:
+                    plan.runs += 1
+                    return plan.exit
+                plan.failures += 1
+                if plan.failures >= FAILURE_LIMIT:
+                    plan.reason = 'the memory checks failed %d times' % plan.failures
+                    blk.fn = fn
+            pc = fn(m, r, mem)
+            while pc == start:
+                pc = fn(m, r, mem)
+            return pc
+        return looped
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Vector execution
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def run_chunk(self, plan, n):
+        """
+        run the next n iterations of plan with numpy, returns False (nothing is changed) if a check fails
+        """
+        m = self.m
+        r, mem = m.registers, m.memory
+        k = np.arange(n, dtype=np.int64)
+        env = {}
+        value = lambda reg: env[reg] if reg in env else (int(r[reg]) if reg else 0)
+        for reg, (step_reg, step) in plan.induction.items():
+            if step_reg is not None:
+                step = int(r[step_reg])
+            env[reg] = wrap(int(r[reg]) + k * step)
+
+        loads, stores, contributions = [], [], {}
+        for i, (operands, inst) in enumerate(plan.ops):
+            if inst in ('LW', 'SW'):
+                access = self.access(wrap(value(operands[2]) + operands[1]), n, i)
+                if access is None:
+                    return False
+                if inst == 'LW':
+                    loads.append(access)
+                    env[operands[0]] = self.view(access, n).astype(np.int64)
+                else:
+                    stores.append((access, value(operands[0])))
+                continue
+            rd, rs1, rs2 = operands
+            if rd in plan.reductions and plan.reductions[rd][0] == i:
+                contributions[rd] = value(plan.reductions[rd][2])
+            elif inst == 'ADDi': env[rd] = wrap(value(rs1) + rs2)
+            elif inst == 'ADD':  env[rd] = wrap(value(rs1) + value(rs2))
+            elif inst == 'SUB':  env[rd] = wrap(value(rs1) - value(rs2))
+            elif inst == 'MUL':  env[rd] = wrap(value(rs1) * value(rs2))
+            elif inst == 'XOR':  env[rd] = value(rs1) ^ value(rs2)
+            elif inst == 'OR':   env[rd] = value(rs1) | value(rs2)
+            elif inst == 'AND':  env[rd] = value(rs1) & value(rs2)
+
+        if not self.independent(loads, stores, n):
+            return False
+        for access, values in stores:
+            self.view(access, n)[:] = values
+            m.memory_written(access.lo, access.hi - access.lo)
+        for reg in plan.written:
+            if reg in plan.reductions:
+                _, reduce, _ = plan.reductions[reg]
+                values = np.broadcast_to(np.asarray(contributions[reg], dtype=np.int64), (n,))
+                r[reg] = wrap(int(reduce.reduce(np.append(values, int(r[reg])))))
+            else:
+                v = env[reg]
+                r[reg] = int(v[-1]) if isinstance(v, np.ndarray) else int(v)
+        return True
+
+    def access(self, addresses, n, index):
+        """
+        stream of the addresses (int or int64 array) of one LW / SW, None if it leaves the memory or wraps
+        """
+        if isinstance(addresses, np.ndarray):
+            first, last = int(addresses[0]), int(addresses[-1])
+            stride = int(addresses[1]) - first if n > 1 else 0
+            if last - first != (n - 1) * stride:
+                return None
+        else:
+            first, stride = addresses, 0
+        access = stream(first, stride, n, index)
+        if access.lo < 0 or access.hi > self.m.memory_size:
+            return None
+        return access
+
+    def view(self, access, n):
+        """
+        int32 view of the memory words of a stream
+        """
+        return np.ndarray((n,), dtype='<i4', buffer=self.m.memory, offset=access.first, strides=(access.stride,))
+
+    def independent(self, loads, stores, n):
+        """
+        True if running the loads of every iteration before the stores gives the same memory as the loop
+        """
+        m = self.m
+        for i, (store, _) in enumerate(stores):
+            if n > 1 and abs(store.stride) < 4:
+                return False    # overwrites its own words
+            if store.lo < m.decode_hi + 4 and m.decode_lo - 4 < store.hi:
+                return False    # code: the interpreter / translator handle self-modifying code
+            for load in loads:
+                if load.overlaps(store):
+                    d = load.distance(store)
+                    if d is None or d < 0 or (d == 0 and load.index > store.index):
+                        return False    # a load would have to see a value stored in an earlier iteration
+            for other, _ in stores[:i]:
+                if store.overlaps(other) and store.distance(other) != 0:
+                    return False        # the last store of a word has to win
+        return True
+
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+    # Report
+    #------------------------------------------------------------------------------------------------------------------------------------------------
+
+    def report(self):
+        """
+        every hot loop found: start label / address, vectorized runs and iterations, runs that failed the memory
+        checks, or why it is not vectorized
+        """
+        labels = {pc: label for label, pc in self.m.label_dictionary.items()}
+        lines = ['%-16s %6s %8s %12s %10s  %s' % ('loop', 'insts', 'runs', 'iterations', 'fallbacks', 'status')]
+        for start, plan in sorted(self.loops.items()):
+            lines.append('%-16s %6d %8d %12d %10d  %s' % (labels.get(start, str(start)), plan.length, plan.runs,
+                                                         plan.iterations, plan.failures, plan.reason or 'vectorized'))
+        return '\n'.join(lines)
@@ -0,0 +1,119 @@
+"""
+This is a test for hot-loop vectorization: vectorized loops leave the same state as the block engine, loops
+with dependencies between iterations fall back, and the end label / instruction counts / snapshots still work
+"""
+
+import time
+from machine import machine
+from assembler import assembler
+from benchmark import KERNELS, write_words, load_kernel, machine_state
+from vectorizer import HOT_THRESHOLD
+
+zero, t0, t1, t2, a0, a1, a2, a3 = 0, 5, 6, 7, 10, 11, 12, 13
+
+def kernel(name, size, vectorize):
+    m, check = load_kernel(name, size)
+    v = m.enable_vectorizer() if vectorize else None
+    t = time.perf_counter()
+    m.execute('start', 'end', engine='block')
+    t = time.perf_counter() - t
+    assert(check(m))
+    return m, v, t
+
+#-------------------------------------------------------------------------------
+# Test 1: every benchmark kernel, block engine with and without the vectorizer
+#-------------------------------------------------------------------------------
+for name in KERNELS:
+    size = KERNELS[name][2]
+    plain, _, t_plain = kernel(name, size, False)
+    vector, v, t_vector = kernel(name, size, True)
+    assert(machine_state(plain) == machine_state(vector))
+    print("Test 1: %-12s %7.1f ms -> %7.1f ms, %d loops vectorized"
+          % (name, t_plain * 1000, t_vector * 1000, sum(p.reason is None for p in v.loops.values())))
+
+m, v, t_vector = kernel('memcpy', 40000, True)
+plain, _, t_plain = kernel('memcpy', 40000, False)
+print(v.report())
+# every iteration after the loop got hot ran in one numpy run
+plan = v.loops[m.getLabel('loop')]
+assert(plan.reason is None and plan.runs == 1 and plan.iterations == 40000 - HOT_THRESHOLD)
+assert(machine_state(m) == machine_state(plain))
+print("Test 1: memcpy of 40000 words %.1f ms -> %.1f ms" % (t_plain * 1000, t_vector * 1000))
+
+#-------------------------------------------------------------------------------
+# Test 2: loops with dependencies between iterations
+#-------------------------------------------------------------------------------
+def array_loop(load_offset, store_offset, add):
+    """
+    a[i + store_offset] = a[i + load_offset] + add for a2 words at a0
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', a3, zero, 0)
+    a.addLabel('loop')
+    a.storeAssembly('LW', t0, 4 * load_offset, a0)
+    a.storeAssembly('ADDi', t0, t0, add)
+    a.storeAssembly('SW', t0, 4 * store_offset, a0)
+    a.storeAssembly('ADD', a3, a3, t0)
+    a.storeAssembly('ADDi', a0, a0, 4)
+    a.storeAssembly('ADDi', a2, a2, -1)
+    a.storeAssembly('BLT', zero, a2, 'loop')
+    a.addLabel('end')
+    return a
+
+def carried():
+    """
+    t1 = t1 * 3 + a[i]: the multiply needs the value of the previous iteration
+    """
+    a = assembler()
+    a.addLabel('start')
+    a.storeAssembly('ADDi', t2, zero, 3)
+    a.addLabel('loop')
+    a.storeAssembly('LW', t0, 0, a0)
+    a.storeAssembly('MUL', t1, t1, t2)
+    a.storeAssembly('ADD', t1, t1, t0)
+    a.storeAssembly('ADDi', a0, a0, 4)
+    a.storeAssembly('ADDi', a2, a2, -1)
+    a.storeAssembly('BNE', a2, zero, 'loop')
+    a.addLabel('end')
+    return a
+
+cases = [('in place', array_loop(0, 0, 1), True), ('load ahead', array_loop(1, 0, 1), True),
+         ('recurrence', array_loop(0, 1, 1), False), ('carried', carried(), False)]
+for name, program, vectorized in cases:
+    results = []
+    for vectorize in [False, True]:
+        m = machine(mem_size=1 << 16)
+        program.assemble().load(m, 0)
+        write_words(m, 4096, list(range(-500, 1500)))
+        m.registers[a0], m.registers[a2] = 4096, 1000
+        v = m.enable_vectorizer() if vectorize else None
+        assert(m.execute('start', 'end', engine='block') == 'end')
+        results.append(machine_state(m))
+    plan = v.loops[m.getLabel('loop')]
+    assert(results[0] == results[1] and (plan.runs == 1) == vectorized)
+    print("Test 2: %-10s %s" % (name, 'vectorized' if plan.runs else plan.reason or 'memory checks failed'))
+
+#-------------------------------------------------------------------------------
+# Test 3: end label, instruction counts, snapshots and stores into code
+#-------------------------------------------------------------------------------
+results = []
+for vectorize in [False, True]:
+    m = machine(mem_size=1 << 16)
+    array_loop(0, 0, 0).assemble().load(m, 0)
+    write_words(m, 4096, list(range(1000)))
+    m.registers[a0], m.registers[a2] = 4096, 1000
+    if vectorize:
+        m.enable_vectorizer()
+    m.snapshot()
+    out = [m.execute('start', 'end', 500, engine='block'), m.pc, int(m.registers[a2])]
+    out += [m.execute(None, 'end', engine='block'), int(m.registers[a2]), sorted(m.dirty)]
+    m.restore()
+    out += [m.execute('start', 'loop', engine='block'), int(m.registers[a3])]
+    m.restore()
+    m.registers[a0] = 0                                         # the loop stores into its own code
+    m.registers[a2] = 50
+    out += [m.execute('start', 'end', engine='block'), machine_state(m)]
+    results.append(out)
+assert(results[0] == results[1] and results[1][3] == 'end' and results[1][5] == [1])
+print("Test 3: " + str(results[1][:5]))